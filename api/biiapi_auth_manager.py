@@ -18,14 +18,19 @@ from biicode.common.api.biiapi import BiiAPI
 from biicode.common.utils.bii_logging import logger
 from uuid import getnode as get_mac
 import hashlib
+import threading
 
 
 def input_credentials_if_unauthorized(func):
     """Decorator. Handles AuthenticationException and request user
-    to input a user and a password"""
+    to input a user and a password.
+    Calls can be done from several threads. Login is done by one thread at a time, and
+    calls failed with a token already changed by other thread are just repeated, so the
+    user is asked for credentials only once"""
     LOGIN_RETRIES = 3
 
     def wrapper(self, *args, **kwargs):
+        token = self.rest_client.token
         try:
             # Set custom headers of mac_digest and username
             self.set_custom_headers(self.user)
@@ -33,22 +38,29 @@ def input_credentials_if_unauthorized(func):
         except ForbiddenException as e:
             # User valid but not enough permissions
             logger.debug("Forbidden: %s" % str(e))
-            if self.user is None or self.rest_client.token is None:
-                # token is None when you change user with user command
-                # Anonymous is not enough, ask for a user
-                self.user_io.out.info('Please log in to perform this action. If you don\'t have'
-                                      ' an account sign up here: http://www.biicode.com')
-                if self.user is None:
-                    logger.debug("User None, ask for it, anonymous not enough!")
-                return retry_with_new_token(self, *args, **kwargs)
-            else:
-                # If our user receives a ForbiddenException propagate it, not log with other user
-                raise e
+            with self.login_lock:
+                if self.rest_client.token is not None and self.rest_client.token != token:
+                    # Other thread logged in meanwhile, try with its token
+                    return wrapper(self, *args, **kwargs)
+                if self.user is None or self.rest_client.token is None:
+                    # token is None when you change user with user command
+                    # Anonymous is not enough, ask for a user
+                    self.user_io.out.info('Please log in to perform this action. If you don\'t '
+                                          'have an account sign up here: http://www.biicode.com')
+                    if self.user is None:
+                        logger.debug("User None, ask for it, anonymous not enough!")
+                    return retry_with_new_token(self, *args, **kwargs)
+                else:
+                    # If our user receives a ForbiddenException propagate it, not log with
+                    # other user
+                    raise e
         except AuthenticationException:
             # Token expired or not valid, so clean the token and repeat the call
             # (will be anonymous call but registering who is calling)
-            self._store_login((self.user, None))
-            self.rest_client.token = None
+            with self.login_lock:
+                if self.rest_client.token == token:  # Not already cleaned or renewed
+                    self._store_login((self.user, None))
+                    self.rest_client.token = None
             # Set custom headers of mac_digest and username
             self.set_custom_headers(self.user)
             return wrapper(self, *args, **kwargs)
@@ -87,6 +99,7 @@ class BiiApiAuthManager(BiiAPI):
         self.user_io = user_io
         self.rest_client = rest_client
         self.localdb = localdb
+        self.login_lock = threading.RLock()
         self.user, self.rest_client.token = localdb.get_login()
 
     def _store_login(self, login):
@@ -133,6 +146,22 @@ class BiiApiAuthManager(BiiAPI):
     def get_version_delta_info(self, block_version):
         return self.rest_client.get_version_delta_info(block_version)
 
+    @input_credentials_if_unauthorized
+    def revalidate_version_delta_info(self, block_version, etag=None):
+        return self.rest_client.revalidate_version_delta_info(block_version, etag)
+
+    @input_credentials_if_unauthorized
+    def get_version_delta_infos(self, block_versions):
+        return self.rest_client.get_version_delta_infos(block_versions)
+
+    @input_credentials_if_unauthorized
+    def get_dep_tables(self, block_versions):
+        return self.rest_client.get_dep_tables(block_versions)
+
+    @input_credentials_if_unauthorized
+    def get_cells_snapshots(self, block_versions):
+        return self.rest_client.get_cells_snapshots(block_versions)
+
     @input_credentials_if_unauthorized
     def get_version_by_tag(self, brl_block, version_tag):
         return self.rest_client.get_version_by_tag(brl_block, version_tag)
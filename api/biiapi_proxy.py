@@ -1,55 +1,308 @@
 from biicode.common.utils.bii_logging import logger
 from biicode.common.model.symbolic.reference import References, ReferencedResources
+from biicode.common.model.resource import Resource
 from biicode.common.exception import NotInStoreException, NotFoundException, BiiException
 from biicode.common.api.biiapi import BiiAPI
 from biicode.common.model.version_tag import DEV
+from biicode.common.model.symbolic.block_version import BlockVersion
 from biicode.client.exception import ConnectionErrorException
+from biicode.client.store.lru_cache import LRUCache
+from biicode.client.conf import (BII_MEMORY_CACHE_SIZE, BII_API_THREADS,
+                                 BII_DOWNLOAD_PAGE_SIZE, BII_DEV_REVALIDATION_TTL)
+from multiprocessing.pool import ThreadPool
+import copy
+import time
+
+
+def _get_not_found_refs(requested_refs, found_refs):
+    not_found_refs = References()
+    for block_version, cell_names in requested_refs.iteritems():
+        version_resources = found_refs.get(block_version, {})
+        missing = cell_names.difference(version_resources)
+        if missing:
+            not_found_refs[block_version] = missing
+    return not_found_refs
+
+
+def _copy_resource(resource):
+    '''Copy of a memory cached resource, so callers modifying it don't change the cached
+    one. Blobs are shared, they are never modified in place'''
+    return Resource(copy.deepcopy(resource.cell), copy.copy(resource.content))
+
+
+# Remote calls that can be requested in advance, for many versions at once:
+# kind => (call of one version, batched call of many versions)
+DELTA_INFO = 'delta_info'
+DEP_TABLE = 'dep_table'
+_REMOTE_CALLS = {DELTA_INFO: ('get_version_delta_info', 'get_version_delta_infos'),
+                 DEP_TABLE: ('get_dep_table', 'get_dep_tables')}
+
+
+def _pages(references, page_size):
+    """ Splits references in References of at most page_size cells
+    """
+    page = References()
+    size = 0
+    for block_version, cell_names in references.iteritems():
+        for cell_name in cell_names:
+            page.setdefault(block_version, set()).add(cell_name)
+            size += 1
+            if size == page_size:
+                yield page
+                page = References()
+                size = 0
+    if size:
+        yield page
+
+
+def _call(func, *args):
+    '''Returns (result, None) of calling func, or (None, exception) if it fails, so
+    the exception can be raised later, in other thread'''
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, e
 
 
 class BiiAPIProxy(BiiAPI):
     """Caching in disk BiiAPI implementation
     """
 
-    def __init__(self, localdb, restapi_manager, user_io):
+    def __init__(self, localdb, restapi_manager, user_io, threads=BII_API_THREADS,
+                 page_size=BII_DOWNLOAD_PAGE_SIZE, dev_ttl=BII_DEV_REVALIDATION_TTL):
+        """threads: max number of remote calls done concurrently
+        page_size: max number of files downloaded in each request of published resources
+        dev_ttl: seconds a cached DEV version is used before checking it again with remote
+        """
         self._store = localdb
         self._restapi_manager = restapi_manager
         self._out = user_io.out
         self._dev_versions = {}
         self._retrieved_blocks = set()  # transient, just for output
+        # Already decoded from localdb in this process, most used ones
+        self._snapshots = LRUCache(BII_MEMORY_CACHE_SIZE)  # BlockVersion => [CellName]
+        self._dep_tables = LRUCache(BII_MEMORY_CACHE_SIZE)  # BlockVersion => BlockVersionTable
+        self._resources = LRUCache(BII_MEMORY_CACHE_SIZE)  # Reference => Resource
+        self._threads = threads
+        self._page_size = page_size
+        self._dev_ttl = dev_ttl
+        self.refresh = False  # Check all the cached DEV versions with remote, ignoring dev_ttl
+        # Requested in advance: kind => {BlockVersion: (value, exception)}
+        self._prefetched = {kind: {} for kind in _REMOTE_CALLS}
+        # Dep tables stored in advance, their dependencies not requested yet
+        self._unexpanded_tables = set()
+        self._batch_supported = True  # Older servers don't have batched calls
+        # Working offline: once the server is unreachable (or with --offline), everything
+        # is read from localdb, and remote is not called anymore
+        self._offline_error = None
 
     def _store_login(self, user, token):
         self._store.set_login(user, token)
 
+    def transaction(self):
+        """ Groups all the local cache writes done inside in a single commit
+        """
+        return self._store.transaction()
+
+    def _remove_dev_references(self, block_version):
+        self._store.remove_dev_references(block_version)
+        self._snapshots.invalidate(lambda key: key == block_version)
+        self._dep_tables.invalidate(lambda key: key == block_version)
+        self._resources.invalidate(lambda key: key.block_version == block_version)
+        self._unexpanded_tables.discard(block_version)
+
+    def _fetch_remote(self, kind, block_versions):
+        """ Requests to remote in advance the values of the given kind (DELTA_INFO,
+        DEP_TABLE) of the given versions, so the following _remote_value calls don't need
+        to wait for them one by one. They are requested in a single batched call, or
+        concurrently if the server doesn't support it
+        """
+        prefetched = self._prefetched[kind]
+        pending = [v for v in set(block_versions) if v not in prefetched]
+        if len(pending) < 2 or self._offline_error:
+            return
+        single_call, batched_call = _REMOTE_CALLS[kind]
+        if self._batch_supported and hasattr(self._restapi_manager, batched_call):
+            try:
+                values = getattr(self._restapi_manager, batched_call)(pending)
+            except NotFoundException:
+                logger.debug("Server doesn't support %s, calling for each version"
+                             % batched_call)
+                self._batch_supported = False
+            except ConnectionErrorException as e:
+                self.set_offline(e)
+                return
+            except Exception as e:
+                logger.debug("Error in %s, calling for each version: %s" % (batched_call, e))
+            else:
+                prefetched.update((v, (values[v], None)) for v in pending
+                                  if values.get(v) is not None)
+                # Not returned ones, called one by one to get their error
+                pending = [v for v in pending if v not in prefetched]
+        if len(pending) < 2 or self._threads < 2:
+            return
+        method = getattr(self._restapi_manager, single_call)
+        pool = ThreadPool(min(self._threads, len(pending)))
+        try:
+            results = pool.map(lambda v: _call(method, v), pending)
+        finally:
+            pool.close()
+            pool.join()
+        prefetched.update(zip(pending, results))
+
+    def _store_prefetched(self, block_versions):
+        """ Stores the delta infos and dep tables of the given versions already requested
+        in advance, all of them in a single commit. No remote call is done meanwhile, so the
+        cache is not locked waiting for the server. Failed ones are kept, to raise their
+        error when requested
+        """
+        deltas = self._prefetched[DELTA_INFO]
+        tables = self._prefetched[DEP_TABLE]
+        if not any(v in deltas or v in tables for v in block_versions):
+            return
+        with self.transaction():
+            for block_version in block_versions:
+                if block_version in deltas and deltas[block_version][1] is None:
+                    self.get_version_delta_info(block_version)
+            for block_version in block_versions:
+                # As get_dep_table, only for versions with a valid delta info
+                if (block_version in tables and tables[block_version][1] is None and
+                        self._dev_versions.get(block_version)):
+                    table, _ = tables.pop(block_version)
+                    self._store.set_dep_table(block_version, table)
+                    self._dep_tables.put(block_version, table)
+                    self._unexpanded_tables.add(block_version)
+
+    def _remote_value(self, kind, block_version):
+        try:
+            value, error = self._prefetched[kind].pop(block_version)
+        except KeyError:
+            return self._remote(_REMOTE_CALLS[kind][0], block_version)
+        if error is not None:
+            if isinstance(error, ConnectionErrorException):
+                self.set_offline(error)
+            raise error
+        return value
+
+    def set_offline(self, error):
+        """ Works offline from now on, only with the blocks in localdb
+        param error: ConnectionErrorException, the reason
+        """
+        if self._offline_error is None:
+            self._out.warn("Working offline, only with the blocks in cache, DEV versions "
+                           "might be outdated: %s" % error)
+            self._offline_error = error
+
+    def _check_connection(self):
+        """ Raises the connection error if working offline, not to wait for the server
+        """
+        if self._offline_error:
+            raise self._offline_error
+
+    def _remote(self, method, *args):
+        """ Calls remote, failing fast if working offline. A connection error switches
+        to offline
+        """
+        if self._offline_error:
+            versions = [str(arg) for arg in args if isinstance(arg, BlockVersion)]
+            if versions:
+                method = "%s of %s" % (method, ", ".join(versions))
+            raise ConnectionErrorException("Working offline, can't call %s: %s"
+                                           % (method, self._offline_error))
+        try:
+            return getattr(self._restapi_manager, method)(*args)
+        except ConnectionErrorException as e:
+            self.set_offline(e)
+            raise
+
+    def _is_cached(self, block_version):
+        try:
+            self._store.get_delta_info(block_version)
+            return True
+        except NotInStoreException:
+            return False
+
+    def _needs_remote_delta_info(self, block_version):
+        """ Versions not cached, or DEV ones, which have to be checked with remote
+        """
+        if block_version.time == -1 or block_version in self._dev_versions:
+            return False
+        try:
+            return (self._store.get_delta_info(block_version).tag == DEV and
+                    self._revalidation_due(block_version))
+        except NotInStoreException:
+            return True
+
+    def _revalidation_due(self, block_version):
+        """ Cached DEV versions are checked with remote once every dev_ttl seconds
+        """
+        if self.refresh:
+            return True
+        validated, _ = self._store.get_dev_validation(block_version)
+        return validated is None or time.time() - validated >= self._dev_ttl
+
+    def _revalidate(self, block_version, delta):
+        """ Returns (remote delta, etag) of a cached DEV version. If it was not requested
+        in advance, it is requested conditionally, so an unchanged one is not downloaded
+        """
+        _, etag = self._store.get_dev_validation(block_version)
+        if (block_version in self._prefetched[DELTA_INFO] or
+                not hasattr(self._restapi_manager, 'revalidate_version_delta_info')):
+            ndelta = self._remote_value(DELTA_INFO, block_version)
+            # The stored etag is still the one of an unchanged delta
+            return ndelta, (etag if ndelta == delta else None)
+        ndelta, etag = self._remote('revalidate_version_delta_info', block_version, etag)
+        return (delta if ndelta is None else ndelta), etag
+
+    def print_stats(self):
+        """ Output (only shown with --verbose) of the memory caches usage
+        """
+        self._out.debug("Memory cache of snapshots: %s\n" % self._snapshots)
+        self._out.debug("Memory cache of dependency tables: %s\n" % self._dep_tables)
+        self._out.debug("Memory cache of resources: %s\n" % self._resources)
+
     def check_valid(self, block_versions, publish=True):
         """ This method is used BEFORE publication, to ensure that the parent versions in cache
         are coherent with server ones
         param block_versions: the versions of the PARENTS of the blocks currently under edition
         """
-        invalid_versions = False
+        cached = []
         for block_version in block_versions:
             # Initial versions are always empty, no problem
             if block_version.time == -1:
                 continue
             # if we dont have it cached, no problem
             try:
-                delta = self._store.get_delta_info(block_version)
+                cached.append((block_version, self._store.get_delta_info(block_version)))
             except NotInStoreException:
                 continue
+        self._fetch_remote(DELTA_INFO, (block_version for block_version, _ in cached))
+        invalid_versions = []
+        for block_version, delta in cached:
             try:
-                ndelta = self._restapi_manager.get_version_delta_info(block_version)
+                self._check_connection()
+                ndelta = self._remote_value(DELTA_INFO, block_version)
+            except ConnectionErrorException as e:
+                # Can't be checked, the cached one is kept
+                self.set_offline(e)
+                continue
             except:
                 ndelta = None
             # If the cached delta does not match server one, invalidate cache and warn
             if delta != ndelta:
-                invalid_versions = True
-                self._store.remove_dev_references(block_version)
-                if publish:
-                    self._out.warn("Your ancestor %s in cache doesn't match server one"
-                                   % str(block_version))
-                    self._out.warn("The block %s was probably deleted on server, "
-                                   "the cache has been updated" % block_version.block_name)
-                else:
-                    self._out.info("%s updated in cache" % block_version.to_pretty())
+                invalid_versions.append(block_version)
+        # Written once all the remote checks are done, not to lock the cache meanwhile
+        with self.transaction():
+            for block_version in invalid_versions:
+                self._remove_dev_references(block_version)
+        for block_version in invalid_versions:
+            if publish:
+                self._out.warn("Your ancestor %s in cache doesn't match server one"
+                               % str(block_version))
+                self._out.warn("The block %s was probably deleted on server, "
+                               "the cache has been updated" % block_version.block_name)
+            else:
+                self._out.info("%s updated in cache" % block_version.to_pretty())
         if invalid_versions and publish:
             raise BiiException("There was a cache mismatch due to deleted blocks. You might "
                                "want to check your diff 'bii diff' or just retry")
@@ -62,21 +315,38 @@ class BiiAPIProxy(BiiAPI):
 
     def get_cells_snapshot(self, block_version):
         self.get_version_delta_info(block_version)
-        try:
-            return self._store.get_cells_snapshot(block_version)
-        except NotInStoreException:
-            remote_snap = self._restapi_manager.get_cells_snapshot(block_version)
-            self._store.create_cells_snapshot(block_version, remote_snap)
-            return remote_snap
+        snapshot = self._snapshots.get(block_version)
+        if snapshot is None:
+            try:
+                snapshot = self._store.get_cells_snapshot(block_version)
+            except NotInStoreException:
+                snapshot = self._remote('get_cells_snapshot', block_version)
+                self._store.create_cells_snapshot(block_version, snapshot)
+            self._snapshots.put(block_version, snapshot)
+        # Copied, so callers modifying it don't change the cached one
+        return copy.copy(snapshot)
 
     def get_dep_table(self, block_version):
         if self.get_version_delta_info(block_version):
-            try:
-                return self._store.get_dep_table(block_version)
-            except NotInStoreException:
-                remote_table = self._restapi_manager.get_dep_table(block_version)
-                self._store.set_dep_table(block_version, remote_table)
-                return remote_table
+            table = self._dep_tables.get(block_version)
+            if table is None:
+                try:
+                    table = self._store.get_dep_table(block_version)
+                except NotInStoreException:
+                    table = self._remote_value(DEP_TABLE, block_version)
+                    self._store.set_dep_table(block_version, table)
+                    self._unexpanded_tables.add(block_version)
+                self._dep_tables.put(block_version, table)
+            if block_version in self._unexpanded_tables:
+                self._unexpanded_tables.remove(block_version)
+                # Its dependencies are probably resolved next, request them together
+                dependencies = table.values()
+                self._fetch_remote(DELTA_INFO, (v for v in dependencies
+                                                if self._needs_remote_delta_info(v)))
+                self._fetch_remote(DEP_TABLE, (v for v in dependencies
+                                               if v.time != -1 and not self._is_cached(v)))
+                self._store_prefetched(dependencies)
+            return copy.copy(table)
         else:
             return None
 
@@ -84,16 +354,10 @@ class BiiAPIProxy(BiiAPI):
         '''Returns published resources from given ids
         @param references: list of ids
         '''
-        def _get_not_found_refs(requested_refs, found_refs):
-            not_found_refs = References()
-            for block_version, cell_names in requested_refs.iteritems():
-                version_resources = found_refs.get(block_version, {})
-                missing = cell_names.difference(version_resources)
-                if missing:
-                    not_found_refs[block_version] = missing
-            return not_found_refs
-
         # Read from localDB first, if not present, read from remote and catch!
+        versions = [v for v in references.keys() if self._needs_remote_delta_info(v)]
+        self._fetch_remote(DELTA_INFO, versions)
+        self._store_prefetched(versions)
         for block_version in references.keys():
             try:
                 self.get_version_delta_info(block_version)
@@ -101,25 +365,34 @@ class BiiAPIProxy(BiiAPI):
                 self._out.error("Block %s has been deleted from server"
                                         % str(block_version))
                 references.pop(block_version)
-        local_refs = self._store.get_published_resources(references)
-        not_found_refs = _get_not_found_refs(references, local_refs)
+        memory_refs = ReferencedResources()
+        store_refs = References()
+        for reference in references.explode():
+            resource = self._resources.get(reference)
+            if resource is None:
+                store_refs.setdefault(reference.block_version, set()).add(reference.ref)
+            else:
+                memory_refs[reference.block_version][reference.ref] = _copy_resource(resource)
+
+        local_refs = ReferencedResources()
+        if store_refs:
+            local_refs = self._store.get_published_resources(store_refs)
+        not_found_refs = _get_not_found_refs(store_refs, local_refs)
 
         # Read from remote building references
         remote_refs = ReferencedResources()
         if len(not_found_refs) > 0:
             logger.info("NOT In localdb: %s" % str(not_found_refs))
-            for ref in not_found_refs:
-                if ref.block not in self._retrieved_blocks:
-                    self._out.info("Downloading files from: %s" % ref.block.to_pretty())
-                    self._retrieved_blocks.add(ref.block)
-            remote_refs = self._restapi_manager.get_published_resources(not_found_refs)
-
-        # Cache return in local database (and prepare return)
-        if len(remote_refs) > 0:
-            logger.debug("Remote read: %r" % remote_refs.explode().keys())
-            self._store.create_published_resources(remote_refs)
-
-        all_refs = local_refs + remote_refs
+            if self._offline_error:
+                missing = sorted(str(reference) for reference in not_found_refs.explode())
+                raise ConnectionErrorException("Working offline, these files are not in "
+                                               "cache:\n  %s\n%s" % ("\n  ".join(missing),
+                                                                     self._offline_error))
+            remote_refs = self._download_published_resources(not_found_refs)
+
+        for reference, resource in (local_refs + remote_refs).explode().iteritems():
+            self._resources.put(reference, _copy_resource(resource))
+        all_refs = memory_refs + local_refs + remote_refs
         not_found_refs = _get_not_found_refs(references, all_refs)
         if not_found_refs:
             self._out.error("The following files "
@@ -129,10 +402,46 @@ class BiiAPIProxy(BiiAPI):
 
     def get_renames(self, brl_block, t1, t2):
         '''return a Renames object (i.e. a dict{oldName:newName}'''
-        return self._restapi_manager.get_renames(brl_block, t1, t2)
+        return self._remote('get_renames', brl_block, t1, t2)
 
     def publish(self, publish_request):
-        return self._restapi_manager.publish(publish_request)
+        return self._remote('publish', publish_request)
+
+    def _download_published_resources(self, references):
+        """ Downloads the resources in pages of at most page_size files. Each page is
+        stored in localdb as soon as it is received, so if the connection drops, the
+        already downloaded files are not requested again in the next command
+        """
+        remote_refs = ReferencedResources()
+        pending = {v: len(cell_names) for v, cell_names in references.iteritems()}
+        for page in _pages(references, self._page_size):
+            for block_version in page:
+                if block_version.block not in self._retrieved_blocks:
+                    self._out.info("Downloading files from: %s"
+                                   % block_version.block.to_pretty())
+                    self._retrieved_blocks.add(block_version.block)
+            try:
+                page_refs = self._remote('get_published_resources', page)
+            except ConnectionErrorException:
+                if remote_refs:
+                    self._out.warn("Download interrupted, %d files already stored in "
+                                   "cache. Run the command again to resume it"
+                                   % len(remote_refs.explode()))
+                raise
+            if len(page_refs) > 0:
+                logger.debug("Remote read: %r" % page_refs.explode().keys())
+                self._store.create_published_resources(page_refs)
+                self._store.flush()  # Kept even if a following page fails
+            for block_version, resources in page_refs.iteritems():
+                remote_refs[block_version].update(resources)
+            for block_version, cell_names in page.iteritems():
+                total = len(references[block_version])
+                pending[block_version] -= len(cell_names)
+                if total > self._page_size:
+                    self._out.info("  %s: %d/%d files" % (block_version.to_pretty(),
+                                                          total - pending[block_version],
+                                                          total))
+        return remote_refs
 
     def get_version_delta_info(self, block_version):
         if block_version.time == -1:
@@ -145,44 +454,53 @@ class BiiAPIProxy(BiiAPI):
         assert block_version.time is not None
         try:
             delta = self._store.get_delta_info(block_version)
-            if delta.tag == DEV:
+            if delta.tag == DEV and self._revalidation_due(block_version):
                 try:
-                    ndelta = self._restapi_manager.get_version_delta_info(block_version)
-                    if delta != ndelta:
-                        self._store.remove_dev_references(block_version)
-                        self._store.upsert_delta_info(block_version, ndelta)
-                        delta = ndelta
+                    self._check_connection()
+                    ndelta, etag = self._revalidate(block_version, delta)
+                    with self.transaction():
+                        if delta != ndelta:
+                            self._remove_dev_references(block_version)
+                            self._store.upsert_delta_info(block_version, ndelta)
+                            if ndelta.tag == DEV:
+                                self._out.info("Dev version of %s has been updated"
+                                               % str(block_version))
                         if ndelta.tag == DEV:
-                            self._out.info("Dev version of %s has been updated"
-                                                   % str(block_version))
+                            self._store.set_dev_validation(block_version, etag)
+                    delta = ndelta
                 except (ConnectionErrorException, NotFoundException) as e:
+                    if isinstance(e, ConnectionErrorException):
+                        self.set_offline(e)
                     self._out.warn('You depend on DEV version "%s", but unable to '
                                            'check updates in server: %s'
                                            % (str(block_version), str(e)))
         except NotInStoreException:
-            delta = self._restapi_manager.get_version_delta_info(block_version)
-            if delta.tag == DEV:  # Ensure we delete the references we can have because they can be outdated
-                self._store.remove_dev_references(block_version)
+            delta = self._remote_value(DELTA_INFO, block_version)
+            with self.transaction():
+                if delta.tag == DEV:  # Ensure we delete the references we can have because they can be outdated
+                    self._remove_dev_references(block_version)
 
-            self._store.upsert_delta_info(block_version, delta)
+                self._store.upsert_delta_info(block_version, delta)
+                if delta.tag == DEV:
+                    self._store.set_dev_validation(block_version)
 
         self._dev_versions[block_version] = delta
         return delta
 
     def get_version_by_tag(self, brl_block, version_tag):
-        return self._restapi_manager.get_version_by_tag(brl_block, version_tag)
+        return self._remote('get_version_by_tag', brl_block, version_tag)
 
     def get_block_info(self, brl_block):
-        return self._restapi_manager.get_block_info(brl_block)
+        return self._remote('get_block_info', brl_block)
 
     def find(self, finder_request, response):
-        return self._restapi_manager.find(finder_request, response)
+        return self._remote('find', finder_request, response)
 
     def get_server_info(self):
-        return self._restapi_manager.get_server_info()
+        return self._remote('get_server_info')
 
     def require_auth(self):
-        return self._restapi_manager.require_auth()
+        return self._remote('require_auth')
 
     def authenticate(self, user, password):
-        return self._restapi_manager.authenticate(user, password)
+        return self._remote('authenticate', user, password)
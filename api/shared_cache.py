@@ -0,0 +1,182 @@
+'''
+Second level cache, shared by a team in a directory (can be a network filesystem), between
+the user cache in BiiAPIProxy and the remote BiiAPI. Resources not found in the shared cache
+are retrieved from the remote api and stored in the shared cache for the rest of the team.
+
+Delta infos are always validated with the remote api, and DEV versions that changed are
+removed from the shared cache, so blocks are checked like in BiiAPIProxy
+'''
+import threading
+from biicode.common.utils.bii_logging import logger
+from biicode.common.model.symbolic.reference import References, ReferencedResources
+from biicode.common.exception import NotInStoreException
+from biicode.common.model.version_tag import DEV
+from biicode.client.api.biiapi_proxy import _get_not_found_refs
+
+
+def _shared_write(func):
+    '''Decorator. Other clients may be using the shared cache, or it may be read-only for
+    this user. A failed write in the shared cache must never fail the command'''
+    def wrapper(self, *args, **kwargs):
+        if self._store.read_only:
+            return
+        try:
+            func(self, *args, **kwargs)
+        except Exception as e:
+            logger.warning("Could not write in shared cache %s: %s" % (self._store.dbfile, e))
+    return wrapper
+
+
+class SharedCacheAPI(object):
+
+    def __init__(self, shared_localdb, restapi_manager):
+        self._store = shared_localdb
+        self._restapi_manager = restapi_manager
+        self._validated = set()  # Versions checked with the remote api by this process
+        self._lock = threading.Lock()  # Delta infos can be requested from several threads
+
+    def __getattr__(self, name):
+        '''Everything else is not cached, directly called in remote api'''
+        return getattr(self._restapi_manager, name)
+
+    def _shared_delta(self, block_version):
+        try:
+            return self._store.get_delta_info(block_version)
+        except NotInStoreException:
+            return None
+        except Exception as e:
+            logger.warning("Could not read shared cache %s: %s" % (self._store.dbfile, e))
+            return None
+
+    def _is_valid(self, block_version):
+        '''Shared cached versions can be used if they are not DEV, or if they have been
+        checked in this process'''
+        if block_version in self._validated:
+            return True
+        delta = self._shared_delta(block_version)
+        return delta is not None and delta.tag != DEV
+
+    def _shared_etag(self, block_version):
+        try:
+            return self._store.get_dev_validation(block_version)[1]
+        except Exception as e:
+            logger.warning("Could not read shared cache %s: %s" % (self._store.dbfile, e))
+            return None
+
+    def _validate(self, block_version, delta, etag=None):
+        '''The shared copy of a version just checked with remote is updated if it changed,
+        and used from now on if it matches remote. In read-only shared caches, changed
+        copies can't be updated, so they are not used. The etag of the remote response is
+        stored with the matching copy, to validate it when remote is not modified'''
+        self._update_delta_info(block_version, delta)
+        if self._shared_delta(block_version) == delta:
+            self._validated.add(block_version)
+            if etag is not None:
+                self._shared_call(self._store.set_dev_validation, block_version, etag)
+
+    def get_version_delta_info(self, block_version):
+        delta = self._restapi_manager.get_version_delta_info(block_version)
+        with self._lock:
+            self._validate(block_version, delta)
+        return delta
+
+    def revalidate_version_delta_info(self, block_version, etag=None):
+        delta, new_etag = self._restapi_manager.revalidate_version_delta_info(block_version,
+                                                                              etag)
+        with self._lock:
+            if delta is not None:
+                self._validate(block_version, delta, new_etag)
+            elif etag is not None and self._shared_etag(block_version) == etag:
+                # Not changed since the user cached it, with the response of the shared copy
+                self._validated.add(block_version)
+        return delta, new_etag
+
+    def get_version_delta_infos(self, block_versions):
+        deltas = self._restapi_manager.get_version_delta_infos(block_versions)
+        with self._lock:
+            for block_version, delta in deltas.iteritems():
+                if delta is not None:
+                    self._validate(block_version, delta)
+        return deltas
+
+    @_shared_write
+    def _update_delta_info(self, block_version, delta):
+        try:
+            cached_delta = self._store.get_delta_info(block_version)
+        except NotInStoreException:
+            cached_delta = None
+        if cached_delta != delta:
+            with self._store.transaction():
+                # Cached resources of a changed DEV version are outdated
+                self._store.remove_dev_references(block_version)
+                self._store.upsert_delta_info(block_version, delta)
+
+    def get_cells_snapshot(self, block_version):
+        if self._is_valid(block_version):
+            try:
+                return self._store.get_cells_snapshot(block_version)
+            except NotInStoreException:
+                pass
+        snapshot = self._restapi_manager.get_cells_snapshot(block_version)
+        self._shared_call(self._store.create_cells_snapshot, block_version, snapshot)
+        return snapshot
+
+    def get_dep_table(self, block_version):
+        if self._is_valid(block_version):
+            try:
+                return self._store.get_dep_table(block_version)
+            except NotInStoreException:
+                pass
+        table = self._restapi_manager.get_dep_table(block_version)
+        self._shared_call(self._store.set_dep_table, block_version, table)
+        return table
+
+    def get_dep_tables(self, block_versions):
+        return self._get_many(block_versions, self._store.get_dep_table,
+                              self._restapi_manager.get_dep_tables, self._store.set_dep_table)
+
+    def get_cells_snapshots(self, block_versions):
+        return self._get_many(block_versions, self._store.get_cells_snapshot,
+                              self._restapi_manager.get_cells_snapshots,
+                              self._store.create_cells_snapshot)
+
+    def _get_many(self, block_versions, read, remote_read, write):
+        '''Batched read: reads the valid versions from the shared cache, and the rest of
+        them with a single remote call, storing them for the rest of the team'''
+        result = {}
+        for block_version in block_versions:
+            if self._is_valid(block_version):
+                try:
+                    result[block_version] = read(block_version)
+                except NotInStoreException:
+                    pass
+        missing = [v for v in block_versions if v not in result]
+        if missing:
+            remote = remote_read(missing)
+            for block_version, value in remote.iteritems():
+                if value is not None:
+                    self._shared_call(write, block_version, value)
+            result.update(remote)
+        return result
+
+    def get_published_resources(self, references):
+        valid_refs = References()
+        for block_version, cell_names in references.iteritems():
+            if self._is_valid(block_version):
+                valid_refs[block_version] = cell_names
+        shared_refs = ReferencedResources()
+        if valid_refs:
+            try:
+                shared_refs = self._store.get_published_resources(valid_refs)
+            except Exception as e:
+                logger.warning("Could not read shared cache %s: %s" % (self._store.dbfile, e))
+        not_found_refs = _get_not_found_refs(references, shared_refs)
+        remote_refs = ReferencedResources()
+        if not_found_refs:
+            remote_refs = self._restapi_manager.get_published_resources(not_found_refs)
+            self._shared_call(self._store.create_published_resources, remote_refs)
+        return shared_refs + remote_refs
+
+    @_shared_write
+    def _shared_call(self, method, *args):
+        method(*args)
@@ -199,7 +199,18 @@ class BiiCommand(object):
         ''' ADVANCED Save and process pending changes.'''
         parser = argparse.ArgumentParser(description=self.work.__doc__,
                                          prog="bii work")
-        parser.parse_args(*parameters)  # To enable -h
+        parser.add_argument("--watch", default=False, action='store_true',
+                            help='Keep processing the project when its files change. Build '
+                            'and configure commands of the project will use it, not '
+                            'processing it again')
+        args = parser.parse_args(*parameters)
+        if args.watch:
+            from biicode.client.shell.work_daemon import WorkDaemon
+            try:
+                WorkDaemon(self.bii).serve_forever()
+            except KeyboardInterrupt:
+                self.bii.user_io.out.write('Stopped watching\n')
+            return
         client_hive_manager = ClientHiveManager(self.bii)
         client_hive_manager.work()
         self.bii.user_io.out.write('Work done!\n')
@@ -0,0 +1,80 @@
+import argparse
+import os
+import shutil
+import tempfile
+from biicode.common.output_stream import Color
+from biicode.client.store.cache_bundle import write_bundle, read_bundle
+
+
+def _size(num_bytes):
+    for unit in ('B', 'KB', 'MB'):
+        if num_bytes < 1024:
+            return '%.1f %s' % (num_bytes, unit)
+        num_bytes /= 1024.0
+    return '%.1f GB' % num_bytes
+
+
+class CacheCommands(object):
+    '''Manage the user cache of published blocks'''
+    group = 'cache'
+
+    def __init__(self, bii):
+        self.bii = bii
+
+    def info(self, *parameters):
+        '''Show the size and contents deduplication of the user cache'''
+        parser = argparse.ArgumentParser(description=self.info.__doc__,
+                                         prog="bii %s:info" % self.group)
+        parser.parse_args(*parameters)  # for -h
+        localdb = self.bii.user_cache.localdb
+        stats = localdb.contents_stats()
+        out = self.bii.user_io.out
+        out.writeln('User cache: %s' % localdb.dbfile, Color.BRIGHT_GREEN)
+        out.writeln('  Size on disk: %s' % _size(stats['db_size']))
+        out.writeln('  Published contents: %d (%d unique, dedup ratio %.2f)'
+                    % (stats['contents'], stats['unique_contents'], stats['dedup_ratio']))
+        out.writeln('  Contents size: %s, stored compressed: %s'
+                    % (_size(stats['contents_size']), _size(stats['stored_size'])))
+
+    def export(self, *parameters):
+        '''Export cached block versions to a bundle file, to be imported in other caches'''
+        parser = argparse.ArgumentParser(description=self.export.__doc__,
+                                         prog="bii %s:export" % self.group)
+        parser.add_argument("bundle", help="Bundle file to write")
+        parser.add_argument("blocks", nargs="*",
+                            help="Blocks to export all their cached versions, "
+                                 "e.g. 'user/block'. By default, the whole cache")
+        args = parser.parse_args(*parameters)
+        localdb = self.bii.user_cache.localdb
+        versions = localdb.cached_versions()
+        if args.blocks:
+            versions = {key: version for key, version in versions.iteritems()
+                        if str(version.block_name) in args.blocks}
+        tmp_folder = tempfile.mkdtemp(suffix='biicode')
+        try:
+            dbfile = os.path.join(tmp_folder, 'bundle.db')
+            localdb.export_versions(dbfile, versions.keys())
+            write_bundle(dbfile, args.bundle)
+        finally:
+            shutil.rmtree(tmp_folder)
+        self.bii.user_io.out.success('Exported %d block versions to %s'
+                                     % (len(versions), args.bundle))
+
+    def _import(self, *parameters):
+        '''Import in the cache the block versions of a bundle file created with export'''
+        parser = argparse.ArgumentParser(description=self._import.__doc__,
+                                         prog="bii %s:import" % self.group)
+        parser.add_argument("bundle", help="Bundle file to read")
+        args = parser.parse_args(*parameters)
+        tmp_folder = tempfile.mkdtemp(suffix='biicode')
+        try:
+            dbfile = os.path.join(tmp_folder, 'bundle.db')
+            read_bundle(args.bundle, dbfile)
+            imported = self.bii.user_cache.localdb.import_versions(dbfile)
+        finally:
+            shutil.rmtree(tmp_folder)
+        self.bii.user_io.out.success('Imported %d new block versions from %s'
+                                     % (imported, args.bundle))
+
+# "import" is a python keyword, can't be the name of the method
+setattr(CacheCommands, 'import', CacheCommands._import)
@@ -2,7 +2,8 @@ import sys
 from biicode.common.exception import BiiException
 from biicode.client.command.biicommand import BiiCommand
 from biicode.common.utils.bii_logging import logger
-from biicode.client.exception import NotInAHiveException, ClientException
+from biicode.client.exception import (NotInAHiveException, ClientException,
+                                      ConnectionErrorException)
 from biicode.client.migrations.migration_launcher import launch as migration_launch
 import traceback
 from biicode.common.output_stream import WARN, DEBUG
@@ -26,6 +27,15 @@ class ToolExecutor(object):
             elif '--verbose' in argv:
                 argv.remove('--verbose')
                 self.bii.user_io.out.level = DEBUG
+            if '--refresh' in argv:
+                argv.remove('--refresh')
+                self.bii.biiapi.refresh = True
+            if '--stats' in argv:
+                argv.remove('--stats')
+                self.bii.show_stats = True
+            if '--offline' in argv:
+                argv.remove('--offline')
+                self.bii.biiapi.set_offline(ConnectionErrorException('--offline option'))
 
             command = argv[0]
             if command == '--help' or command == '-h':
@@ -20,7 +20,14 @@ class ToolCatalog(dict):
         out.writeln('For help about a command:', Color.YELLOW)
         out.writeln('    $ bii COMMAND --help')
         out.write('To change verbosity, use options ', Color.YELLOW)
-        out.writeln('--quiet --verbose\n')
+        out.writeln('--quiet --verbose')
+        out.write('To check all cached DEV versions with the server, use option ', Color.YELLOW)
+        out.writeln('--refresh')
+        out.write('To work only with the blocks in cache, without network, use option ',
+                  Color.YELLOW)
+        out.writeln('--offline')
+        out.write('To show a summary of the calls to the server, use option ', Color.YELLOW)
+        out.writeln('--stats\n')
 
         if not argv or 'all' in argv:
             out.writeln('--------- Global Commands ----------', Color.YELLOW)
@@ -4,3 +4,78 @@ from biicode.common.conf.configure_environment import get_env
 from biicode.common.conf import MEGABYTE
 
 BII_RESTURL = get_env('BII_RESTURL', 'https://biiserverproduction.herokuapp.com')
+# Work without connecting to the server, only with the blocks in the user cache (as the
+# --offline option), e.g. in build machines without network access
+BII_OFFLINE = get_env('BII_OFFLINE', False)
+
+# Local databases (user cache bii.db and project .hive.db)
+# Journal mode of the user cache, WAL allows concurrent bii processes. Use DELETE for
+# network filesystems without shared memory support
+BII_DB_JOURNAL_MODE = get_env('BII_DB_JOURNAL_MODE', 'WAL')
+BII_DB_BUSY_TIMEOUT = float(get_env('BII_DB_BUSY_TIMEOUT', 30))  # seconds waiting for a lock
+BII_DB_BUSY_RETRIES = int(get_env('BII_DB_BUSY_RETRIES', 5))  # retries after busy timeout
+BII_DB_CACHE_SIZE = int(get_env('BII_DB_CACHE_SIZE', 8 * 1024))  # page cache in KiB
+BII_DB_MMAP_SIZE = int(get_env('BII_DB_MMAP_SIZE', 64 * MEGABYTE))
+
+# Size bounded user cache. When bigger than BII_CACHE_MAX_SIZE (MB, 0 is unbounded), the
+# least recently used block versions are evicted at the end of the commands, for at most
+# BII_CACHE_EVICTION_TIME seconds, returning up to BII_CACHE_VACUUM_PAGES pages to disk
+BII_CACHE_MAX_SIZE = int(get_env('BII_CACHE_MAX_SIZE', 1024)) * MEGABYTE
+BII_CACHE_EVICTION_TIME = float(get_env('BII_CACHE_EVICTION_TIME', 0.5))
+BII_CACHE_VACUUM_PAGES = int(get_env('BII_CACHE_VACUUM_PAGES', 2048))
+
+# Cached DEV versions are checked with the server at most once every
+# BII_DEV_REVALIDATION_TTL seconds (0 checks them in every command, as --refresh)
+BII_DEV_REVALIDATION_TTL = float(get_env('BII_DEV_REVALIDATION_TTL', 60))
+
+# Max number of snapshots, dependency tables and resources kept decoded in memory
+# for the duration of a command
+BII_MEMORY_CACHE_SIZE = int(get_env('BII_MEMORY_CACHE_SIZE', 10000))
+
+# Folder of a cache shared by a team (can be in a network filesystem), to retrieve the
+# resources not found in the user cache before downloading them. Empty to disable it
+BII_SHARED_CACHE = get_env('BII_SHARED_CACHE', '')
+
+# File to dump, at the end of each command, a JSON trace of the calls to the server
+BII_REST_TRACE = get_env('BII_REST_TRACE', '')
+
+# Connections kept alive to the server, number of hosts and connections for each host
+BII_HTTP_POOL_CONNECTIONS = int(get_env('BII_HTTP_POOL_CONNECTIONS', 4))
+BII_HTTP_POOL_MAXSIZE = int(get_env('BII_HTTP_POOL_MAXSIZE', 10))
+
+# Timeout (seconds) of the calls to the server. Specific calls can have their own
+# timeout, e.g. BII_HTTP_TIMEOUTS="publish=120,get_published_resources=60"
+BII_HTTP_TIMEOUT = float(get_env('BII_HTTP_TIMEOUT', 15))
+BII_HTTP_TIMEOUTS = dict((name.strip(), float(value)) for name, value in
+                         (item.split('=') for item in get_env('BII_HTTP_TIMEOUTS', '').split(',')
+                          if item.strip()))
+
+# Idempotent calls failing to connect are retried up to BII_HTTP_RETRIES times, waiting
+# a random time up to BII_HTTP_BACKOFF * 2^retry seconds. After BII_HTTP_MAX_FAILURES
+# consecutive failures, calls fail without connecting for BII_HTTP_RESET_TIME seconds
+BII_HTTP_RETRIES = int(get_env('BII_HTTP_RETRIES', 3))
+BII_HTTP_BACKOFF = float(get_env('BII_HTTP_BACKOFF', 0.5))
+BII_HTTP_MAX_FAILURES = int(get_env('BII_HTTP_MAX_FAILURES', 5))
+BII_HTTP_RESET_TIME = float(get_env('BII_HTTP_RESET_TIME', 30))
+
+# Request bodies of at least this size (bytes) are sent gzip compressed, if the server
+# accepts them. 0 disables the compression of requests
+BII_HTTP_COMPRESS_MIN_SIZE = int(get_env('BII_HTTP_COMPRESS_MIN_SIZE', 1024))
+
+# Max number of concurrent calls to the server, e.g. checking many versions
+BII_API_THREADS = int(get_env('BII_API_THREADS', 8))
+
+# Max number of files downloaded in each request of published resources. Each page is
+# stored in the user cache as soon as it is received, so an interrupted download is resumed
+BII_DOWNLOAD_PAGE_SIZE = int(get_env('BII_DOWNLOAD_PAGE_SIZE', 500))
+
+# Keep in the project database the stat and content of scanned files, so next scans only
+# read from disk the files whose size, mtime or inode changed
+BII_SCAN_MANIFEST = get_env('BII_SCAN_MANIFEST', True)
+# Threads reading the files of the project scan. 1 reads them sequentially
+BII_WALK_THREADS = int(get_env('BII_WALK_THREADS', 8))
+
+# "bii work --watch" daemon. Seconds between checks of changed files, and whether other
+# commands of the project (build, configure) use the daemon processed project when running
+BII_WATCH_INTERVAL = float(get_env('BII_WATCH_INTERVAL', 0.5))
+BII_WORK_DAEMON = get_env('BII_WORK_DAEMON', True)
@@ -4,6 +4,7 @@ from biicode.client.command.process_executor import simple_exe
 from biicode.common.exception import BiiException
 from biicode.client.dev.cmake.cmaketool import KEEP_CURRENT_TOOLCHAIN, ctest_command, cmake_command
 from biicode.client.client_hive_manager import ClientHiveManager
+from biicode.client.shell.work_daemon import request_prepare
 import platform
 from biicode.client.command.context_manager import CustomEnvPath
 import re
@@ -86,12 +87,18 @@ class CMakeToolChain(object):
         paths_to_add = self.prepare_build_path()
         cmds_to_remove = self.prepare_configure_cmds(generator)
         with CustomEnvPath(paths_to_add=paths_to_add, cmds_to_remove=cmds_to_remove):
-            client_hive_manager = ClientHiveManager(self.bii)
-            client_hive_manager.work()
-            base = self.target_processor(client_hive_manager)
-            block_targets = base.targets()
             cmake = self.cmake(self.bii)
-            cmake.configure(block_targets, force, generator, toolchain, parameters)
+            # A "bii work --watch" daemon already has the project processed
+            prepared = request_prepare(self.bii, self.group, generator, toolchain)
+            if prepared is None:
+                client_hive_manager = ClientHiveManager(self.bii)
+                client_hive_manager.work()
+                base = self.target_processor(client_hive_manager)
+                block_targets = base.targets()
+                prepared = cmake.prepare(block_targets, generator, toolchain)
+            toolchain_file, regenerate = prepared
+            if regenerate or force:
+                cmake.generate_project(toolchain_file, parameters)
 
     def configure(self, *parameters):
         '''Configure project with cmake'''
@@ -55,15 +55,23 @@ class CMakeTool(object):
         param generator: CMake generator
         param toolchain: the name of the file containing toolchain. eg. bii/toolchain_xxx.cmake
         '''
+        toolchain_file, regenerate = self.prepare(block_targets, generator, toolchain)
+        if regenerate or force:
+            self.generate_project(toolchain_file, parameters)
 
+    def prepare(self, block_targets, generator, toolchain):
+        '''writes the CMake files of the project, without invoking CMake
+        return: (toolchain file, True if CMake has to generate the project again)
+        '''
         # If we have re-written CMake files or the CMakeCache does not exist (probably deleted
         # because of a change of settings), the call cmake generator
         self._handle_generator(generator)
-        force = force or not os.path.exists(os.path.join(self.bii_paths.build, 'CMakeCache.txt'))
+        cmake_cache = os.path.join(self.bii_paths.build, 'CMakeCache.txt')
+        regenerate = not os.path.exists(cmake_cache)
         toolchain_file = self._handle_toolchain(toolchain)
-        force = force or not os.path.exists(os.path.join(self.bii_paths.build, 'CMakeCache.txt'))
-        if self._create_cmakelists(block_targets) or force:
-            self._generate_project(toolchain_file, parameters)
+        regenerate = regenerate or not os.path.exists(cmake_cache)
+        regenerate = self._create_cmakelists(block_targets) or regenerate
+        return toolchain_file, regenerate
 
     @abstractmethod
     def _create_cmakelists(self, targets):
@@ -134,7 +142,7 @@ class CMakeTool(object):
                     settings.cmake.generator = "Unix Makefiles"
                 hive_disk_image.settings = settings
 
-    def _generate_project(self, toolchain_file, parameters):
+    def generate_project(self, toolchain_file, parameters):
         '''runs CMake to generate Makefiles or Project'''
         # Obtain generator
         settings = self.hive_disk_image.settings
@@ -34,9 +34,21 @@ class MigrateToFirstVersion(Migration):
                     save(file_path, '*%s' % version.to_pretty())
 
 
+class MigrateBlobCodec(Migration):
+    '''CONVERTS repr() TEXT VALUES OF PROJECT AND USER CACHE DATABASES TO BINARY BLOBS'''
+
+    def migrate(self, *args, **kwargs):
+        from biicode.client.store import hivedb, localdb
+        bii = args[0]
+        bii.hive_disk_image.hivedb.migrate_legacy_blobs(hivedb.BLOB_TABLES)
+        # User cache is shared by all projects, already converted rows are skipped
+        bii.user_cache.localdb.migrate_legacy_blobs(localdb.BLOB_TABLES)
+
+
 def get_client_migrations():
     # DO NOT DELETE **NEVER** ELEMENTS IN THIS LIST. ONLY APPEND NEW MIGRATIONS!!
     return [
             MigrateArduinoSettings(),
             MigrateToFirstVersion(),
+            MigrateBlobCodec(),
     ]
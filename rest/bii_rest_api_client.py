@@ -1,4 +1,8 @@
-from biicode.client.rest.rest_api import RestApiClient
+from biicode.client.rest.rest_api import RestApiClient, pooled_session, CircuitBreaker
+from biicode.client.conf import (BII_HTTP_POOL_CONNECTIONS, BII_HTTP_POOL_MAXSIZE,
+                                 BII_HTTP_COMPRESS_MIN_SIZE, BII_HTTP_TIMEOUT,
+                                 BII_HTTP_TIMEOUTS, BII_HTTP_RETRIES, BII_HTTP_BACKOFF,
+                                 BII_HTTP_MAX_FAILURES, BII_HTTP_RESET_TIME)
 from biicode.common.utils.serializer import Serializer, ListDeserializer
 from biicode.common.exception import BiiServiceException
 from biicode.common.model.symbolic.block_version_table import BlockVersionTable
@@ -23,6 +27,33 @@ from biicode.client.rest.rest_api import JWTAuth
 from requests.auth import HTTPBasicAuth
 from biicode.common.utils.bson_encoding import decode_bson, encode_bson
 from biicode.common.api.ui import BiiResponse
+from biicode.client.exception import ConnectionErrorException
+import time
+import zlib
+
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip format
+    return compressor.compress(data) + compressor.flush()
+
+
+def accepts_gzip(res):
+    '''Servers advertise the encodings they accept in requests with the Accept-Encoding
+    header of their responses (RFC 7694)'''
+    return 'gzip' in res.headers.get('accept-encoding', '')
+
+
+class BatchDeserializer(object):
+    '''Deserializes the [[block_version, value], ...] return of batched calls to a dict
+    {BlockVersion: value}. Value is None for the versions not found or not allowed'''
+
+    def __init__(self, value_deserializer):
+        self.value_deserializer = value_deserializer
+
+    def deserialize(self, data):
+        return {BlockVersion.deserialize(block_version):
+                None if value is None else self.value_deserializer.deserialize(value)
+                for block_version, value in data}
 
 
 class BiiRestApiClient(RestApiClient, BiiAPI):
@@ -36,31 +67,51 @@ class BiiRestApiClient(RestApiClient, BiiAPI):
     version = "v1"
 
     authorized_functions = {
-        'get_published_resources': {'pattern': '/get_published_resources', 'method': "POST"},
+        'get_published_resources': {'pattern': '/get_published_resources', 'method': "POST",
+                                    'idempotent': True},
         'publish': {'pattern': '/publish', 'method': "POST"},
         'upload': {'pattern': '/upload', 'method': "POST"},
         'require_auth': {'pattern': '/require_auth', 'method': "GET"},
         'get_dep_table': {'pattern': '/users/:user_name/blocks/:block_name/branches/:branch_name/versions/:version/block_version_table/',
                           'method': "GET"},
-        'get_cells_snapshot': {'pattern': '/cells_snapshot', 'method': "POST"},
-        'find': {'pattern': '/finder_result', 'method': "POST"},
-        'diff': {'pattern': '/diff', 'method': "POST"},
-        'get_renames': {'pattern': '/renames', 'method': "POST"},
+        'get_cells_snapshot': {'pattern': '/cells_snapshot', 'method': "POST", 'idempotent': True},
+        'find': {'pattern': '/finder_result', 'method': "POST", 'idempotent': True},
+        'diff': {'pattern': '/diff', 'method': "POST", 'idempotent': True},
+        'get_renames': {'pattern': '/renames', 'method': "POST", 'idempotent': True},
         'get_block_info': {'pattern': '/users/:user_name/blocks/:block_name/branches/:branch_name/info', 'method': "GET"},
-        'get_server_info': {'pattern': '/get_server_info', 'method': "POST"},
+        # Just checks for updates, must not delay commands, not retried
+        'get_server_info': {'pattern': '/get_server_info', 'method': "POST", 'timeout': 1},
         'authenticate': {'pattern': '/authenticate', 'method': "GET"},  # Sends user and password by basic http, other methods sends user + token
         'get_version_delta_info': {'pattern': '/users/:user_name/blocks/:block_name/branches/:branch_name/version/:version/delta_info', 'method': "GET"},
         'get_version_by_tag': {'pattern': '/users/:user_name/blocks/:block_name/branches/:branch_name/tag/:tag', 'method': "GET"},
+        # Batched calls, many versions at once
+        'get_version_delta_infos': {'pattern': '/version_delta_infos', 'method': "POST",
+                                    'idempotent': True},
+        'get_dep_tables': {'pattern': '/block_version_tables', 'method': "POST",
+                           'idempotent': True},
+        'get_cells_snapshots': {'pattern': '/cells_snapshots', 'method': "POST",
+                                'idempotent': True},
       }
 
     def __init__(self, base_url):
         self.base_url = base_url
         self.token = None  # Anonymous until setted
         self.custom_headers = {}  # Can set custom headers to each request
+        # Not until the server says it accepts them, older servers don't
+        self.compress_requests = False
+        self.call_hook = None  # Called with a dict describing each call, see rest_stats
         logger.debug("Init rest api client pointing to: %s" % self.base_url)
         super(BiiRestApiClient, self).__init__(
                                    self.base_url + "/" + BiiRestApiClient.version,
-                                   self.authorized_functions)
+                                   self.authorized_functions,
+                                   timeout=BII_HTTP_TIMEOUT,
+                                   session=pooled_session(BII_HTTP_POOL_CONNECTIONS,
+                                                          BII_HTTP_POOL_MAXSIZE),
+                                   timeouts=BII_HTTP_TIMEOUTS,
+                                   retries=BII_HTTP_RETRIES,
+                                   backoff=BII_HTTP_BACKOFF,
+                                   circuit_breaker=CircuitBreaker(BII_HTTP_MAX_FAILURES,
+                                                                  BII_HTTP_RESET_TIME))
 
     ################### REST METHODS ########################
     def get_published_resources(self, references):
@@ -119,14 +170,31 @@ class BiiRestApiClient(RestApiClient, BiiAPI):
 
     def get_version_delta_info(self, block_version):
         """Returns the last blockversion"""
-        brl, time, _ = block_version
-        url_params = {"user_name": brl.owner,
-                      "block_name": brl.block_name,
-                      "branch_name": brl.branch,
-                      "version": time
-                      }
         return self.bson_jwt_call('get_version_delta_info',
-                                     url_params=url_params, deserializer=BlockDelta)
+                                  url_params=self._delta_info_params(block_version),
+                                  deserializer=BlockDelta)
+
+    def revalidate_version_delta_info(self, block_version, etag=None):
+        """Conditional get_version_delta_info, returns (BlockDelta, etag). BlockDelta is
+        None if it didn't change since the response with the given etag (304 Not Modified).
+        Servers without ETags always return the BlockDelta, and etag None"""
+        headers = {'If-None-Match': etag} if etag else None
+        res = self.bson_jwt_call('get_version_delta_info',
+                                 url_params=self._delta_info_params(block_version),
+                                 headers=headers, raw=True)
+        if res.status_code == 304:
+            return None, etag
+        delta = BiiRestApiClient.deserialize_return(res, BlockDelta)
+        return delta, res.headers.get('etag')
+
+    @staticmethod
+    def _delta_info_params(block_version):
+        brl, time, _ = block_version
+        return {"user_name": brl.owner,
+                "block_name": brl.block_name,
+                "branch_name": brl.branch,
+                "version": time
+                }
 
     def get_version_by_tag(self, brl_block, version_tag):
         """Given a BlockVersion that has a tag but not a time returns a complete BlockVersion"""
@@ -139,6 +207,24 @@ class BiiRestApiClient(RestApiClient, BiiAPI):
         return self.bson_jwt_call('get_version_by_tag',
                                   url_params=url_params, deserializer=BlockVersion)
 
+    def get_version_delta_infos(self, block_versions):
+        """Returns {BlockVersion: BlockDelta}"""
+        return self._batch_call('get_version_delta_infos', block_versions, BlockDelta)
+
+    def get_dep_tables(self, block_versions):
+        """Returns {BlockVersion: BlockVersionTable}"""
+        return self._batch_call('get_dep_tables', block_versions, BlockVersionTable)
+
+    def get_cells_snapshots(self, block_versions):
+        """Returns {BlockVersion: [CellName]}"""
+        return self._batch_call('get_cells_snapshots', block_versions,
+                                ListDeserializer(CellName))
+
+    def _batch_call(self, function_name, block_versions, value_deserializer):
+        data = Serializer().build(("data", list(block_versions)))
+        return self.bson_jwt_call(function_name, data=data,
+                                  deserializer=BatchDeserializer(value_deserializer))
+
     def get_server_info(self):
         """Gets a ServerInfo and sends os_info + client version to server"""
         os_info = OSInfo.capture()
@@ -146,7 +232,7 @@ class BiiRestApiClient(RestApiClient, BiiAPI):
         data = (os_info, str(__version__))
         serialized_data = Serializer().build(("data", data))
         info = self.bson_jwt_call('get_server_info', data=serialized_data,
-                                  deserializer=ServerInfo, timeout=1)
+                                  deserializer=ServerInfo)
         return info
 
     def require_auth(self):
@@ -160,18 +246,21 @@ class BiiRestApiClient(RestApiClient, BiiAPI):
 
     ################### END REST METHODS ########################
     def bson_jwt_call(self, function_name, deserializer=None, url_params={}, data=None,
-                      headers=None, response=None, timeout=None):
+                      headers=None, response=None, timeout=None, raw=False):
         # If we dont have token, send without jwtauth (anonymous)
         logger.debug("JWT Call %s" % str(function_name))
         auth = JWTAuth(self.token) if self.token else None
         headers = headers or {}
         headers.update(self.custom_headers)
         headers['Content-Type'] = 'application/bson'
+        headers['Accept-Encoding'] = 'gzip'
 
+        encode_start = time.time()
         if data is not None:
             data = str(encode_bson(data))
         return self.call(function_name, url_params=url_params, data=data, headers=headers,
-                         auth=auth, deserializer=deserializer, response=response, timeout=timeout)
+                         auth=auth, deserializer=deserializer, response=response, timeout=timeout,
+                         raw=raw, encode_time=time.time() - encode_start)
 
     def basic_auth_call(self, user, password, function_name, url_params={},
                         data=None, headers=None, deserializer=None):
@@ -180,11 +269,70 @@ class BiiRestApiClient(RestApiClient, BiiAPI):
                          data=data, headers=headers, auth=auth,
                          deserializer=deserializer)
 
-    def call(self, *args, **kwargs):
+    def call(self, function_name, **kwargs):
         deserializer = kwargs.pop("deserializer", None)
         response = kwargs.pop("response", None)
-        ret = super(BiiRestApiClient, self).call(*args, **kwargs)
-        return BiiRestApiClient.deserialize_return(ret, deserializer, response)
+        raw = kwargs.pop("raw", False)  # Return the requests response, not deserialized
+        data = kwargs.get("data")
+        record = {'function': function_name,
+                  'url_params': {k: str(v) for k, v in (kwargs.get("url_params") or {}).items()},
+                  'start': time.time(),
+                  'encode_time': kwargs.pop("encode_time", 0),
+                  'decode_time': 0,
+                  'request_bytes': len(data or ''),
+                  'sent_bytes': len(data or ''),
+                  'response_bytes': 0,
+                  'received_bytes': 0,
+                  'status': None}
+        try:
+            ret = self._send(function_name, data, kwargs, record)
+        except ConnectionErrorException:
+            record['latency'] = time.time() - record['start']
+            self._record(record)
+            raise
+        record['latency'] = time.time() - record['start']
+        record['status'] = ret.status_code
+        # Responses are uncompressed by requests while read, Content-Length is the
+        # compressed size
+        record['response_bytes'] = len(ret.content)
+        record['received_bytes'] = int(ret.headers.get('content-length',
+                                                       record['response_bytes']))
+        if raw:
+            self._record(record)
+            return ret
+        try:
+            return BiiRestApiClient.deserialize_return(ret, deserializer, response)
+        finally:
+            record['decode_time'] = time.time() - record['start'] - record['latency']
+            self._record(record)
+
+    def _send(self, function_name, data, kwargs, record):
+        if self._compress(data):
+            sent = gzip_compress(data)
+            record['sent_bytes'] = len(sent)
+            headers = dict(kwargs.get("headers") or {})
+            headers['Content-Encoding'] = 'gzip'
+            ret = super(BiiRestApiClient, self).call(function_name, **dict(kwargs, data=sent,
+                                                                          headers=headers))
+            if ret.status_code == 415:  # Unsupported Media Type, send it again uncompressed
+                self.compress_requests = False
+                record['sent_bytes'] = record['request_bytes']
+                ret = super(BiiRestApiClient, self).call(function_name, **kwargs)
+        else:
+            ret = super(BiiRestApiClient, self).call(function_name, **kwargs)
+        self.compress_requests = accepts_gzip(ret)
+        return ret
+
+    def _compress(self, data):
+        return (self.compress_requests and BII_HTTP_COMPRESS_MIN_SIZE > 0 and
+                data is not None and len(data) >= BII_HTTP_COMPRESS_MIN_SIZE)
+
+    def _record(self, record):
+        logger.debug("%(function)s: status %(status)s in %(latency).3fs, sent %(sent_bytes)d "
+                     "bytes (%(request_bytes)d uncompressed), received %(received_bytes)d "
+                     "bytes (%(response_bytes)d uncompressed)" % record)
+        if self.call_hook is not None:
+            self.call_hook(record)
 
     @staticmethod
     def decode_return_content(res, response=None):
@@ -2,8 +2,12 @@ import requests
 from biicode.common.settings.fixed_string import FixedStringWithValue
 from biicode.client.exception import BiiException, ConnectionErrorException
 from requests.auth import AuthBase
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout
 import urllib
+import random
+import threading
+import time
 from biicode.common.utils.bii_logging import logger
 
 
@@ -43,6 +47,62 @@ class HttpRequestsLibMethod(FixedStringWithValue):
               'OPTIONS': requests.options, 'DELETE': requests.delete}
 
 
+def pooled_session(pool_connections, pool_maxsize):
+    """Session keeping alive the connections, so consecutive requests to the same host
+    don't open a new TCP (and TLS) connection each one
+    param pool_connections: number of hosts with connections kept
+    param pool_maxsize: max number of connections kept for each host
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class CircuitBreaker(object):
+    """After max_failures consecutive connection failures, calls fail without connecting
+    (the circuit is open) for reset_time seconds. Then calls are tried again: the first
+    success closes the circuit, a failure opens it again
+    """
+
+    def __init__(self, max_failures, reset_time):
+        self.max_failures = max_failures
+        self.reset_time = reset_time
+        self._failures = 0
+        self._opened = None  # time it was opened
+        self._lock = threading.Lock()  # Calls can be done from several threads
+
+    def allow(self):
+        with self._lock:
+            if self._opened is None:
+                return True
+            if time.time() - self._opened < self.reset_time:
+                return False
+            # Half open, a single failure opens it again
+            self._opened = None
+            self._failures = self.max_failures - 1
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.max_failures and self._opened is None:
+                self._opened = time.time()
+                logger.debug("%d consecutive connection failures, circuit opened for %ss"
+                             % (self._failures, self.reset_time))
+
+
+def backoff_time(backoff, retry):
+    """Random (jitter), so clients failing at the same time don't retry at the same time"""
+    return random.uniform(0, backoff * 2 ** retry)
+
+
 class JWTAuth(AuthBase):
     """Attaches JWT Authentication to the given Request object."""
     def __init__(self, token):
@@ -56,9 +116,19 @@ class JWTAuth(AuthBase):
 class RestApiClient(object):
 
     DEFAULT_TIMEOUT = 15
+    # Calls that can be repeated without side effects, others have to define 'idempotent'
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
 
     def __init__(self, base_url, authorized_methods,
-                 http_lib_methods=HttpRequestsLibMethod, timeout=None, proxies=None, verify=False):
+                 http_lib_methods=HttpRequestsLibMethod, timeout=None, proxies=None, verify=False,
+                 session=None, timeouts=None, retries=0, backoff=0, circuit_breaker=None):
+        """session: requests.Session to make the calls with, reusing its connections.
+        If None, http_lib_methods are called, opening a connection each call
+        timeouts: {function_name: timeout}, overriding the 'timeout' of authorized_methods
+        retries: times an idempotent call is retried after failing to connect, waiting
+        a random time up to backoff * 2^retry seconds
+        circuit_breaker: CircuitBreaker to fail fast when the server is unreachable
+        """
 
         self.base_url = base_url
         self.authorized_methods = authorized_methods
@@ -66,6 +136,11 @@ class RestApiClient(object):
         self.proxies = proxies or urllib.getproxies()
         self.verify = verify
         self.http_lib_methods = http_lib_methods
+        self.session = session
+        self.timeouts = timeouts or {}
+        self.retries = retries
+        self.backoff = backoff
+        self.circuit_breaker = circuit_breaker
         assert(isinstance(self.http_lib_methods, FixedStringWithValue.__class__))
 
     def call(self, function_name, url_params=None, params=None, data=None, auth=None,
@@ -75,17 +150,47 @@ class RestApiClient(object):
         method = self._get_method(function_name)
         pattern = self._get_pattern(function_name)
         url = self._get_url(pattern, url_params)
+        timeout = timeout or self._get_timeout(function_name)
+        retries = self.retries if self._is_idempotent(function_name) else 0
+        for retry in range(retries + 1):
+            if retry:
+                wait = backoff_time(self.backoff, retry - 1)
+                logger.debug("Retrying %s in %.2fs" % (function_name, wait))
+                time.sleep(wait)
+            if self.circuit_breaker and not self.circuit_breaker.allow():
+                raise ConnectionErrorException("Can't connect to biicode, too many failed "
+                                               "connections. Retrying in %ss"
+                                               % self.circuit_breaker.reset_time)
+            try:
+                ret = method(url, params=params, data=data, auth=auth, headers=headers,
+                             verify=self.verify, timeout=timeout, proxies=self.proxies)
+            except (ConnectionError, Timeout) as e:
+                logger.debug(str(e))
+                if self.circuit_breaker:
+                    self.circuit_breaker.failure()
+            else:
+                if self.circuit_breaker:
+                    self.circuit_breaker.success()
+                return ret
+        raise ConnectionErrorException("Can't connect to biicode, check internet connection!")
+
+    def _get_timeout(self, function_name):
         try:
-            return method(url, params=params, data=data, auth=auth, headers=headers,
-                          verify=self.verify, timeout=timeout or self.timeout,
-                          proxies=self.proxies)
-        except (ConnectionError, Timeout) as e:
-            logger.debug(str(e))
-            raise ConnectionErrorException("Can't connect to biicode, check internet connection!")
+            return self.timeouts[function_name]
+        except KeyError:
+            return self.authorized_methods[function_name].get('timeout', self.timeout)
+
+    def _is_idempotent(self, function_name):
+        function = self.authorized_methods[function_name]
+        return function.get('idempotent', function['method'] in self.IDEMPOTENT_METHODS)
 
     def _get_method(self, function_name):
         try:
-            return self.http_lib_methods(self.authorized_methods[function_name]['method']).value
+            http_method = self.authorized_methods[function_name]['method']
+            method = self.http_lib_methods(http_method).value
+            if self.session is not None:
+                return getattr(self.session, http_method.lower())
+            return method
         except KeyError:
             raise MethodNotFoundInApiException(function_name)  # From dict method
         except ValueError:
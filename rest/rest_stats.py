@@ -0,0 +1,59 @@
+'''
+Instrumentation of the calls to the server. BiiRestApiClient calls its call_hook with a
+dict for each call:
+
+    function: name of the called function, e.g. get_dep_table
+    url_params: {param: value} of the url of the function
+    status: HTTP status code, None if it could not connect
+    start: timestamp of the call
+    latency: seconds waiting for the server, including the response download
+    encode_time, decode_time: seconds encoding the request and decoding the response
+    request_bytes, response_bytes: size of the uncompressed BSON data
+    sent_bytes, received_bytes: size on the wire
+'''
+import json
+import threading
+from collections import OrderedDict
+
+_TOTALS = ('latency', 'encode_time', 'decode_time', 'sent_bytes', 'received_bytes')
+
+
+class RestStats(object):
+    '''Records the calls to the server, to summarize them and to dump them in a JSON
+    trace file'''
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()  # Calls can be done from several threads
+
+    def add(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self):
+        '''Returns text lines with the totals of each called function'''
+        functions = OrderedDict()
+        for call in self.calls:
+            totals = functions.setdefault(call['function'], dict.fromkeys(_TOTALS, 0))
+            totals['calls'] = totals.get('calls', 0) + 1
+            totals['errors'] = totals.get('errors', 0) + (call['status'] is None or
+                                                          call['status'] >= 400)
+            totals['max_latency'] = max(totals.get('max_latency', 0), call['latency'])
+            for name in _TOTALS:
+                totals[name] += call[name]
+        lines = ['%d calls to server in %.3fs, sent %.1f KB, received %.1f KB'
+                 % (len(self.calls), sum(c['latency'] for c in self.calls),
+                    sum(c['sent_bytes'] for c in self.calls) / 1024.0,
+                    sum(c['received_bytes'] for c in self.calls) / 1024.0)]
+        for function, totals in functions.iteritems():
+            lines.append('  %-28s %4d calls (%d errors) %8.3fs (max %.3fs), encode %.3fs, '
+                         'decode %.3fs, sent %.1f KB, received %.1f KB'
+                         % (function, totals['calls'], totals['errors'], totals['latency'],
+                            totals['max_latency'], totals['encode_time'],
+                            totals['decode_time'], totals['sent_bytes'] / 1024.0,
+                            totals['received_bytes'] / 1024.0))
+        return lines
+
+    def dump(self, path):
+        with open(path, 'w') as trace:
+            json.dump({'calls': self.calls}, trace, indent=1)
@@ -2,6 +2,7 @@ import sys
 import os
 import shlex
 import traceback
+import time
 from biicode.client.command.executor import ToolExecutor
 from biicode.client.command.tool_catalog import ToolCatalog
 from biicode.common.exception import BiiException
@@ -16,13 +17,16 @@ from biicode.client.dev.hardware.raspberry_pi.rpitoolchain import RPiToolChain
 from biicode.client.dev.hardware.arduino.arduinotoolchain import ArduinoToolChain
 from biicode.client.shell.updates_manager import UpdatesStore, UpdatesManager
 from biicode.common.model.server_info import ClientVersion
-from biicode.client.exception import ObsoleteClient
-from biicode.client.conf import BII_RESTURL
+from biicode.client.exception import ObsoleteClient, ClientException, ConnectionErrorException
+from biicode.client.conf import BII_RESTURL, BII_SHARED_CACHE, BII_OFFLINE, BII_REST_TRACE
 from biicode.client.rest.bii_rest_api_client import BiiRestApiClient
+from biicode.client.rest.rest_stats import RestStats
 from biicode.client.dev.node.nodetoolchain import NodeToolChain
+from biicode.client.command.cache_commands import CacheCommands
 from biicode.client.workspace.bii_paths import BiiPaths
 from biicode.client.workspace.hive_disk_image import HiveDiskImage
 from biicode.client.workspace.user_cache import UserCache
+from biicode.client.store.sqlite import SQLiteDB
 
 
 class Bii(object):
@@ -36,9 +40,12 @@ class Bii(object):
                                                      RPiToolChain,
                                                      SetupCommands,
                                                      ArduinoToolChain,
-                                                     NodeToolChain])
+                                                     NodeToolChain,
+                                                     CacheCommands])
         self.executor = ToolExecutor(self, toolcatalog)
         self._biiapi = None
+        self.rest_stats = RestStats()
+        self.show_stats = False  # --stats, summary of the calls to server after the command
 
     @property
     def hive_disk_image(self):
@@ -50,17 +57,31 @@ class Bii(object):
         if self._biiapi is None:
             from biicode.client.api.biiapi_proxy import BiiAPIProxy
             from biicode.client.api.biiapi_auth_manager import BiiApiAuthManager
-            auth_manager = BiiApiAuthManager(self._restapi, self.user_io, self.user_cache.localdb)
-            self._biiapi = BiiAPIProxy(self.user_cache.localdb, auth_manager, self.user_io)
+            remote_api = BiiApiAuthManager(self._restapi, self.user_io, self.user_cache.localdb)
+            if BII_SHARED_CACHE:
+                from biicode.client.api.shared_cache import SharedCacheAPI
+                try:
+                    shared_localdb = self.user_cache.shared_localdb(BII_SHARED_CACHE)
+                    remote_api = SharedCacheAPI(shared_localdb, remote_api)
+                except ClientException as e:
+                    self.user_io.out.warn('Shared cache %s not available: %s'
+                                          % (BII_SHARED_CACHE, e))
+            self._biiapi = BiiAPIProxy(self.user_cache.localdb, remote_api, self.user_io)
+            if BII_OFFLINE:
+                self._biiapi.set_offline(ConnectionErrorException('BII_OFFLINE is set'))
         return self._biiapi
 
     @property
     def _restapi(self):
-        return BiiRestApiClient(BII_RESTURL)
+        restapi = BiiRestApiClient(BII_RESTURL)
+        restapi.call_hook = self.rest_stats.add
+        return restapi
 
     def execute(self, argv):
         '''Executes user provided command. Eg. bii run:cpp'''
         errors = False
+        start_time = time.time()
+        start_commits = SQLiteDB.commit_count
         try:
             if isinstance(argv, basestring):  # To make tests easier to write
                 argv = shlex.split(argv)
@@ -79,6 +100,22 @@ class Bii(object):
             self.user_io.out.error('Error executing command.\n'
                                    '\tCheck the documentation in http://docs.biicode.com\n'
                                    '\tor ask in the forum http://forum.biicode.com\n')
+        if self._biiapi is not None:
+            self._biiapi.print_stats()
+        if self.show_stats:
+            for line in self.rest_stats.summary():
+                self.user_io.out.writeln(line)
+        if BII_REST_TRACE:
+            try:
+                self.rest_stats.dump(BII_REST_TRACE)
+            except (IOError, OSError) as e:
+                logger.debug('Could not write trace %s: %s' % (BII_REST_TRACE, e))
+        try:
+            self.user_cache.evict()
+        except Exception as e:
+            logger.debug('Could not evict from local cache: %s' % e)
+        logger.debug("Command finished in %.3fs, %d local database commits"
+                     % (time.time() - start_time, SQLiteDB.commit_count - start_commits))
         return errors
 
 
@@ -92,16 +129,20 @@ def run_main(args, user_io=None, current_folder=None, user_folder=None, biiapi_c
         bii = Bii(user_io, current_folder, biicode_folder)
 
         # Update manager doesn't need proxy nor authentication to call get_server_info
-        biiapi_client = biiapi_client or bii.biiapi
+        biiapi_client = biiapi_client or bii._restapi
         updates_manager = get_updates_manager(biiapi_client, biicode_folder)
 
-        try:  # Check for updates
-            updates_manager.check_for_updates(bii.user_io.out)
+        try:  # Check for updates in background, obsolete clients stop with the last info
+            offline = BII_OFFLINE or '--offline' in args
+            updates_manager.check_for_updates(bii.user_io.out, offline, background=True)
         except ObsoleteClient as e:
             bii.user_io.out.error(e.message)
             return int(True)
 
-        errors = bii.execute(args)
+        try:
+            errors = bii.execute(args)
+        finally:
+            updates_manager.finish()
         return int(errors)
     except OSError as e:
         print str(e)
@@ -3,6 +3,7 @@ Get ServerInfo from BiicodeRestApi. Alert user for downloading new version
 and check for deprecated client installed.
 '''
 import datetime
+import threading
 from biicode.common.model.server_info import ClientVersion, ServerInfo
 from biicode.client.exception import ObsoleteClient
 from biicode.common.utils.file_utils import save, load
@@ -81,6 +82,7 @@ class UpdatesManager(object):
     """Check for updates in server each TIME_BETWEEN_CHECKS"""
     TIME_BETWEEN_CHECKS = datetime.timedelta(hours=6)
     FILE_LAST_CHECK = ".updates"
+    FINISH_TIMEOUT = 0.5  # Seconds the end of a command waits for the background check
 
     def __init__(self, store, biiapi, client_version, time_between_checks=None):
         assert(isinstance(client_version, ClientVersion))
@@ -88,24 +90,46 @@ class UpdatesManager(object):
         self.biiapi = biiapi
         self.store = store
         self.time_between_checks = time_between_checks or self.TIME_BETWEEN_CHECKS
+        self.thread = None  # Background check, if any
 
-    def check_for_updates(self, biiout):
-        """Calls get_server_info in remote api if TIME_BETWEEN_CHECKS have passed"""
+    def check_for_updates(self, biiout, offline=False, background=False):
+        """Calls get_server_info in remote api if TIME_BETWEEN_CHECKS have passed. Offline,
+        only the last stored server info is processed.
+        In background, the call is done in a thread, storing its result for the next
+        checks, and the last stored server info is processed meanwhile"""
         update_info = self.store.load()
         server_info = update_info.server_info
         last_check = update_info.time
         now = datetime.datetime.utcnow()
         # If we don't have information yet or its old information
-        if last_check is None or (last_check + self.time_between_checks) <= now:
-            try:
-                server_info = self.biiapi.get_server_info()
-            except Exception as e:  # Don't care if we can't call. continue working
-                logger.debug(e)
-                server_info = ServerInfo()
-            self.store.save(UpdateInfo(server_info, now))
+        if not offline and (last_check is None or
+                            (last_check + self.time_between_checks) <= now):
+            if background:
+                self.thread = threading.Thread(target=self._update, args=(now, ))
+                self.thread.daemon = True  # Delays the end of the command up to finish()
+                self.thread.start()
+            else:
+                server_info = self._update(now)
         # If have not passed TIME_BETWEEN_CHECKS, process old server_info
         return self._process_server_info(server_info, biiout)
 
+    def finish(self, timeout=None):
+        """Waits for the background check, if any, to store its result, so commands shorter
+        than the call don't check again. Not longer than timeout, the check is discarded"""
+        if self.thread is not None:
+            self.thread.join(self.FINISH_TIMEOUT if timeout is None else timeout)
+            if self.thread.is_alive():
+                logger.debug('Check for updates not finished, discarded')
+
+    def _update(self, now):
+        try:
+            server_info = self.biiapi.get_server_info()
+        except Exception as e:  # Don't care if we can't call. continue working
+            logger.debug(e)
+            server_info = ServerInfo()
+        self.store.save(UpdateInfo(server_info, now))
+        return server_info
+
     def _process_server_info(self, server_info, biiout):
         if not server_info:
             return
@@ -0,0 +1,289 @@
+'''
+"bii work --watch" daemon. It processes the project each time its files change, keeping
+the processed project in memory, so other commands of the project, like "bii build" or
+"bii cpp:configure", ask the daemon for it instead of processing the project again.
+
+The daemon listens in a localhost socket. Its port and a random token that clients must
+send are written in the bii folder of the project, readable only by the user. Messages
+are JSON lines: the client sends a request, the daemon answers with the output of the
+request ({"out": text}) followed by its result ({"result": {...}})
+'''
+import binascii
+import errno
+import json
+import os
+import select
+import socket
+import sys
+import time
+import traceback
+from contextlib import closing
+from biicode.common.exception import BiiException
+from biicode.common.settings.osinfo import OSInfo
+from biicode.common.utils.bii_logging import logger
+from biicode.client.conf import BII_WATCH_INTERVAL, BII_WORK_DAEMON
+from biicode.client.exception import ClientException, NotInAHiveException
+from biicode.client.workspace.bii_paths import (BII_DIR, BIN_DIR, BUILD_DIR, CMAKE_DIR, DEP_DIR,
+                                                LIB_DIR, SRC_DIR)
+from biicode.client.workspace.watcher import create_watcher
+
+DAEMON_FILE = 'work_daemon'
+# Seconds a client waits for the first message of the daemon, busy or hung. Once it starts
+# answering, processing can take long
+_FIRST_MESSAGE_TIMEOUT = 10
+
+
+def _daemon_file(bii_paths):
+    return os.path.join(bii_paths.bii, DAEMON_FILE)
+
+
+def _read_daemon_file(bii_paths):
+    with open(_daemon_file(bii_paths)) as daemon_file:
+        return json.load(daemon_file)
+
+
+def _running(pid):
+    '''True if a process with such pid is running'''
+    if OSInfo.is_win():  # os.kill would terminate it
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM  # Running, of other user
+    return True
+
+
+def _send(connection, message):
+    connection.sendall(json.dumps(message) + '\n')
+
+
+def _messages(connection):
+    for line in connection.makefile('rb'):
+        yield json.loads(line)
+
+
+class _RequestStream(object):
+    '''Output stream of the daemon, also sent to the client of the request being served'''
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.connection = None
+
+    def write(self, data):
+        self._stream.write(data)
+        if self.connection is not None:
+            if isinstance(data, str):
+                data = data.decode('utf-8', 'replace')
+            try:
+                _send(self.connection, {'out': data})
+            except socket.error as e:  # Client gone, the request is still completed
+                logger.debug('Work daemon client disconnected: %s' % e)
+                self.connection = None
+
+    def flush(self):
+        self._stream.flush()
+
+
+class WorkDaemon(object):
+
+    def __init__(self, bii, interval=BII_WATCH_INTERVAL):
+        self._interval = interval
+        self._stream = _RequestStream(sys.stdout)
+        self._level = bii.user_io.out.level
+        self._paths = bii.bii_paths
+        self._bii = self._new_bii()
+        self._manager = None  # ClientHiveManager, with the processed project
+        self._targets = None  # Block targets of the processed project, for configure
+        self._dirty = True  # Project changed since processed
+        self._error = None  # Error processing the project, the processed one is not valid
+        self._watcher = None
+
+    @property
+    def out(self):
+        return self._bii.user_io.out
+
+    def _new_bii(self):
+        '''A Bii with the output also sent to clients. Created again when the project
+        settings change, as they are cached'''
+        from biicode.client.shell.bii import Bii
+        from biicode.client.shell.biistream import BiiOutputStream
+        from biicode.client.shell.userio import UserIO
+        out = BiiOutputStream(self._stream, level=self._level)
+        return Bii(UserIO(sys.stdin, out), self._paths.current_dir, self._paths.user_bii_home)
+
+    def _create_watcher(self):
+        paths = self._bii.bii_paths
+        if not os.path.exists(paths.deps):
+            os.makedirs(paths.deps)
+        skip = [paths.get_by_name(d)
+                for d in [DEP_DIR, BII_DIR, BIN_DIR, BUILD_DIR, CMAKE_DIR, LIB_DIR, SRC_DIR]]
+        folders = [(paths.project_root, 0), (paths.deps, 2)]
+        if os.path.exists(paths.blocks):
+            folders.append((paths.blocks, 2))
+        return create_watcher(folders, skip, self._bii.user_cache.bii_ignore, paths.bii)
+
+    def serve_forever(self):
+        '''Processes the project when it changes, and serves it to other bii commands,
+        until interrupted'''
+        self._check_not_running()
+        self._work()
+        self._watcher = self._create_watcher()
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            server.bind(('127.0.0.1', 0))
+            server.listen(5)
+            token = binascii.hexlify(os.urandom(16))
+            self._write_daemon_file(server.getsockname()[1], token)
+            self.out.success('Watching project changes, bii build and bii cpp:configure will '
+                             'use this processed project. Press Ctrl+C to stop')
+            while True:
+                readable, _, _ = select.select([server], [], [], self._interval)
+                self._check_changes()
+                if readable:
+                    connection, _ = server.accept()
+                    self._serve(connection, token)
+        finally:
+            server.close()
+            self._watcher.close()
+            try:
+                os.remove(_daemon_file(self._paths))
+            except OSError:
+                pass
+
+    def _check_not_running(self):
+        try:
+            pid = _read_daemon_file(self._paths)['pid']
+        except (EnvironmentError, ValueError, KeyError):
+            return
+        if pid != os.getpid() and _running(pid):
+            raise ClientException('"bii work --watch" is already running for this project '
+                                  '(process %s). If it is not, remove %s'
+                                  % (pid, _daemon_file(self._paths)))
+
+    def _write_daemon_file(self, port, token):
+        path = _daemon_file(self._paths)
+        if os.path.exists(path):
+            os.remove(path)  # Of a daemon that was killed, checked not running
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        with os.fdopen(descriptor, 'w') as daemon_file:
+            json.dump({'port': port, 'token': token, 'pid': os.getpid()}, daemon_file)
+
+    def _check_changes(self):
+        '''Processes the project if any file changed'''
+        changed = self._watcher.changes()
+        if changed:
+            logger.debug('Changed files: %s' % ', '.join(sorted(changed)))
+            if any(self._watcher.is_config(path) for path in changed):
+                self._bii = self._new_bii()  # settings.bii, policies.bii... changed
+                self._manager = None
+            self._dirty = True
+        if self._dirty:
+            self._work()
+
+    def _work(self):
+        start = time.time()
+        self._dirty = False
+        self._targets = None
+        try:
+            if self._manager is None:
+                from biicode.client.client_hive_manager import ClientHiveManager
+                self._manager = ClientHiveManager(self._bii)
+            self._manager.work()
+        except Exception as e:  # e.g. a wrong biicode.conf, keep watching to be fixed
+            if not isinstance(e, BiiException):
+                logger.error(traceback.format_exc())
+            self._error = e
+            self._manager = None  # Processed just partially
+            self.out.error(str(e))
+        else:
+            self._error = None
+            self.out.info('Project processed in %.0f ms' % ((time.time() - start) * 1000))
+
+    def _serve(self, connection, token):
+        with closing(connection):
+            try:
+                connection.settimeout(self._interval * 10)  # Not to block the daemon
+                request = json.loads(connection.makefile('rb').readline())
+                if request.get('token') != token:
+                    logger.warning('Work daemon request with wrong token')
+                    return
+                connection.settimeout(None)
+                self._stream.connection = connection
+                try:
+                    result = self._request(request)
+                except Exception as e:
+                    logger.error(traceback.format_exc())
+                    result = {'error': str(e)}
+                finally:
+                    self._stream.connection = None
+                _send(connection, {'result': result})
+            except (socket.error, ValueError, AttributeError) as e:
+                logger.debug('Work daemon bad request: %s' % e)
+
+    def _request(self, request):
+        from biicode.client.dev.cpp.cpptoolchain import CPPToolChain
+        if request.get('command') != 'prepare' or request.get('group') != CPPToolChain.group:
+            return {'unsupported': True}
+        self._check_changes()  # Files saved right before the command
+        if self._error is not None:  # Fixed by other means, e.g. installing a tool
+            self._work()
+            if self._error is not None:
+                return {'error': str(self._error)}
+        toolchain = CPPToolChain(self._bii)
+        cmake = toolchain.cmake(self._bii)
+        if self._targets is None or not os.path.exists(self._bii.bii_paths.build):
+            self._targets = toolchain.target_processor(self._manager).targets()
+        toolchain_file, regenerate = cmake.prepare(self._targets, request.get('generator'),
+                                                   request.get('toolchain'))
+        return {'toolchain_file': toolchain_file, 'regenerate': regenerate}
+
+
+def request_prepare(bii, group, generator, toolchain):
+    '''Asks the "bii work --watch" daemon of the project, if running, for the processed
+    project and its CMake files written
+    return: (toolchain file, True if CMake has to generate the project again), or None if
+    there is no daemon, and the project has to be processed by the caller
+    '''
+    if not BII_WORK_DAEMON:
+        return None
+    try:
+        daemon = _read_daemon_file(bii.bii_paths)
+        if not _running(daemon['pid']):
+            logger.debug('Not using work daemon: process %s not running' % daemon['pid'])
+            return None
+        connection = socket.create_connection(('127.0.0.1', daemon['port']), timeout=1)
+    except (NotInAHiveException, EnvironmentError, ValueError, KeyError) as e:
+        logger.debug('Not using work daemon: %s' % e)
+        return None
+    result = None
+    try:
+        with closing(connection):
+            connection.settimeout(_FIRST_MESSAGE_TIMEOUT)
+            _send(connection, {'token': daemon.get('token'), 'command': 'prepare',
+                               'group': group, 'generator': generator, 'toolchain': toolchain})
+            for message in _messages(connection):
+                connection.settimeout(None)  # Answering, processing can take long
+                if 'out' in message:
+                    bii.user_io.out.write(message['out'].encode('utf-8'))
+                else:
+                    result = message.get('result')
+                    break
+    except (socket.error, ValueError) as e:  # Killed or hung daemon, timeout is a socket.error
+        logger.debug('Work daemon request failed: %s' % e)
+        return None
+    if result is None or result.get('unsupported'):
+        # Stopped, or other daemon (wrong token) now in that port
+        logger.debug('Work daemon did not serve the request')
+        return None
+    if 'error' in result:
+        raise BiiException(result['error'])
+    toolchain_file = result['toolchain_file']
+    if toolchain_file is not None:
+        toolchain_file = toolchain_file.encode(sys.getfilesystemencoding() or 'utf-8')
+    return toolchain_file, result['regenerate']
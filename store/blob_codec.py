@@ -0,0 +1,31 @@
+'''
+Codecs to transform serialized values (output of serialize() methods: dicts, lists,
+tuples, strings, numbers and bson Binary) into the bytes stored in the BLOB columns
+of the local databases.
+'''
+from biicode.common.utils.bson_encoding import encode_bson, decode_bson
+
+
+class BSONCodec(object):
+    '''Binary codec, the same encoding used for the REST API payloads.
+    BSON documents must be dicts, so the value is wrapped in a single field'''
+    name = 'bson'
+
+    def encode(self, value):
+        return str(encode_bson({'v': value}))
+
+    def decode(self, data):
+        return decode_bson(str(data))['v']
+
+
+class ReprCodec(object):
+    '''Legacy codec, repr() text evaluated back with eval().
+    Only used to read rows written by clients previous to BSONCodec'''
+    name = 'repr'
+
+    def encode(self, value):
+        return value.__repr__()
+
+    def decode(self, data):
+        from bson.binary import Binary  # DO NOT REMOVE! Necessary for eval
+        return eval(data)
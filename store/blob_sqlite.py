@@ -6,6 +6,51 @@ from biicode.common.exception import NotInStoreException
 from biicode.client.store.sqlite import SQLiteDB, encode_serialized_value,\
     decode_serialized_value
 from biicode.common.utils.serializer import serialize
+import collections
+
+
+class LazyBlobDict(collections.MutableMapping):
+    '''Dict of the rows of a table, keyed by ID. The rows are kept encoded, and each value
+    is decoded the first time it is accessed, so reading a big table only pays for the
+    values actually used'''
+
+    def __init__(self, rows, deserializer, key_type):
+        '''rows: iterable of (id, blob) rows'''
+        self._deserializer = deserializer
+        self._encoded = {key_type(ID): blob for ID, blob in rows}
+        self._decoded = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._decoded[key]
+        except KeyError:
+            blob = self._encoded.pop(key)  # KeyError if not found, like a dict
+            item = self._deserializer.deserialize(decode_serialized_value(blob))
+            self._decoded[key] = item
+            return item
+
+    def __setitem__(self, key, value):
+        self._encoded.pop(key, None)
+        self._decoded[key] = value
+
+    def __delitem__(self, key):
+        if key in self._decoded:
+            del self._decoded[key]
+        else:
+            del self._encoded[key]
+
+    def __contains__(self, key):
+        return key in self._decoded or key in self._encoded
+
+    def __iter__(self):
+        # Keys are copied, values accessed while iterating move from encoded to decoded
+        return iter(self._decoded.keys() + self._encoded.keys())
+
+    def __len__(self):
+        return len(self._decoded) + len(self._encoded)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
 
 
 class BlobSQLite(SQLiteDB):
@@ -14,9 +59,9 @@ class BlobSQLite(SQLiteDB):
         cursor.execute("create table if not exists %s (id TEXT UNIQUE, blob BLOB)" % table)
 
     def read(self, ID, table, deserializer):
-        query = "SELECT blob FROM %s WHERE id=\"%s\"" % (table, ID)
+        query = "SELECT blob FROM %s WHERE id=?" % table
         c = self.connection.cursor()
-        c.execute(query)
+        c.execute(query, (ID, ))
         rs = c.fetchone()
         if not rs:
             raise NotInStoreException('Not found %s in %s' % (ID, table))
@@ -47,6 +92,13 @@ class BlobSQLite(SQLiteDB):
                 result[item.ID] = item
         return result
 
+    def read_all_lazy(self, table, deserializer, key_type):
+        '''Like read_all, but values are decoded when accessed. key_type builds the keys
+        from the ID column, which must be the str() of the values ID'''
+        c = self.connection.cursor()
+        c.execute("SELECT id, blob FROM %s" % table)
+        return LazyBlobDict(c, deserializer, key_type)
+
     def create(self, ID, value, table):
         self._generic_write(table, ID, encode_serialized_value(serialize(value)),
                             'id', 'blob', 'INSERT')
@@ -68,3 +120,18 @@ class BlobSQLite(SQLiteDB):
 
     def upsert_multi(self, id_value_list, table):
         self._generic_write_multi(table, id_value_list, 'id', 'blob', 'INSERT OR REPLACE')
+
+    def migrate_legacy_blobs(self, tables):
+        '''Re-encodes with current codec the rows written as text by the legacy codec.
+        Rows already converted are skipped, so it is safe to call it several times
+        '''
+        c = self.connection.cursor()
+        converted = 0
+        for table in tables:
+            c.execute("SELECT id, blob FROM %s WHERE typeof(blob)='text'" % table)
+            rows = [(encode_serialized_value(decode_serialized_value(blob)), ID)
+                    for ID, blob in c.fetchall()]
+            self._execute("UPDATE %s SET blob=? WHERE id=?" % table, rows, many=True)
+            converted += len(rows)
+        self._commit()
+        return converted
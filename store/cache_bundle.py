@@ -0,0 +1,60 @@
+'''
+Cache bundles are single files with cached block versions of the user cache, to
+pre-populate other caches, e.g. in CI machines. A bundle is a header line with the format
+version and the sha1 of the database, followed by the database file compressed with zlib
+'''
+import hashlib
+import zlib
+from biicode.client.exception import ClientException
+
+BUNDLE_HEADER = 'biicode-cache-bundle'
+BUNDLE_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+
+
+def _chunks(f):
+    return iter(lambda: f.read(CHUNK_SIZE), '')
+
+
+def write_bundle(dbfile, bundle_path):
+    sha = hashlib.sha1()
+    with open(dbfile, 'rb') as db:
+        for chunk in _chunks(db):
+            sha.update(chunk)
+    compressor = zlib.compressobj()
+    with open(dbfile, 'rb') as db, open(bundle_path, 'wb') as bundle:
+        bundle.write('%s %d %s\n' % (BUNDLE_HEADER, BUNDLE_VERSION, sha.hexdigest()))
+        for chunk in _chunks(db):
+            bundle.write(compressor.compress(chunk))
+        bundle.write(compressor.flush())
+
+
+def read_bundle(bundle_path, dbfile):
+    '''Uncompresses the database of the bundle in dbfile, checking it is not corrupted'''
+    with open(bundle_path, 'rb') as bundle:
+        try:
+            header, version, checksum = bundle.readline().split()
+            version = int(version)
+        except ValueError:
+            header = None
+        if header != BUNDLE_HEADER:
+            raise ClientException('%s is not a biicode cache bundle' % bundle_path)
+        if version != BUNDLE_VERSION:
+            raise ClientException('Cache bundle %s version %d not supported'
+                                  % (bundle_path, version))
+        sha = hashlib.sha1()
+        decompressor = zlib.decompressobj()
+        try:
+            with open(dbfile, 'wb') as db:
+                for chunk in _chunks(bundle):
+                    data = decompressor.decompress(chunk)
+                    sha.update(data)
+                    db.write(data)
+                data = decompressor.flush()
+                sha.update(data)
+                db.write(data)
+        except zlib.error as e:
+            raise ClientException('Cache bundle %s is corrupted: %s' % (bundle_path, e))
+    if sha.hexdigest() != checksum:
+        raise ClientException('Cache bundle %s is corrupted, checksum does not match'
+                              % bundle_path)
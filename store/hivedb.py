@@ -1,5 +1,6 @@
 from biicode.common.model.brl.block_cell_name import BlockCellName
 import os
+import sqlite3
 from biicode.client.exception import ClientException
 from biicode.common.model.content import ContentDeserializer
 from biicode.common.api.edition_api import EditionAPI
@@ -30,6 +31,10 @@ def factory(dbpath):
 
 CONTENTS = "contents"
 VERSION = "client_version"
+# (path, size, mtime, inode, sha1, compressed content) of the files read in the last scan
+SCAN_MANIFEST = "scan_manifest"
+# Tables with (id, blob) rows, encoded with BLOB_CODEC
+BLOB_TABLES = [CONTENTS, VERSION]
 
 
 class HiveDB(BlobSQLite, EditionAPI):
@@ -50,7 +55,8 @@ class HiveDB(BlobSQLite, EditionAPI):
             raise ClientException("Could not initalize local cache", e)
 
     def read_edition_contents(self):
-        return self.read_all(CONTENTS, ContentDeserializer(BlockCellName))
+        '''Returns a dict-like {BlockCellName: Content}, decoding each content when used'''
+        return self.read_all_lazy(CONTENTS, ContentDeserializer(BlockCellName), BlockCellName)
 
     def upsert_edition_contents(self, contents):
         # The hivedb actually doesnt need the serialized bytes, they will
@@ -58,13 +64,41 @@ class HiveDB(BlobSQLite, EditionAPI):
         for c in contents:
             c.load.serialize_bytes = False
         rows = [(c.ID, c) for c in contents]
-        result = self.upsert_multi(rows, CONTENTS)
+        with self.transaction():
+            result = self.upsert_multi(rows, CONTENTS)
         return result
 
     def delete_edition_contents(self, block_cell_names):
         result = self.delete_multi(block_cell_names, CONTENTS)
         return result
 
+    def _create_scan_manifest(self):
+        # Not in init, existing databases don't have it
+        self._execute("CREATE TABLE IF NOT EXISTS %s (path TEXT UNIQUE, size INTEGER, "
+                      "mtime INTEGER, inode INTEGER, hash TEXT, content BLOB)" % SCAN_MANIFEST)
+
+    def read_scan_manifest(self):
+        '''Returns {path: (size, mtime_ns, inode, sha1, compressed content)}'''
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("SELECT path, size, mtime, inode, hash, content FROM %s"
+                           % SCAN_MANIFEST)
+        except sqlite3.OperationalError:  # Not created yet, first scan
+            return {}
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+
+    def update_scan_manifest(self, rows, deleted_paths):
+        '''rows: [(path, size, mtime_ns, inode, sha1, compressed content)] to store
+        deleted_paths: paths to remove from the manifest
+        '''
+        rows = [row[:5] + (sqlite3.Binary(row[5]), ) for row in rows]
+        with self.transaction():
+            self._create_scan_manifest()
+            self._execute("DELETE FROM %s WHERE path = ?" % SCAN_MANIFEST,
+                          [(path, ) for path in deleted_paths], many=True)
+            self._execute("INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?, ?)" % SCAN_MANIFEST,
+                          rows, many=True)
+
     def upsert_last_migrated(self, migration):
         self.upsert('last_migrated', migration, VERSION)
 
@@ -74,4 +108,6 @@ class HiveDB(BlobSQLite, EditionAPI):
 
     def clean(self):
         self.delete_all(CONTENTS)
+        self._execute("DROP TABLE IF EXISTS %s" % SCAN_MANIFEST)
+        self._commit()
         self.vacuum()
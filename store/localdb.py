@@ -1,6 +1,9 @@
 from biicode.client.exception import ClientException
-from biicode.client.store.sqlite import SQLiteDB, encode_serialized_value, decode_serialized_value
-from biicode.common.model.content import ContentDeserializer
+from biicode.client.store.sqlite import (SQLiteDB, encode_serialized_value,
+                                        decode_serialized_value, encode_serialized_key,
+                                        encode_compressed_value, decode_compressed_value,
+                                        LEGACY_CODEC)
+from biicode.common.model.content import ContentDeserializer, Content
 from biicode.common.model.cells import CellDeserializer
 from biicode.common.utils.bii_logging import logger
 from biicode.common.model.id import ID
@@ -11,11 +14,19 @@ from biicode.client.store.blob_sqlite import BlobSQLite
 from biicode.common.model.brl.cell_name import CellName
 from biicode.common.utils.serializer import ListDeserializer
 from biicode.common.model.block_delta import BlockDelta
+from biicode.common.model.symbolic.block_version import BlockVersion
 import traceback
+import os
+import sqlite3
+import time
+from biicode.client.conf import BII_DB_JOURNAL_MODE
 
 
 PUBLISHED_CELLS = "cells"  # ID => PublishedCell
-PUBLISHED_CONTENTS = "contents"  # ID => PublishedContent
+PUBLISHED_CONTENTS = "contents"  # ID => ID part of PublishedContent, hash of the rest
+# Identical contents of different IDs (same file in different blocks) share the same
+# compressed blob, with the number of contents pointing to it
+CONTENT_BLOBS = "content_blobs"  # hash => compressed PublishedContent without ID
 SNAPSHOTS = 'snapshots'
 # There are more than one reference to same ID, we store ID and the
 # cell/content in the previous tables
@@ -23,12 +34,47 @@ SNAPSHOTS = 'snapshots'
 PUBLISHED_REFERENCES = "refs"  # Reference => Cell ID, Content ID
 DEP_TABLES = "dep_tables"
 DELTAS = "deltas"
+# Last access time of each block version, to evict the least recently used ones
+VERSION_ACCESS = "version_access"  # BlockVersion => last access timestamp
+# Last check of each cached DEV version with the server, and the ETag of its delta there
+DEV_VALIDATIONS = "dev_validations"  # BlockVersion => validation timestamp, etag
+# Block versions evicted at once, each batch in its own transaction
+EVICTION_BATCH = 20
+# SQLite default limit of parameters in a query is 999
+MAX_QUERY_PARAMETERS = 900
+# Tables with (id, blob) rows, encoded with BLOB_CODEC
+BLOB_TABLES = [PUBLISHED_CELLS, PUBLISHED_CONTENTS, SNAPSHOTS, DEP_TABLES, DELTAS]
+
+
+def _split_content(serial):
+    '''Splits a serialized content in the part specific of its ID and the rest, which is
+    the same for identical files'''
+    shared = dict(serial)
+    own = {Content.SERIAL_ID_KEY: shared.pop(Content.SERIAL_ID_KEY)}
+    return own, shared
+
+
+def _decode_content(own, shared):
+    '''own: blob of the contents table
+    shared: compressed blob of the content_blobs table, None for contents stored whole'''
+    serial = decode_serialized_value(own)
+    if shared is not None:
+        content = decode_compressed_value(shared)
+        content.update(serial)
+        serial = content
+    return serial
 
 
 class LocalDB(BlobSQLite):
 
-    def __init__(self, dbfile):
-        super(LocalDB, self).__init__(dbfile)
+    def __init__(self, dbfile, journal_mode=BII_DB_JOURNAL_MODE, read_only=False,
+                 track_access=True):
+        '''track_access: store the access time of the used block versions, to evict the
+        least recently used ones'''
+        super(LocalDB, self).__init__(dbfile, journal_mode, read_only)
+        self._track_access = track_access and not read_only
+        self._touched = set()  # Versions used by this instance, never evicted by it
+        self._accessed = {}  # {version key: access time} read, not stored yet
         self.connect()
         self.init()
 
@@ -49,22 +95,36 @@ class LocalDB(BlobSQLite):
         try:
             cursor = self.connection.cursor()
 
-            self.create_table(cursor, PUBLISHED_CONTENTS)
+            cursor.execute("create table if not exists %s (id TEXT UNIQUE, blob BLOB, hash TEXT)"
+                           % PUBLISHED_CONTENTS)
             self.create_table(cursor, PUBLISHED_CELLS)
             self.create_table(cursor, SNAPSHOTS)
             self.create_table(cursor, DEP_TABLES)
             self.create_table(cursor, DELTAS)
 
+            cursor.execute("create table if not exists %s (hash TEXT UNIQUE, blob BLOB, "
+                           "size INTEGER, refcount INTEGER)" % CONTENT_BLOBS)
+            self._migrate_contents_hash(cursor)
+            cursor.execute("CREATE INDEX if not exists hash_index ON %s (hash)"
+                           % PUBLISHED_CONTENTS)
+
             # To avoid multiple usernames in the login table, use always "login" as id
             cursor.execute("create table if not exists login (id TEXT UNIQUE, "
                            "username TEXT UNIQUE, token TEXT)")
             cursor.execute("create table if not exists %s "
-                              "(reference TEXT UNIQUE, cell_id TEXT, content_id TEXT)"
+                              "(reference TEXT UNIQUE, cell_id TEXT, content_id TEXT, "
+                              "block_version TEXT)"
                               % PUBLISHED_REFERENCES)
+            self._migrate_references_block_version(cursor)
+            cursor.execute("CREATE INDEX if not exists block_version_index ON %s (block_version)"
+                              % (PUBLISHED_REFERENCES))
             cursor.execute("CREATE INDEX if not exists cell_id_index ON %s (cell_id)"
                               % (PUBLISHED_REFERENCES))
             cursor.execute("CREATE INDEX if not exists content_id_index ON %s (content_id)"
                               % (PUBLISHED_REFERENCES))
+            self._create_version_access(cursor)
+            cursor.execute("create table if not exists %s (block_version TEXT UNIQUE, "
+                           "validated REAL, etag TEXT)" % DEV_VALIDATIONS)
         except Exception as e:
             message = "Could not initalize local cache"
             raise ClientException(message, e)
@@ -72,6 +132,93 @@ class LocalDB(BlobSQLite):
             if cursor:
                 cursor.close()
 
+    def _migrate_references_block_version(self, cursor):
+        '''Caches created by older clients don't have the block_version column in
+        references table, add it and fill it from the stored references'''
+        cursor.execute("PRAGMA table_info(%s)" % PUBLISHED_REFERENCES)
+        if 'block_version' in [column[1] for column in cursor.fetchall()]:
+            return
+        cursor.execute("ALTER TABLE %s ADD COLUMN block_version TEXT" % PUBLISHED_REFERENCES)
+        cursor.execute("SELECT reference FROM %s" % PUBLISHED_REFERENCES)
+        rows = []
+        for (key, ) in cursor.fetchall():
+            # Keys are repr() text, only decoded here, once
+            reference = Reference.deserialize(LEGACY_CODEC.decode(key))
+            rows.append((encode_serialized_key(reference.block_version.serialize()), key))
+        self._execute("UPDATE %s SET block_version=? WHERE reference=?" % PUBLISHED_REFERENCES,
+                      rows, many=True)
+        self._commit()
+
+    def _migrate_contents_hash(self, cursor):
+        '''Contents of caches created by older clients are stored whole in contents
+        table, move them to the shared content blobs'''
+        cursor.execute("PRAGMA table_info(%s)" % PUBLISHED_CONTENTS)
+        if 'hash' in [column[1] for column in cursor.fetchall()]:
+            return
+        cursor.execute("ALTER TABLE %s ADD COLUMN hash TEXT" % PUBLISHED_CONTENTS)
+        cursor.execute("SELECT id, blob FROM %s" % PUBLISHED_CONTENTS)
+        with self.transaction():
+            for content_id, blob in cursor.fetchall():
+                self._create_published_content(content_id, decode_serialized_value(blob))
+
+    def _create_version_access(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                       (VERSION_ACCESS, ))
+        if cursor.fetchone():
+            return
+        cursor.execute("create table %s (block_version TEXT UNIQUE, last_access REAL)"
+                       % VERSION_ACCESS)
+        cursor.execute("CREATE INDEX last_access_index ON %s (last_access)" % VERSION_ACCESS)
+        # Versions cached by older clients are the first candidates to be evicted
+        cursor.execute("INSERT OR IGNORE INTO {access} (block_version, last_access) "
+                       "SELECT id, 0 FROM {deltas} UNION SELECT id, 0 FROM {tables} "
+                       "UNION SELECT id, 0 FROM {snapshots} "
+                       "UNION SELECT DISTINCT block_version, 0 FROM {refs} "
+                       "WHERE block_version IS NOT NULL"
+                       .format(access=VERSION_ACCESS, deltas=DELTAS, tables=DEP_TABLES,
+                               snapshots=SNAPSHOTS, refs=PUBLISHED_REFERENCES))
+        self._commit()
+
+    def _touch(self, ser_versions):
+        '''Records the access time of the given block version keys read, kept in memory so
+        reads don't write. Only the first access of each version is recorded, a command
+        doesn't need more precision. They are stored by store_access()'''
+        if not self._track_access:
+            return
+        now = time.time()
+        for ser_version in ser_versions:
+            if ser_version not in self._touched:
+                self._touched.add(ser_version)
+                self._accessed[ser_version] = now
+
+    def _touch_written(self, ser_versions):
+        '''Stores the access time of the given block version keys, in the transaction
+        writing their values, so every cached version can be evicted'''
+        if not self._track_access:
+            return
+        ser_versions = set(ser_versions)
+        self._touched.update(ser_versions)
+        for ser_version in ser_versions:
+            self._accessed.pop(ser_version, None)
+        now = time.time()
+        self._execute("INSERT OR REPLACE INTO %s (block_version, last_access) VALUES (?, ?)"
+                      % VERSION_ACCESS, [(v, now) for v in ser_versions], many=True)
+
+    def store_access(self):
+        '''Stores in a single commit the access times recorded by the reads. Failures are
+        ignored, e.g. in read-only caches, access times are just a hint for eviction'''
+        if not self._accessed:
+            return
+        rows = [(v, access) for v, access in self._accessed.iteritems()]
+        self._accessed = {}
+        try:
+            with self.transaction():
+                # Only versions still cached, they could be removed by other process
+                self._execute("UPDATE %s SET last_access=? WHERE block_version=?"
+                              % VERSION_ACCESS, [(access, v) for v, access in rows], many=True)
+        except sqlite3.OperationalError as e:
+            logger.debug("Could not store access times in %s: %s" % (self.dbfile, e))
+
     def get_login(self):
         '''Returns login credentials.
         This method is also in charge of expiring them.
@@ -95,54 +242,121 @@ class LocalDB(BlobSQLite):
     def set_login(self, login):
         """Login is a tuple of (login, token)"""
         try:
-            statement = self.connection.cursor()
-            statement.execute("INSERT OR REPLACE INTO login (id, username, token) "
-                              "VALUES (?, ?, ?)",
-                              ("login", login[0], login[1]))
-            self.connection.commit()
+            self._execute("INSERT OR REPLACE INTO login (id, username, token) "
+                          "VALUES (?, ?, ?)",
+                          ("login", login[0], login[1]))
+            self._commit()
         except Exception as e:
             raise ClientException("Could not store credentials in local cache", e)
 
     def get_dep_table(self, block_version):
-        ID = encode_serialized_value(block_version.serialize())
-        return self.read(ID, DEP_TABLES, BlockVersionTable)
+        ID = encode_serialized_key(block_version.serialize())
+        return self._read_version(ID, DEP_TABLES, BlockVersionTable)
+
+    def _read_version(self, ID, table, deserializer):
+        value = self.read(ID, table, deserializer)
+        if value is not None:
+            self._touch([ID])
+        return value
 
     def set_dep_table(self, block_version, dep_table):
         assert isinstance(dep_table, BlockVersionTable)
-        ID = encode_serialized_value(block_version.serialize())
-        self.create(ID, dep_table, DEP_TABLES)
+        ID = encode_serialized_key(block_version.serialize())
+        with self.transaction():
+            self.create(ID, dep_table, DEP_TABLES)
+            self._touch_written([ID])
 
     def get_cells_snapshot(self, block_version):
-        ID = encode_serialized_value(block_version.serialize())
-        return self.read(ID, SNAPSHOTS, ListDeserializer(CellName))
+        ID = encode_serialized_key(block_version.serialize())
+        return self._read_version(ID, SNAPSHOTS, ListDeserializer(CellName))
 
     def create_cells_snapshot(self, block_version, snapshot):
         """Snapshot is a list with cell names for an specific block version ''' """
-        ID = encode_serialized_value(block_version.serialize())
-        self.create(ID, snapshot, SNAPSHOTS)
+        ID = encode_serialized_key(block_version.serialize())
+        with self.transaction():
+            self.create(ID, snapshot, SNAPSHOTS)
+            self._touch_written([ID])
 
     def get_delta_info(self, block_version):
-        ID = encode_serialized_value(block_version.serialize())
-        return self.read(ID, DELTAS, BlockDelta)
+        ID = encode_serialized_key(block_version.serialize())
+        return self._read_version(ID, DELTAS, BlockDelta)
 
     def upsert_delta_info(self, block_version, delta_info):
         """Snapshot is a list with cell names for an specific block version ''' """
         # Don't store origin info in localdb (url field crashes because of ://)
         delta_info.origin = None
-        ID = encode_serialized_value(block_version.serialize())
-        self.upsert(ID, delta_info, DELTAS)
+        ID = encode_serialized_key(block_version.serialize())
+        with self.transaction():
+            self.upsert(ID, delta_info, DELTAS)
+            self._touch_written([ID])
+
+    def get_dev_validation(self, block_version):
+        '''Returns (timestamp, etag) of the last check of a DEV version with the server,
+        (None, None) if it was never checked'''
+        ID = encode_serialized_key(block_version.serialize())
+        c = self.connection.cursor()
+        c.execute("SELECT validated, etag FROM %s WHERE block_version=?" % DEV_VALIDATIONS,
+                  (ID, ))
+        return c.fetchone() or (None, None)
+
+    def set_dev_validation(self, block_version, etag=None):
+        '''Stores that a DEV version has been checked with the server now'''
+        ID = encode_serialized_key(block_version.serialize())
+        self._execute("INSERT OR REPLACE INTO %s (block_version, validated, etag) "
+                      "VALUES (?, ?, ?)" % DEV_VALIDATIONS, (ID, time.time(), etag))
+        self._commit()
 
     def remove_dev_references(self, block_version):
-        ser_version = encode_serialized_value(block_version.serialize())
-        self.delete(ser_version, DEP_TABLES)
-        self.delete(ser_version, SNAPSHOTS)
-        self.delete(ser_version, DELTAS)
+        self._remove_version(encode_serialized_key(block_version.serialize()))
+
+    def _remove_version(self, ser_version):
+        '''Removes everything cached of a block version key'''
+        with self.transaction():
+            self.delete(ser_version, DEP_TABLES)
+            self.delete(ser_version, SNAPSHOTS)
+            self.delete(ser_version, DELTAS)
+
+            c = self.connection.cursor()
+            c.execute('SELECT cell_id, content_id FROM {table} where block_version=(?);'
+                      .format(table=PUBLISHED_REFERENCES), (ser_version,))
+            rows = c.fetchall()
+            command = ('DELETE from {table} where block_version=(?);'
+                       .format(table=PUBLISHED_REFERENCES))
+            self._execute(command, (ser_version,))
+            self._delete_unreferenced({row[0] for row in rows},
+                                      {row[1] for row in rows if row[1]})
+            self._execute("DELETE FROM %s WHERE block_version=?" % VERSION_ACCESS,
+                          (ser_version, ))
+            self._execute("DELETE FROM %s WHERE block_version=?" % DEV_VALIDATIONS,
+                          (ser_version, ))
+        self._touched.discard(ser_version)
+        self._accessed.pop(ser_version, None)
+
+    def _delete_unreferenced(self, cell_ids, content_ids):
+        '''Deletes the given cells and contents if no reference points to them anymore,
+        and the content blobs no longer used by any content'''
+        query = ("DELETE FROM {cells} WHERE id=? AND NOT EXISTS "
+                 "(SELECT 1 FROM {refs} WHERE cell_id=?)")
+        self._execute(query.format(cells=PUBLISHED_CELLS, refs=PUBLISHED_REFERENCES),
+                      [(ID, ID) for ID in cell_ids], many=True)
 
         c = self.connection.cursor()
-        command = 'DELETE from {table} where reference LIKE (?);'.format(table=PUBLISHED_REFERENCES)
-        c.execute(command, ("%{}%".format(ser_version),))
-        self.connection.commit()
-        # TODO: What happens to cells & contents? Not deleted?
+        unreferenced = []
+        for content_id in content_ids:
+            c.execute("SELECT hash FROM {contents} WHERE id=? AND NOT EXISTS "
+                      "(SELECT 1 FROM {refs} WHERE content_id=?)"
+                      .format(contents=PUBLISHED_CONTENTS, refs=PUBLISHED_REFERENCES),
+                      (content_id, content_id))
+            row = c.fetchone()
+            if row:
+                unreferenced.append((content_id, row[0]))
+        self._execute("DELETE FROM %s WHERE id=?" % PUBLISHED_CONTENTS,
+                      [(content_id, ) for content_id, _ in unreferenced], many=True)
+        hashes = [(blob_hash, ) for _, blob_hash in unreferenced if blob_hash]
+        self._execute("UPDATE %s SET refcount=refcount-1 WHERE hash=?" % CONTENT_BLOBS,
+                      hashes, many=True)
+        self._execute("DELETE FROM %s WHERE hash=? AND refcount<=0" % CONTENT_BLOBS,
+                      hashes, many=True)
 
     def get_published_resources(self, references):
         '''
@@ -150,31 +364,35 @@ class LocalDB(BlobSQLite):
             references: a References (biicode.common.model.symbolic.reference.References) object
         '''
         simple_refs = references.explode()  # references object to reference list
-        #each reference has to be stored as json string, cause it is a tuple
-        ids = ",".join(["\"%s\"" % encode_serialized_value(v.serialize()) for v in simple_refs])
-        return self._read_referenced_resources(self.__query_published_references(ids), ID)
+        #each reference is stored as text key, cause it is a tuple
+        keys = {encode_serialized_key(v.serialize()): v for v in simple_refs}
+        result = self._read_referenced_resources(self._query_published_references(keys.keys()),
+                                                 keys, ID)
+        self._touch(encode_serialized_key(v.serialize()) for v in result)
+        return result
 
     def create_published_resources(self, referenced_resources):
         '''
         Params:
             referenced_resources = ReferencedResources (biicode.common.model.symbolic.reference)
         '''
-        statement = self.connection.cursor()
-        for reference, resource in referenced_resources.explode().iteritems():
-            self._query_create_published_reference(reference, resource, statement)
-        self.connection.commit()
-
-    def _read_referenced_resources(self, query, id_type):
-        statement = query
+        with self.transaction():
+            for reference, resource in referenced_resources.explode().iteritems():
+                self._query_create_published_reference(reference, resource)
+            self._touch_written(encode_serialized_key(v.serialize())
+                                for v in referenced_resources)
 
+    def _read_referenced_resources(self, rows, keys, id_type):
+        '''rows: iterable of (reference, cell, content) rows
+        keys: {reference key: Reference} of the requested references, so they
+        don't need to be decoded from the database'''
         ret = ReferencedResources()
-        rs = statement.fetchall()
         cell_des = CellDeserializer(id_type)
         content_des = ContentDeserializer(id_type)
-        for r in rs:
+        for r in rows:
             try:
-                v = Reference.deserialize(decode_serialized_value(r[0]))
-                scontent = decode_serialized_value(r[2]) if r[2] else None
+                v = keys[r[0]]
+                scontent = _decode_content(r[2], r[3]) if r[2] else None
                 res = Resource(cell_des.deserialize(decode_serialized_value(r[1])),
                                content_des.deserialize(scontent))
                 cell_name = v.ref
@@ -187,43 +405,212 @@ class LocalDB(BlobSQLite):
 
         return ret
 
-    def __query_published_references(self, urls):
+    def _query_published_references(self, keys):
+        '''Generator of the rows of given reference keys. Keys are queried in chunks, as
+        SQLite limits the number of parameters of a query, and rows are not fetched
+        all at once, so they can be processed while read'''
         q = '''SELECT %(pub_ref)s.reference as reference,
                       %(pub_cells)s.blob as cell,
-                      %(pub_contents)s.blob as content
+                      %(pub_contents)s.blob as content,
+                      %(blobs)s.blob as content_blob
                FROM %(pub_ref)s
                JOIN %(pub_cells)s ON %(pub_ref)s.cell_id=%(pub_cells)s.id
                LEFT JOIN %(pub_contents)s ON %(pub_ref)s.content_id=%(pub_contents)s.id
-               WHERE reference IN (%(refs)s)''' % {"pub_ref": PUBLISHED_REFERENCES,
-                                                   "pub_cells": PUBLISHED_CELLS,
-                                                   "pub_contents": PUBLISHED_CONTENTS,
-                                                   "refs": urls}
-        statement = self.connection.cursor()
-        return statement.execute(q)
-
-    def _query_create_published_reference(self, reference, resource, statement):
-        query = ("INSERT OR REPLACE INTO %s (reference, cell_id, content_id) VALUES (?, ?, ?)"
-                 % PUBLISHED_REFERENCES)
+               LEFT JOIN %(blobs)s ON %(pub_contents)s.hash=%(blobs)s.hash
+               WHERE reference IN (%(refs)s)'''
+        keys = list(keys)
+        for i in range(0, len(keys), MAX_QUERY_PARAMETERS):
+            chunk = keys[i:i + MAX_QUERY_PARAMETERS]
+            query = q % {"pub_ref": PUBLISHED_REFERENCES,
+                         "pub_cells": PUBLISHED_CELLS,
+                         "pub_contents": PUBLISHED_CONTENTS,
+                         "blobs": CONTENT_BLOBS,
+                         "refs": ",".join("?" * len(chunk))}
+            statement = self.connection.cursor()
+            for row in statement.execute(query, chunk):
+                yield row
+
+    def _query_create_published_reference(self, reference, resource):
+        query = ("INSERT OR REPLACE INTO %s (reference, cell_id, content_id, block_version) "
+                 "VALUES (?, ?, ?, ?)" % PUBLISHED_REFERENCES)
         content_id = resource.content.ID.__repr__() if resource.content else None
-        statement.execute(query, (encode_serialized_value(reference.serialize()),
-                                  resource.cell.ID.__repr__(),
-                                  content_id))
+        self._execute(query, (encode_serialized_key(reference.serialize()),
+                              resource.cell.ID.__repr__(),
+                              content_id,
+                              encode_serialized_key(reference.block_version.serialize())))
         query = "REPLACE INTO %s (id, blob) VALUES (?, ?)" % (PUBLISHED_CELLS)
-        statement.execute(query, (resource.cell.ID.__repr__(),
-                                  encode_serialized_value(resource.cell.serialize())))
+        self._execute(query, (resource.cell.ID.__repr__(),
+                              encode_serialized_value(resource.cell.serialize())))
         if content_id:
-            query = "REPLACE INTO %s (id, blob) VALUES (?, ?)" % (PUBLISHED_CONTENTS)
-            statement.execute(query, (resource.content.ID.__repr__(),
-                                      encode_serialized_value(resource.content.serialize())))
+            self._create_published_content(content_id, resource.content.serialize())
+
+    def _create_published_content(self, content_id, serial):
+        own, shared = _split_content(serial)
+        blob_hash, blob, size = encode_compressed_value(shared)
+        c = self.connection.cursor()
+        c.execute("SELECT hash FROM %s WHERE id=?" % PUBLISHED_CONTENTS, (content_id, ))
+        row = c.fetchone()
+        old_hash = row[0] if row else None
+        if old_hash == blob_hash:
+            return
+        if old_hash:
+            self._execute("UPDATE %s SET refcount=refcount-1 WHERE hash=?" % CONTENT_BLOBS,
+                          (old_hash, ))
+            self._execute("DELETE FROM %s WHERE hash=? AND refcount<=0" % CONTENT_BLOBS,
+                          (old_hash, ))
+        self._execute("INSERT OR IGNORE INTO %s (hash, blob, size, refcount) "
+                      "VALUES (?, ?, ?, 0)" % CONTENT_BLOBS, (blob_hash, blob, size))
+        self._execute("UPDATE %s SET refcount=refcount+1 WHERE hash=?" % CONTENT_BLOBS,
+                      (blob_hash, ))
+        self._execute("INSERT OR REPLACE INTO %s (id, blob, hash) VALUES (?, ?, ?)"
+                      % PUBLISHED_CONTENTS, (content_id, encode_serialized_value(own), blob_hash))
+
+    def cached_versions(self):
+        '''Returns {block version key: BlockVersion} of all the cached block versions'''
+        c = self.connection.cursor()
+        c.execute("SELECT block_version FROM %s" % VERSION_ACCESS)
+        return {key: BlockVersion.deserialize(LEGACY_CODEC.decode(key))
+                for (key, ) in c.fetchall()}
+
+    def export_versions(self, dbfile, ser_versions):
+        '''Copies everything cached of the given block version keys to a new database
+        dbfile, with the same schema. Credentials are never exported'''
+        LocalDB(dbfile, journal_mode=None).disconnect()
+        c = self.connection.cursor()
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS selected_versions "
+                  "(block_version TEXT PRIMARY KEY)")
+        c.execute("ATTACH DATABASE ? AS bundle", (dbfile, ))
+        try:
+            with self.transaction():
+                self._execute("DELETE FROM temp.selected_versions")
+                self._execute("INSERT OR IGNORE INTO temp.selected_versions VALUES (?)",
+                              [(v, ) for v in ser_versions], many=True)
+                selected = "(SELECT block_version FROM temp.selected_versions)"
+                self._execute("INSERT INTO bundle.{access} (block_version, last_access) "
+                              "SELECT block_version, last_access FROM main.{access} "
+                              "WHERE block_version IN {selected}"
+                              .format(access=VERSION_ACCESS, selected=selected))
+                self._execute("INSERT INTO bundle.{refs} "
+                              "(reference, cell_id, content_id, block_version) "
+                              "SELECT reference, cell_id, content_id, block_version "
+                              "FROM main.{refs} WHERE block_version IN {selected}"
+                              .format(refs=PUBLISHED_REFERENCES, selected=selected))
+                self._execute("INSERT INTO bundle.{cells} (id, blob) SELECT id, blob "
+                              "FROM main.{cells} WHERE id IN (SELECT cell_id FROM bundle.{refs})"
+                              .format(cells=PUBLISHED_CELLS, refs=PUBLISHED_REFERENCES))
+                self._execute("INSERT INTO bundle.{contents} (id, blob, hash) "
+                              "SELECT id, blob, hash FROM main.{contents} "
+                              "WHERE id IN (SELECT content_id FROM bundle.{refs})"
+                              .format(contents=PUBLISHED_CONTENTS, refs=PUBLISHED_REFERENCES))
+                self._execute("INSERT INTO bundle.{blobs} (hash, blob, size, refcount) "
+                              "SELECT hash, blob, size, (SELECT count(*) FROM bundle.{contents} c "
+                              "WHERE c.hash=b.hash) FROM main.{blobs} b "
+                              "WHERE hash IN (SELECT hash FROM bundle.{contents})"
+                              .format(blobs=CONTENT_BLOBS, contents=PUBLISHED_CONTENTS))
+                for table in (SNAPSHOTS, DEP_TABLES, DELTAS):
+                    self._execute("INSERT INTO bundle.{table} (id, blob) SELECT id, blob "
+                                  "FROM main.{table} WHERE id IN {selected}"
+                                  .format(table=table, selected=selected))
+        finally:
+            c.execute("DETACH DATABASE bundle")
+
+    def import_versions(self, dbfile):
+        '''Merges in this cache the block versions of the database dbfile, created with
+        export_versions. Rows already cached are kept, so importing the same versions again
+        has no effect. Returns the number of new block versions'''
+        c = self.connection.cursor()
+        c.execute("ATTACH DATABASE ? AS bundle", (dbfile, ))
+        try:
+            with self.transaction():
+                c.execute("SELECT count(*) FROM bundle.{access} WHERE block_version NOT IN "
+                          "(SELECT block_version FROM main.{access})"
+                          .format(access=VERSION_ACCESS))
+                new_versions = c.fetchone()[0]
+                # Shared blobs count the new contents pointing to them
+                self._execute("INSERT OR IGNORE INTO main.{blobs} (hash, blob, size, refcount) "
+                              "SELECT hash, blob, size, 0 FROM bundle.{blobs}"
+                              .format(blobs=CONTENT_BLOBS))
+                self._execute("UPDATE main.{blobs} SET refcount=refcount+"
+                              "(SELECT count(*) FROM bundle.{contents} c WHERE c.hash={blobs}.hash "
+                              "AND c.id NOT IN (SELECT id FROM main.{contents})) "
+                              "WHERE hash IN (SELECT hash FROM bundle.{blobs})"
+                              .format(blobs=CONTENT_BLOBS, contents=PUBLISHED_CONTENTS))
+                self._execute("INSERT OR IGNORE INTO main.{contents} (id, blob, hash) "
+                              "SELECT id, blob, hash FROM bundle.{contents}"
+                              .format(contents=PUBLISHED_CONTENTS))
+                self._execute("INSERT OR IGNORE INTO main.{refs} "
+                              "(reference, cell_id, content_id, block_version) "
+                              "SELECT reference, cell_id, content_id, block_version "
+                              "FROM bundle.{refs}".format(refs=PUBLISHED_REFERENCES))
+                for table in (PUBLISHED_CELLS, SNAPSHOTS, DEP_TABLES, DELTAS):
+                    self._execute("INSERT OR IGNORE INTO main.{table} (id, blob) "
+                                  "SELECT id, blob FROM bundle.{table}".format(table=table))
+                self._execute("INSERT OR IGNORE INTO main.{access} (block_version, last_access) "
+                              "SELECT block_version, ? FROM bundle.{access}"
+                              .format(access=VERSION_ACCESS), (time.time(), ))
+        finally:
+            c.execute("DETACH DATABASE bundle")
+        return new_versions
+
+    def contents_stats(self):
+        '''Returns a dict with the deduplication of published contents and the storage size'''
+        c = self.connection.cursor()
+        c.execute("SELECT count(*) FROM %s" % PUBLISHED_CONTENTS)
+        contents = c.fetchone()[0]
+        c.execute("SELECT count(*), sum(refcount), sum(size * refcount), sum(length(blob)) "
+                  "FROM %s" % CONTENT_BLOBS)
+        blobs, blob_refs, size, stored = c.fetchone()
+        db_size = sum(os.path.getsize(path) for path in (self.dbfile, self.dbfile + '-wal')
+                      if os.path.exists(path))
+        return {'contents': contents,
+                'unique_contents': blobs,
+                'dedup_ratio': float(blob_refs or 0) / blobs if blobs else 1.0,
+                'contents_size': size or 0,
+                'stored_size': stored or 0,
+                'db_size': db_size}
+
+    def evict(self, max_size, time_budget, vacuum_pages=None):
+        '''Removes the least recently used block versions while the used size of the
+        database is bigger than max_size bytes, and returns the freed pages to disk.
+        It runs at most time_budget seconds, so commands are not stalled; the next
+        commands will continue evicting. Versions used by this instance are never evicted.
+        Returns the number of evicted versions
+        '''
+        self.store_access()
+        deadline = time.time() + time_budget
+        evicted = 0
+        c = self.connection.cursor()
+        while self.used_size() > max_size and time.time() < deadline:
+            c.execute("SELECT block_version FROM %s ORDER BY last_access LIMIT ?"
+                      % VERSION_ACCESS, (EVICTION_BATCH + len(self._touched), ))
+            versions = [row[0] for row in c.fetchall() if row[0] not in self._touched]
+            versions = versions[:EVICTION_BATCH]
+            if not versions:
+                break
+            with self.transaction():
+                for ser_version in versions:
+                    self._remove_version(ser_version)
+            evicted += len(versions)
+        if evicted:
+            logger.debug("Evicted %d block versions from %s" % (evicted, self.dbfile))
+        self.incremental_vacuum(vacuum_pages)
+        return evicted
 
     def clean(self):
-        self.delete_all(PUBLISHED_CELLS)
-        self.delete_all(PUBLISHED_CONTENTS)
-        self.delete_all(PUBLISHED_REFERENCES)
-        self.delete_all(SNAPSHOTS)
-        self.delete_all(DEP_TABLES)
-        self.delete_all(DELTAS)
-        # Never loose who the user is. Only invalidate token
-        login, _ = self.get_login()
-        self.set_login((login, None))
+        with self.transaction():
+            self.delete_all(PUBLISHED_CELLS)
+            self.delete_all(PUBLISHED_CONTENTS)
+            self.delete_all(CONTENT_BLOBS)
+            self.delete_all(PUBLISHED_REFERENCES)
+            self.delete_all(SNAPSHOTS)
+            self.delete_all(DEP_TABLES)
+            self.delete_all(DELTAS)
+            self.delete_all(VERSION_ACCESS)
+            self.delete_all(DEV_VALIDATIONS)
+            # Never loose who the user is. Only invalidate token
+            login, _ = self.get_login()
+            self.set_login((login, None))
+        self._touched.clear()
+        self._accessed.clear()
+        # Full vacuum, also converts caches of older clients to auto_vacuum INCREMENTAL
         self.vacuum()
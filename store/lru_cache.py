@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''In memory dict-like cache with a maximum number of items. When full, the least
+    recently used item is discarded. Keeps hits and misses counts for stats'''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items[key] = value  # Moved to the end, most recently used
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, predicate):
+        '''Removes the items whose key matches predicate'''
+        for key in [key for key in self._items if predicate(key)]:
+            del self._items[key]
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __str__(self):
+        total = self.hits + self.misses
+        ratio = 100.0 * self.hits / total if total else 0
+        return '%d hits, %d misses (%.0f%% hit ratio), %d items' % (self.hits, self.misses,
+                                                                    ratio, len(self._items))
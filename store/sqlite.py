@@ -1,10 +1,31 @@
 import sqlite3
 from biicode.client.exception import ClientException
 import os
+import random
+import time
+import zlib
+import hashlib
+from contextlib import contextmanager
+from biicode.client.store.blob_codec import BSONCodec, ReprCodec
+from biicode.client.conf import (BII_DB_BUSY_TIMEOUT, BII_DB_CACHE_SIZE, BII_DB_MMAP_SIZE,
+                                 BII_DB_BUSY_RETRIES)
+from biicode.common.utils.bii_logging import logger
+
+
+def _is_busy_error(error):
+    message = str(error)
+    return 'locked' in message or 'busy' in message
 
 
 class SQLiteDB(object):
-    def __init__(self, dbfile_path):
+    commit_count = 0  # Commits done by all the databases, for debugging stats
+
+    def __init__(self, dbfile_path, journal_mode=None, read_only=False):
+        '''journal_mode: None to keep SQLite default (rollback journal), or "WAL" to let
+        readers and a writer from different processes work concurrently
+        read_only: never write the database, e.g. in a folder the user can't write'''
+        if read_only and not os.path.exists(dbfile_path):
+            raise ClientException('Database %s does not exist' % dbfile_path)
         if not os.path.exists(dbfile_path):
             par = os.path.dirname(dbfile_path)
             if not os.path.exists(par):
@@ -12,9 +33,14 @@ class SQLiteDB(object):
             dbfile = open(dbfile_path, 'w+')
             dbfile.close()
         self.dbfile = dbfile_path
+        self.journal_mode = journal_mode
+        self.read_only = read_only
+        self._transaction_level = 0
 
     def init(self):
         """Called when database doesn't exist"""
+        if self.read_only:
+            return
         try:
             statement = self.connection.cursor()
             statement.execute("PRAGMA auto_vacuum = INCREMENTAL;")
@@ -23,23 +49,108 @@ class SQLiteDB(object):
 
     def connect(self):
         try:
+            # Timeout (seconds) is how long SQLite waits for locks of other processes.
+            # Connections can be used from other threads (e.g. storing credentials from the
+            # threads of remote calls), but never concurrently
             self.connection = sqlite3.connect(self.dbfile,
-                                              detect_types=sqlite3.PARSE_DECLTYPES)
+                                              detect_types=sqlite3.PARSE_DECLTYPES,
+                                              timeout=BII_DB_BUSY_TIMEOUT,
+                                              check_same_thread=False)
             self.connection.text_factory = str
+            self._set_pragmas()
         except Exception as e:
             raise ClientException('Could not connect to local cache', e)
 
+    def _set_pragmas(self):
+        c = self.connection.cursor()
+        if self.read_only:
+            # Writes fail, instead of waiting for a lock or creating a journal
+            c.execute("PRAGMA query_only = ON;")
+        else:
+            # Only has effect in a new database, and it must be set before enabling WAL
+            c.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        if self.journal_mode and not self.read_only:
+            # Persistent in the database file, only the first connection really changes it
+            try:
+                c.execute("PRAGMA journal_mode = %s;" % self.journal_mode)
+                mode = c.fetchone()[0]
+                if mode.lower() != self.journal_mode.lower():
+                    logger.debug("Unable to set %s journal mode in %s, using %s"
+                                 % (self.journal_mode, self.dbfile, mode))
+                elif mode.lower() == 'wal':
+                    # Safe with WAL, commits don't need to wait for the disk
+                    c.execute("PRAGMA synchronous = NORMAL;")
+            except sqlite3.OperationalError as e:
+                logger.debug("Unable to set journal mode in %s: %s" % (self.dbfile, e))
+        # Negative cache_size is in KiB instead of pages
+        c.execute("PRAGMA cache_size = -%d;" % BII_DB_CACHE_SIZE)
+        c.execute("PRAGMA mmap_size = %d;" % BII_DB_MMAP_SIZE)
+        c.execute("PRAGMA temp_store = MEMORY;")
+        c.close()
+
+    def _execute(self, query, params=(), many=False):
+        '''Executes a write statement. If the database is still locked by other process
+        after waiting the busy timeout, it is retried. A statement failing that way has
+        no effect, so retrying is safe even inside a transaction
+        '''
+        cursor = self.connection.cursor()
+        execute = cursor.executemany if many else cursor.execute
+        self._retry_on_busy(execute, query, params)
+        return cursor
+
+    def _retry_on_busy(self, func, *args):
+        for retry in range(BII_DB_BUSY_RETRIES + 1):
+            try:
+                return func(*args)
+            except sqlite3.OperationalError as e:
+                if not _is_busy_error(e) or retry == BII_DB_BUSY_RETRIES:
+                    raise
+                wait = random.uniform(0, 0.1 * 2 ** retry)
+                logger.debug("%s is locked, retrying in %.2fs" % (self.dbfile, wait))
+                time.sleep(wait)
+
     def disconnect(self):
         self.connection.close()
 
+    @contextmanager
+    def transaction(self):
+        '''Groups all the writes done inside in a single commit. It can be nested, only
+        the outermost transaction commits. If an exception reaches the outermost
+        transaction, all the writes are rolled back
+        '''
+        self._transaction_level += 1
+        try:
+            yield
+        except BaseException:
+            self._transaction_level -= 1
+            if self._transaction_level == 0:
+                self.connection.rollback()
+            raise
+        self._transaction_level -= 1
+        self._commit()
+
+    def _commit(self):
+        '''Commits, unless inside a transaction, which will commit when finished'''
+        if self._transaction_level == 0:
+            # A busy commit keeps the transaction, so it can be retried
+            self._retry_on_busy(self.connection.commit)
+            SQLiteDB.commit_count += 1
+
+    def flush(self):
+        '''Commits the writes done so far inside a transaction, so they are kept if the
+        transaction fails later. The transaction goes on for the following writes. Outside
+        transactions the writes are already committed, there is nothing to do'''
+        if self._transaction_level > 0:
+            self._retry_on_busy(self.connection.commit)
+            SQLiteDB.commit_count += 1
+
     def _generic_write(self, table, key, value, key_field, value_field,
                        write='INSERT OR REPLACE'):
-        statement = self.connection.cursor()
         query = "%s INTO %s (%s, %s) VALUES (?, ?)" % (write, table,
                                                        key_field,
                                                        value_field)
-        statement.execute(query, (key, value))
-        self.connection.commit()
+        self._execute(query, (key, value))
+        self._commit()
 
     def _generic_write_multi(self, table, id_value_list, key_field,
                              value_field, write='INSERT OR REPLACE'):
@@ -48,28 +159,25 @@ class SQLiteDB(object):
         '''
         serial_rows = [(str(ID), encode_serialized_value(obj.serialize()))
                        for ID, obj in id_value_list]
-        c = self.connection.cursor()
         query = "%s INTO %s (%s, %s) VALUES (?, ?)" % (write, table,
                                                        key_field, value_field)
-        c.executemany(query, serial_rows)
-        self.connection.commit()
+        self._execute(query, serial_rows, many=True)
+        self._commit()
 
     def delete(self, ID, table):
-        statement = self.connection.cursor()
         command = 'DELETE from %s where id=(?)' % table
-        statement.execute(command, (ID,))
-        self.connection.commit()
+        self._execute(command, (ID,))
+        self._commit()
 
     def delete_multi(self, IDs, table):
-        c = self.connection.cursor()
         command = "DELETE from %s where id=(?)" % (table)
-        c.executemany(command, [[ID] for ID in IDs])
+        self._execute(command, [[ID] for ID in IDs], many=True)
+        self._commit()
 
     def delete_all(self, table):
-        statement = self.connection.cursor()
         command = "DELETE FROM %s;" % (table)
-        statement.execute(command)
-        self.connection.commit()
+        self._execute(command)
+        self._commit()
 
     def vacuum(self):
         '''
@@ -89,15 +197,53 @@ class SQLiteDB(object):
         c = self.connection.cursor()
         c.execute('VACUUM;')
 
+    def incremental_vacuum(self, pages=None):
+        '''Returns up to pages free pages (all if None) to the filesystem, without rebuilding
+        the database like VACUUM does. Only works for databases with auto_vacuum INCREMENTAL
+        (created by this client, or converted by a full vacuum())
+        '''
+        query = 'PRAGMA incremental_vacuum(%d);' % pages if pages else 'PRAGMA incremental_vacuum;'
+        # The pragma frees one page per returned row, so it has to be fully iterated
+        self._retry_on_busy(lambda: self.connection.cursor().execute(query).fetchall())
 
-def encode_serialized_value(value):
-    '''json is other way to do it if value was a dict
-       can even be replaced here with pickle but is less legible'''
+    def used_size(self):
+        '''Size in bytes of the database pages in use, not counting the free ones'''
+        c = self.connection.cursor()
+        c.execute('PRAGMA page_count;')
+        page_count = c.fetchone()[0]
+        c.execute('PRAGMA freelist_count;')
+        free_count = c.fetchone()[0]
+        c.execute('PRAGMA page_size;')
+        return (page_count - free_count) * c.fetchone()[0]
+
+
+# Codec used for all the new written values. Rows written by older clients (TEXT instead
+# of BLOB) are still readable with LEGACY_CODEC, until MigrateBlobCodec converts them
+BLOB_CODEC = BSONCodec()
+LEGACY_CODEC = ReprCodec()
+
+
+def encode_serialized_key(value):
+    '''Keys are stored as text, so they can be compared and indexed, and are never decoded'''
     return value.__repr__()
 
 
+def encode_serialized_value(value):
+    return sqlite3.Binary(BLOB_CODEC.encode(value))
+
+
 def decode_serialized_value(value):
-    '''json is other way to do it if value was a dict
-   can even be replaced here with pickle but is less legible'''
-    from bson.binary import Binary  # DO NOT REMOVE! Necessary for eval
-    return eval(value)
+    if isinstance(value, basestring):  # TEXT row, written with legacy codec
+        return LEGACY_CODEC.decode(value)
+    return BLOB_CODEC.decode(value)
+
+
+def encode_compressed_value(value):
+    '''Returns (hash, compressed blob, uncompressed size) of value. The hash is the sha1
+    of the encoded value, so identical values have the same hash and can be stored once'''
+    data = BLOB_CODEC.encode(value)
+    return hashlib.sha1(data).hexdigest(), sqlite3.Binary(zlib.compress(data)), len(data)
+
+
+def decode_compressed_value(value):
+    return BLOB_CODEC.decode(zlib.decompress(value))
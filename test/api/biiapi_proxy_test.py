@@ -1,11 +1,15 @@
 
 import os
+import sqlite3
+import threading
+import time
 from biicode.common.model.resource import Resource
 from biicode.common.model.brl.cell_name import CellName
 from biicode.common.model.symbolic.reference import ReferencedResources, References
 from mock import Mock
 from biicode.client.store.localdb import LocalDB
-from biicode.client.api.biiapi_proxy import BiiAPIProxy
+from biicode.client.store.sqlite import SQLiteDB
+from biicode.client.api.biiapi_proxy import BiiAPIProxy, DELTA_INFO
 from biicode.common.test.bii_test_case import BiiTestCase
 from biicode.common.model.symbolic.block_version_table import BlockVersionTable
 from biicode.common.model.content import Content
@@ -17,6 +21,10 @@ from biicode.common.model.cells import SimpleCell
 from biicode.common.model.block_delta import BlockDelta
 from biicode.common.model.version_tag import DEV
 from biicode.common.api.biiapi import BiiAPI
+from biicode.client.api.biiapi_auth_manager import BiiApiAuthManager
+from biicode.client.exception import ConnectionErrorException
+from biicode.client.rest.bii_rest_api_client import BiiRestApiClient
+from biicode.client.test.rest.server_mock import BiiServerMock
 
 
 class BiiApiProxyTest(BiiTestCase):
@@ -66,6 +74,21 @@ class BiiApiProxyTest(BiiTestCase):
         self.assertFalse(self.restapi.get_published_resources.called)
         self.assertEqual(c, self.referenced_resources)
 
+    def test_cached_resources_not_shared(self):
+        s = References()
+        s[self.block_version] = {CellName("alf.c"), CellName("willy.c")}
+
+        # Callers modifying the resources they get don't modify the ones of other callers
+        for _ in range(3):
+            c = self.proxy.get_published_resources(s)
+            alf = c[self.block_version][CellName("alf.c")]
+            self.assertEqual(ID((0, 1, 2)), alf.cell.ID)
+            self.assertEqual(Blob("Hello Alf"), alf.content.load)
+            alf.cell.ID = ID((0, 1, 99))
+            alf.content.load = Blob("Modified")
+        self.assertEqual(4, self.proxy._resources.hits)
+        self.assertEqual(1, self.restapi.get_published_resources.call_count)
+
     def test_cached_snapshot(self):
         self.proxy.get_cells_snapshot(self.block_version)
 
@@ -85,3 +108,267 @@ class BiiApiProxyTest(BiiTestCase):
         snap = self.proxy.get_dep_table(self.block_version)
         self.assertFalse(self.restapi.get_dep_table.called)
         self.assertEqual(self.dep_table, snap)
+
+    def test_memory_cache_invalidated(self):
+        s = References()
+        s[self.block_version] = {CellName("alf.c"), CellName("willy.c")}
+        self.proxy.get_published_resources(s)
+        self.proxy.get_published_resources(s)
+        self.assertEqual(2, self.proxy._resources.hits)
+
+        # Cached version no longer matches server one, so it is removed from all caches
+        self.restapi.get_version_delta_info.return_value = BlockDelta('changed', DEV, None)
+        self.proxy.check_valid([self.block_version], publish=False)
+        self.restapi.get_published_resources.called = False
+        c = self.proxy.get_published_resources(s)
+        self.assertTrue(self.restapi.get_published_resources.called)
+        self.assertEqual(c, self.referenced_resources)
+
+    def test_delta_infos_requested_concurrently(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        s = References()
+        for version in range(20):
+            s[BlockVersion(brl_block, version)] = {CellName("alf.c")}
+        self.restapi.get_published_resources.return_value = ReferencedResources()
+        self.proxy.get_published_resources(s)
+        # Each version requested once, concurrently, and then not requested again
+        # (call_count is not thread safe, the list of calls is)
+        self.assertEqual(20, len(self.restapi.get_version_delta_info.call_args_list))
+        self.assertEqual({}, self.proxy._prefetched[DELTA_INFO])
+
+    def test_check_valid_concurrent_calls(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        versions = [BlockVersion(brl_block, v) for v in range(8)]
+        delta = BlockDelta('', DEV, None)
+        with self.localdb.transaction():
+            for version in versions:
+                self.localdb.upsert_delta_info(version, delta)
+        lock = threading.Lock()
+        calls = {'active': 0, 'peak': 0}
+
+        def get_version_delta_info(_):
+            with lock:
+                calls['active'] += 1
+                calls['peak'] = max(calls['peak'], calls['active'])
+            time.sleep(0.05)
+            with lock:
+                calls['active'] -= 1
+            return delta
+        self.restapi.get_version_delta_info.side_effect = get_version_delta_info
+
+        # Up to the given number of calls at the same time
+        for threads in (1, 4):
+            calls['peak'] = 0
+            proxy = BiiAPIProxy(self.localdb, self.restapi, Mock(), threads=threads)
+            proxy.check_valid(versions, publish=False)
+            self.assertEqual(threads, calls['peak'])
+
+    def test_prefetched_revalidation_keeps_etag(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        unchanged, changed = BlockVersion(brl_block, 1), BlockVersion(brl_block, 2)
+        delta = BlockDelta('', DEV, None)
+        for version in (unchanged, changed):
+            self.localdb.upsert_delta_info(version, delta)
+            self.localdb.set_dev_validation(version, '"etag%d"' % version.time)
+        self.restapi.get_version_delta_info.side_effect = \
+            lambda v: delta if v == unchanged else BlockDelta('changed', DEV, None)
+        self.restapi.revalidate_version_delta_info = Mock()
+        s = References()
+        s[unchanged] = {CellName("alf.c")}
+        s[changed] = {CellName("alf.c")}
+        self.restapi.get_published_resources.return_value = ReferencedResources()
+
+        # Both delta infos requested in advance, unconditionally
+        BiiAPIProxy(self.localdb, self.restapi, Mock(), dev_ttl=0).get_published_resources(s)
+        self.assertFalse(self.restapi.revalidate_version_delta_info.called)
+        self.assertEqual('"etag1"', self.localdb.get_dev_validation(unchanged)[1])
+        self.assertIsNone(self.localdb.get_dev_validation(changed)[1])
+
+    def test_paged_download_resumed(self):
+        s = References()
+        s[self.block_version] = {CellName("alf.c"), CellName("willy.c")}
+        requested = []
+
+        def get_published_resources(references):
+            requested.append(references)
+            if len(requested) == 2:
+                raise ConnectionErrorException('Connection dropped')
+            result = ReferencedResources()
+            for block_version, cell_names in references.iteritems():
+                for cell_name in cell_names:
+                    result[block_version][cell_name] = \
+                        self.referenced_resources[block_version][cell_name]
+            return result
+        self.restapi.get_published_resources.side_effect = get_published_resources
+
+        proxy = BiiAPIProxy(self.localdb, self.restapi, Mock(), page_size=1)
+        with self.assertRaises(ConnectionErrorException):
+            with proxy.transaction():
+                proxy.get_published_resources(s)
+        first_page = requested[0][self.block_version]
+        self.assertEqual(1, len(first_page))
+
+        # The first page was stored, only the second one is downloaded again
+        proxy = BiiAPIProxy(self.localdb, self.restapi, Mock(), page_size=1)
+        c = proxy.get_published_resources(s)
+        self.assertEqual(3, len(requested))
+        self.assertEqual(s[self.block_version] - first_page,
+                         requested[2][self.block_version])
+        self.assertEqual(c, self.referenced_resources)
+
+    def test_cache_only_when_server_unreachable(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        versions = [BlockVersion(brl_block, version) for version in range(3)]
+        delta = BlockDelta('', DEV, None)
+        for version in versions:
+            self.localdb.upsert_delta_info(version, delta)
+        self.restapi.get_version_delta_info.side_effect = ConnectionErrorException('Down')
+        for version in versions:
+            self.assertEqual(delta, self.proxy.get_version_delta_info(version))
+        # After the first failure, cached DEV versions are not checked with the server
+        self.assertEqual(1, self.restapi.get_version_delta_info.call_count)
+
+    def test_offline(self):
+        s = References()
+        s[self.block_version] = {CellName("alf.c"), CellName("willy.c")}
+        self.proxy.get_published_resources(s)
+        self.restapi.reset_mock()
+
+        proxy = BiiAPIProxy(self.localdb, self.restapi, Mock(), dev_ttl=0)
+        proxy.set_offline(ConnectionErrorException('--offline option'))
+        # Cached DEV version used without checking it
+        self.assertEqual(self.referenced_resources, proxy.get_published_resources(s))
+        s[self.block_version].add(CellName("missing.c"))
+        with self.assertRaisesRegexp(ConnectionErrorException, "missing.c"):
+            proxy.get_published_resources(s)
+        with self.assertRaises(ConnectionErrorException):
+            proxy.get_dep_table(self.block_version)
+        self.assertEqual([], self.restapi.method_calls)
+
+    def test_prefetched_delta_infos_single_commit(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        alf = self.referenced_resources[self.block_version][CellName("alf.c")]
+        s = References()
+        resources = ReferencedResources()
+        for version in range(5):
+            s[BlockVersion(brl_block, version)] = {CellName("alf.c")}
+            resources[BlockVersion(brl_block, version)][CellName("alf.c")] = alf
+        self.restapi.get_published_resources.return_value = resources
+
+        commits = SQLiteDB.commit_count
+        self.assertEqual(resources, self.proxy.get_published_resources(s))
+        # One for the delta infos, other for the downloaded files
+        self.assertEqual(commits + 2, SQLiteDB.commit_count)
+        self.assertEqual(5, len(self.restapi.get_version_delta_info.call_args_list))
+
+    def test_prefetched_dep_tables_single_commit(self):
+        dependencies = [BlockVersion(BRLBlock('dummy/dummy/dep%d/master' % i), 0)
+                        for i in range(3)]
+        tables = {version: BlockVersionTable() for version in dependencies}
+        tables[self.block_version] = BlockVersionTable()
+        for version in dependencies:
+            tables[self.block_version][version.block_name] = version
+        self.restapi.get_dep_table.side_effect = lambda version: tables[version]
+
+        commits = SQLiteDB.commit_count
+        self.proxy.get_dep_table(self.block_version)
+        # Dependencies requested together, and stored in a single commit
+        self.assertEqual(commits + 3, SQLiteDB.commit_count)
+        commits = SQLiteDB.commit_count
+        for version in dependencies:
+            self.assertEqual(tables[version], self.proxy.get_dep_table(version))
+        self.assertEqual(commits, SQLiteDB.commit_count)
+        self.assertEqual(4, len(self.restapi.get_dep_table.call_args_list))
+        self.assertEqual(4, len(self.restapi.get_version_delta_info.call_args_list))
+
+    def test_cache_not_locked_during_remote_calls(self):
+        """ Other bii processes can write in the cache while this one waits for remote
+        """
+        def cache_locked():
+            other = sqlite3.connect(self.localdb.dbfile, timeout=0)
+            try:
+                other.execute("BEGIN IMMEDIATE")
+                other.rollback()
+                return False
+            except sqlite3.OperationalError:
+                return True
+            finally:
+                other.close()
+
+        locked = []
+
+        def get_published_resources(_):
+            locked.append(cache_locked())
+            return self.referenced_resources
+
+        def get_version_delta_info(_):
+            locked.append(cache_locked())
+            return BlockDelta('changed', DEV, None)
+        self.restapi.get_published_resources.side_effect = get_published_resources
+        self.restapi.get_version_delta_info.side_effect = get_version_delta_info
+        s = References()
+        s[self.block_version] = {CellName("alf.c"), CellName("willy.c")}
+
+        proxy = BiiAPIProxy(self.localdb, self.restapi, Mock(), page_size=1)
+        proxy.get_published_resources(s)
+        proxy.check_valid([self.block_version], publish=False)
+        self.assertEqual([False] * 4, locked)
+
+
+class BiiApiProxyServerTest(BiiTestCase):
+    '''Proxy calling a stand-in server through the real rest client'''
+
+    def setUp(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        self.versions = [BlockVersion(brl_block, t) for t in range(5)]
+        self.localdb = LocalDB(os.path.join(self.new_tmp_folder(), 'bii.db'))
+        delta = BlockDelta('', DEV, None)
+        with self.localdb.transaction():
+            for version in self.versions:
+                self.localdb.upsert_delta_info(version, delta)
+
+    def _proxy(self, server, **kwargs):
+        auth_manager = BiiApiAuthManager(BiiRestApiClient(server.url), Mock(), self.localdb)
+        return BiiAPIProxy(self.localdb, auth_manager, Mock(), **kwargs)
+
+    def _check_valid(self, batched):
+        server = BiiServerMock(batched)
+        try:
+            server.deltas.update({v: BlockDelta('', DEV, None) for v in self.versions})
+            proxy = self._proxy(server)
+            proxy.check_valid(self.versions, publish=False)
+            proxy.check_valid(self.versions, publish=False)
+            return server.requests
+        finally:
+            server.stop()
+
+    def test_delta_infos_coalesced(self):
+        requests = self._check_valid(batched=True)
+        self.assertEqual(['/v1/version_delta_infos'] * 2, requests)
+
+    def test_delta_infos_fallback(self):
+        requests = self._check_valid(batched=False)
+        # Batched call only tried once, then one call for each version
+        self.assertEqual(1, requests.count('/v1/version_delta_infos'))
+        self.assertEqual(11, len(requests))
+
+    def test_dev_versions_revalidated(self):
+        server = BiiServerMock()
+        try:
+            version = self.versions[0]
+            server.deltas[version] = BlockDelta('', DEV, None)
+            self._proxy(server, dev_ttl=0).get_version_delta_info(version)
+            # Unchanged, not downloaded again
+            self._proxy(server, dev_ttl=0).get_version_delta_info(version)
+            self.assertEqual(2, len(server.requests))
+            self.assertEqual(1, server.not_modified)
+            # Recently checked, not checked again
+            self._proxy(server).get_version_delta_info(version)
+            self.assertEqual(2, len(server.requests))
+            proxy = self._proxy(server)
+            proxy.refresh = True
+            proxy.get_version_delta_info(version)
+            self.assertEqual(3, len(server.requests))
+            self.assertEqual(2, server.not_modified)
+        finally:
+            server.stop()
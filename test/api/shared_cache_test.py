@@ -0,0 +1,137 @@
+import os
+from mock import Mock
+from biicode.common.model.resource import Resource
+from biicode.common.model.brl.cell_name import CellName
+from biicode.common.model.symbolic.reference import ReferencedResources, References
+from biicode.client.store.localdb import LocalDB
+from biicode.client.api.shared_cache import SharedCacheAPI
+from biicode.common.test.bii_test_case import BiiTestCase
+from biicode.common.model.content import Content
+from biicode.common.model.blob import Blob
+from biicode.common.model.id import ID
+from biicode.common.model.brl.brl_block import BRLBlock
+from biicode.common.model.symbolic.block_version import BlockVersion
+from biicode.common.model.cells import SimpleCell
+from biicode.common.model.block_delta import BlockDelta
+from biicode.common.model.version_tag import DEV
+from biicode.common.api.biiapi import BiiAPI
+
+
+class SharedCacheAPITest(BiiTestCase):
+
+    def setUp(self):
+        self.folder = self.new_tmp_folder()
+        self.block_version = BlockVersion(BRLBlock('dummy/dummy/block/master'), 0)
+        alf = Resource(SimpleCell("dummy/block/alf.c"),
+                       Content(ID((0, 1, 2)), Blob("Hello Alf")))
+        alf.cell.ID = ID((0, 1, 2))
+        self.referenced_resources = ReferencedResources()
+        self.referenced_resources[self.block_version][CellName("alf.c")] = alf
+        self.references = References()
+        self.references[self.block_version] = {CellName("alf.c")}
+
+        self.restapi = Mock(BiiAPI)
+        self.restapi.get_published_resources.return_value = self.referenced_resources
+        self.restapi.get_version_delta_info.return_value = BlockDelta('', DEV, None)
+        self.shared_db = LocalDB(os.path.join(self.folder, 'bii.db'), journal_mode='DELETE')
+
+    def tearDown(self):
+        self.shared_db.disconnect()
+
+    def _new_client(self):
+        '''Other user, with its own process, sharing the same cache'''
+        return SharedCacheAPI(self.shared_db, self.restapi)
+
+    def test_resources_shared(self):
+        client = self._new_client()
+        client.get_version_delta_info(self.block_version)
+        self.assertEqual(self.referenced_resources,
+                         client.get_published_resources(self.references))
+        self.assertEqual(1, self.restapi.get_published_resources.call_count)
+
+        client = self._new_client()
+        client.get_version_delta_info(self.block_version)
+        self.assertEqual(self.referenced_resources,
+                         client.get_published_resources(self.references))
+        self.assertEqual(1, self.restapi.get_published_resources.call_count)
+
+    def test_dev_version_not_checked_is_not_shared(self):
+        self._new_client().get_published_resources(self.references)
+        self._new_client().get_published_resources(self.references)
+        self.assertEqual(2, self.restapi.get_published_resources.call_count)
+
+    def test_updated_dev_version_removed(self):
+        client = self._new_client()
+        client.get_version_delta_info(self.block_version)
+        client.get_published_resources(self.references)
+
+        self.restapi.get_version_delta_info.return_value = BlockDelta('changed', DEV, None)
+        client = self._new_client()
+        client.get_version_delta_info(self.block_version)
+        client.get_published_resources(self.references)
+        self.assertEqual(2, self.restapi.get_published_resources.call_count)
+
+    def _share_revalidated(self, etag):
+        '''Shares the resources of a version revalidated with the given response etag'''
+        delta = BlockDelta('', DEV, None)
+        self.restapi.revalidate_version_delta_info = Mock(return_value=(delta, etag))
+        client = self._new_client()
+        client.revalidate_version_delta_info(self.block_version)
+        client.get_published_resources(self.references)
+
+    def test_not_modified_dev_version_shared(self):
+        self._share_revalidated('"etag"')
+
+        # Other user, with the version cached from the same response
+        self.restapi.revalidate_version_delta_info.return_value = (None, '"etag"')
+        client = self._new_client()
+        self.assertEqual((None, '"etag"'),
+                         client.revalidate_version_delta_info(self.block_version, '"etag"'))
+        self.assertEqual(self.referenced_resources,
+                         client.get_published_resources(self.references))
+        self.assertEqual(1, self.restapi.get_published_resources.call_count)
+
+    def test_not_modified_other_response_not_shared(self):
+        self._share_revalidated('"etag"')
+
+        # The shared copy might not be the one of the user
+        self.restapi.revalidate_version_delta_info.return_value = (None, '"other"')
+        client = self._new_client()
+        client.revalidate_version_delta_info(self.block_version, '"other"')
+        client.get_published_resources(self.references)
+        self.assertEqual(2, self.restapi.get_published_resources.call_count)
+
+    def test_read_only_shared_cache(self):
+        client = self._new_client()
+        client.get_version_delta_info(self.block_version)
+        client.get_published_resources(self.references)
+        self.shared_db.disconnect()
+
+        # Team member without write permission in the shared folder
+        dbfile = self.shared_db.dbfile
+        os.chmod(dbfile, 0444)
+        os.chmod(self.folder, 0555)
+        try:
+            self.shared_db = LocalDB(dbfile, journal_mode='DELETE', read_only=True,
+                                     track_access=False)
+            stat = os.stat(dbfile)
+            client = self._new_client()
+            client.get_version_delta_info(self.block_version)
+            self.assertEqual(self.referenced_resources,
+                             client.get_published_resources(self.references))
+            self.assertEqual(1, self.restapi.get_published_resources.call_count)
+
+            # Changed in server, the shared copy can't be updated, so it is not used
+            self.restapi.get_version_delta_info.return_value = BlockDelta('changed', DEV, None)
+            client = self._new_client()
+            client.get_version_delta_info(self.block_version)
+            self.assertEqual(self.referenced_resources,
+                             client.get_published_resources(self.references))
+            self.assertEqual(2, self.restapi.get_published_resources.call_count)
+
+            self.assertEqual((stat.st_mtime, stat.st_size),
+                             (os.stat(dbfile).st_mtime, os.stat(dbfile).st_size))
+            self.assertEqual(['bii.db'], os.listdir(self.folder))
+        finally:
+            os.chmod(self.folder, 0755)
+            os.chmod(dbfile, 0644)
@@ -0,0 +1,129 @@
+import unittest
+import zlib
+from biicode.client.rest.bii_rest_api_client import BiiRestApiClient, gzip_compress
+from biicode.client.test.rest.server_mock import BiiServerMock, LocalServer, KeepAliveHandler
+from biicode.common.utils.bson_encoding import decode_bson, encode_bson
+from biicode.common.model.brl.brl_block import BRLBlock
+from biicode.common.model.brl.cell_name import CellName
+from biicode.common.model.symbolic.block_version import BlockVersion
+from biicode.common.model.symbolic.block_version_table import BlockVersionTable
+from biicode.common.model.block_delta import BlockDelta
+from biicode.common.model.version_tag import STABLE
+from biicode.common.exception import NotFoundException
+from biicode.client.rest.rest_stats import RestStats
+
+
+class BiiRestApiClientBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BiiServerMock()
+        self.client = BiiRestApiClient(self.server.url)
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        self.versions = [BlockVersion(brl_block, t) for t in range(3)]
+        for version in self.versions:
+            self.server.deltas[version] = BlockDelta('', STABLE, None)
+            self.server.dep_tables[version] = BlockVersionTable()
+            self.server.snapshots[version] = [CellName("alf.c")]
+        self.missing = BlockVersion(brl_block, 10)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_batched_calls(self):
+        requested = self.versions + [self.missing]
+        deltas = self.client.get_version_delta_infos(requested)
+        found = {v: d for v, d in deltas.iteritems() if d is not None}
+        self.assertEqual(self.server.deltas, found)
+        self.assertIsNone(deltas[self.missing])
+        tables = self.client.get_dep_tables(requested)
+        found = {v: t for v, t in tables.iteritems() if t is not None}  # Empty tables are falsy
+        self.assertEqual(self.server.dep_tables, found)
+        snapshots = self.client.get_cells_snapshots(requested)
+        found = {v: s for v, s in snapshots.iteritems() if s is not None}
+        self.assertEqual(self.server.snapshots, found)
+        self.assertEqual(['/v1/version_delta_infos', '/v1/block_version_tables',
+                          '/v1/cells_snapshots'], self.server.requests)
+
+    def test_single_calls(self):
+        self.assertEqual(self.server.deltas[self.versions[0]],
+                         self.client.get_version_delta_info(self.versions[0]))
+        self.assertEqual(self.server.dep_tables[self.versions[0]],
+                         self.client.get_dep_table(self.versions[0]))
+        with self.assertRaises(NotFoundException):
+            self.client.get_version_delta_info(self.missing)
+
+    def test_calls_recorded(self):
+        stats = RestStats()
+        self.client.call_hook = stats.add
+        self.client.get_version_delta_info(self.versions[0])
+        with self.assertRaises(NotFoundException):
+            self.client.get_version_delta_info(self.missing)
+        found, missing = stats.calls
+        self.assertEqual('get_version_delta_info', found['function'])
+        self.assertEqual('dummy', found['url_params']['user_name'])
+        self.assertEqual(200, found['status'])
+        self.assertGreater(found['received_bytes'], 0)
+        self.assertGreaterEqual(found['latency'], 0)
+        self.assertEqual(404, missing['status'])
+
+    def test_batched_calls_not_supported(self):
+        self.server.batched = False
+        with self.assertRaises(NotFoundException):
+            self.client.get_version_delta_infos(self.versions)
+
+
+class GzipEchoHandler(KeepAliveHandler):
+    '''Returns the received data, gzip compressed. Accepts gzip compressed requests if
+    server.accept_gzip, registering the encoding of the requests in server.encodings'''
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        encoding = self.headers.get('Content-Encoding')
+        self.server.encodings.append(encoding)
+        if encoding == 'gzip':
+            if not self.server.accept_gzip:
+                return self.send(415, 'Unsupported Media Type')
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        content = gzip_compress(str(encode_bson({'return': decode_bson(body)['data']})))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/bson')
+        self.send_header('Content-Encoding', 'gzip')
+        if self.server.accept_gzip:
+            self.send_header('Accept-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class BiiRestApiClientCompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer(GzipEchoHandler)
+        self.server.encodings = []
+        self.server.accept_gzip = True
+        self.client = BiiRestApiClient(self.server.url)
+        self.data = 'int main() { return 0; }\n' * 1000
+
+    def tearDown(self):
+        self.server.stop()
+
+    def echo(self, data):
+        return self.client.bson_jwt_call('get_server_info', data={'data': data})
+
+    def test_compressed_when_accepted(self):
+        self.assertEqual(self.data, self.echo(self.data))
+        self.assertEqual(self.data, self.echo(self.data))
+        # Until the first response, the client doesn't know the server accepts gzip
+        self.assertEqual([None, 'gzip'], self.server.encodings)
+
+    def test_small_not_compressed(self):
+        self.echo('')
+        self.assertEqual('hello', self.echo('hello'))
+        self.assertEqual([None, None], self.server.encodings)
+
+    def test_not_accepted_sent_uncompressed(self):
+        self.server.accept_gzip = False
+        self.client.compress_requests = True
+        self.assertEqual(self.data, self.echo(self.data))
+        self.assertEqual(self.data, self.echo(self.data))
+        self.assertEqual(['gzip', None, None], self.server.encodings)
@@ -1,10 +1,14 @@
 
 import unittest
 import urllib
+import time
 from mock import Mock
 from biicode.client.rest.rest_api import (RestApiClient, HttpMethodNotImplementedException,
-                                          MethodNotFoundInApiException, InvalidURLException)
+                                          MethodNotFoundInApiException, InvalidURLException,
+                                          pooled_session, CircuitBreaker)
 from biicode.common.settings.fixed_string import FixedStringWithValue
+from biicode.client.exception import ConnectionErrorException
+from biicode.client.test.rest.server_mock import LocalServer, FlakyServer
 
 
 get_mock = Mock()
@@ -100,3 +104,91 @@ class RestApiTest(unittest.TestCase):
             self.assertFalse(http_method_mock.called)
             self.api.call(method, self.url_params)
             self.assertTrue(http_method_mock.called)
+
+
+def _local_client(server, session=None):
+    return RestApiClient(server.url, {'ping': {'pattern': '/ping', 'method': "GET"}},
+                         session=session)
+
+
+class PooledSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connection_reused(self):
+        api = _local_client(self.server, pooled_session(1, 1))
+        for _ in range(10):
+            self.assertEqual('pong', api.call('ping').content)
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_connection_per_request_without_pool(self):
+        api = _local_client(self.server)
+        for _ in range(10):
+            self.assertEqual('pong', api.call('ping').content)
+        self.assertEqual(10, len(self.server.connections))
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FlakyServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _client(self, **kwargs):
+        return RestApiClient(self.server.url,
+                             {'ping': {'pattern': '/ping', 'method': "GET"},
+                              'post': {'pattern': '/post', 'method': "POST"}},
+                             **kwargs)
+
+    def test_retried_until_success(self):
+        self.server.failures = 2
+        api = self._client(retries=3, backoff=0.01)
+        self.assertEqual('pong', api.call('ping').content)
+        self.assertEqual(3, self.server.requests)
+
+    def test_retries_exhausted(self):
+        self.server.failures = 10
+        api = self._client(retries=2)
+        with self.assertRaises(ConnectionErrorException):
+            api.call('ping')
+        self.assertEqual(3, self.server.requests)
+
+    def test_not_idempotent_not_retried(self):
+        self.server.failures = 1
+        api = self._client(retries=3)
+        with self.assertRaises(ConnectionErrorException):
+            api.call('post')
+        self.assertEqual(1, self.server.requests)
+
+    def test_circuit_breaker(self):
+        self.server.failures = 10
+        api = self._client(retries=5, circuit_breaker=CircuitBreaker(3, reset_time=0.2))
+        with self.assertRaises(ConnectionErrorException):
+            api.call('ping')
+        # Opened after 3 failures, the rest of retries and calls fail without connecting
+        self.assertEqual(3, self.server.requests)
+        with self.assertRaises(ConnectionErrorException):
+            api.call('ping')
+        self.assertEqual(3, self.server.requests)
+
+        time.sleep(0.3)
+        self.server.failures = 0
+        self.assertEqual('pong', api.call('ping').content)
+        self.assertEqual(4, self.server.requests)
+
+    def test_endpoint_timeouts(self):
+        api = RestApiClient(self.server.url,
+                            {'fast': {'pattern': '/ping', 'method': "GET", 'timeout': 1},
+                             'slow': {'pattern': '/ping', 'method': "GET", 'timeout': 1},
+                             'ping': {'pattern': '/ping', 'method': "GET"}},
+                            timeout=10, timeouts={'slow': 60})
+        self.assertEqual(1, api._get_timeout('fast'))
+        self.assertEqual(60, api._get_timeout('slow'))
+        self.assertEqual(10, api._get_timeout('ping'))
+
@@ -0,0 +1,34 @@
+import json
+import os
+from biicode.common.test.bii_test_case import BiiTestCase
+from biicode.client.rest.rest_stats import RestStats
+
+
+def _call(function, status=200, latency=0.1):
+    return {'function': function, 'url_params': {}, 'status': status, 'start': 0,
+            'latency': latency, 'encode_time': 0.01, 'decode_time': 0.02,
+            'request_bytes': 2048, 'sent_bytes': 1024, 'response_bytes': 4096,
+            'received_bytes': 2048}
+
+
+class RestStatsTest(BiiTestCase):
+
+    def setUp(self):
+        self.stats = RestStats()
+        self.stats.add(_call('get_dep_table'))
+        self.stats.add(_call('get_dep_table', status=404, latency=0.3))
+        self.stats.add(_call('publish', status=None))
+
+    def test_summary(self):
+        lines = self.stats.summary()
+        self.assertIn('3 calls to server in 0.500s, sent 3.0 KB, received 6.0 KB', lines[0])
+        self.assertIn('get_dep_table', lines[1])
+        self.assertIn('2 calls (1 errors)    0.400s (max 0.300s)', lines[1])
+        self.assertIn('publish', lines[2])
+        self.assertIn('1 calls (1 errors)', lines[2])
+
+    def test_dump(self):
+        path = os.path.join(self.new_tmp_folder(), 'trace.json')
+        self.stats.dump(path)
+        with open(path) as trace:
+            self.assertEqual(self.stats.calls, json.load(trace)['calls'])
@@ -0,0 +1,154 @@
+'''
+Stand-in servers, running in a thread of the tests, to test the REST clients with real
+HTTP connections
+'''
+import hashlib
+import re
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from biicode.common.utils.bson_encoding import decode_bson, encode_bson
+from biicode.common.model.symbolic.block_version import BlockVersion
+from biicode.common.model.brl.brl_block import BRLBlock
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Connections are kept alive
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.send(200, 'pong')
+
+    def send(self, status, body, content_type='text/plain', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+    '''Stand-in HTTP server, in a thread, registering the client connections'''
+    daemon_threads = True
+
+    def __init__(self, handler=KeepAliveHandler):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.connections = set()
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FlakyHandler(KeepAliveHandler):
+    '''Drops, without response, the connections of the first server.failures requests'''
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.close_connection = 1
+            return
+        self.send(200, 'pong')
+
+    do_POST = do_GET
+
+
+class FlakyServer(LocalServer):
+    '''Stand-in server of an unreliable network, failing the given number of requests'''
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.requests = 0
+        LocalServer.__init__(self, FlakyHandler)
+
+
+_VERSION_URL = re.compile('/v1/users/(?P<owner>[^/]+)/blocks/(?P<block>.+)/branches/'
+                          '(?P<branch>[^/]+)/versions?/(?P<time>\d+)/(?P<call>[a-z_]+)/?$')
+
+
+class BiiServerHandler(KeepAliveHandler):
+    '''Per version calls (delta info, dependency table, snapshot) of biicode server, and
+    their batched versions, serving the data of BiiServerMock'''
+    batched = {'/v1/version_delta_infos': 'deltas',
+               '/v1/block_version_tables': 'dep_tables',
+               '/v1/cells_snapshots': 'snapshots'}
+    single = {'delta_info': 'deltas',
+              'block_version_table': 'dep_tables'}
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        match = _VERSION_URL.match(self.path)
+        if not match or match.group('call') not in self.single:
+            # Not served by this mock
+            return self.send(404, 'Not found')
+        block_version = BlockVersion(BRLBlock('%s/%s/%s' % (match.group('owner'),
+                                                            match.group('block'),
+                                                            match.group('branch'))),
+                                     int(match.group('time')))
+        table = self.single[match.group('call')]
+        value = self._get(table, block_version)
+        if table == 'deltas' and value is not None:
+            etag = '"%s"' % hashlib.sha1(repr(value.serialize())).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                self.server.not_modified += 1
+                return self.send(304, '')
+            return self.send_value(value, headers={'ETag': etag})
+        self.send_value(value)
+
+    def do_POST(self):
+        self.server.requests.append(self.path)
+        data = decode_bson(self.rfile.read(int(self.headers['Content-Length'])))['data']
+        if self.path == '/v1/cells_snapshot':
+            block_version = BlockVersion.deserialize(data)
+            return self.send_value(self._get('snapshots', block_version))
+        if self.path not in self.batched or not self.server.batched:
+            return self.send(404, 'Not found')
+        table = self.batched[self.path]
+        result = []
+        for serial in data:
+            value = self._get(table, BlockVersion.deserialize(serial))
+            result.append([serial, None if value is None else _serialize(value)])
+        self.send_value(result, serialized=True)
+
+    def _get(self, table, block_version):
+        return getattr(self.server, table).get(block_version)
+
+    def send_value(self, value, serialized=False, headers=None):
+        if value is None:
+            return self.send(404, 'Not found')
+        if not serialized:
+            value = _serialize(value)
+        self.send(200, str(encode_bson({'return': value})), 'application/bson', headers)
+
+
+def _serialize(value):
+    if isinstance(value, list):  # Snapshots
+        return [str(v) for v in value]
+    return value.serialize()
+
+
+class BiiServerMock(LocalServer):
+    '''Stand-in biicode server, serving delta infos, dep tables and snapshots of the
+    versions in its dicts. The paths of the received requests are appended to requests,
+    delta infos answered with 304 Not Modified are counted in not_modified
+    param batched: False to simulate a server without batched calls
+    '''
+
+    def __init__(self, batched=True):
+        self.batched = batched
+        self.deltas = {}
+        self.dep_tables = {}
+        self.snapshots = {}
+        self.requests = []
+        self.not_modified = 0
+        LocalServer.__init__(self, BiiServerHandler)
@@ -9,6 +9,8 @@ from mock import Mock
 from biicode.common.model.server_info import ServerInfo, ClientVersion
 import datetime
 import os
+import threading
+import time
 from biicode.client.exception import ObsoleteClient
 from biicode.client.test.shell.user_io_mock import mocked_user_io
 from biicode.common.output_stream import OutputStream
@@ -115,6 +117,82 @@ class UpdatesManagerTest(BiiTestCase):
         manager.check_for_updates(biiout)
         self.assert_not_in_response(biiout, "There is a new version of biicode")
 
+    def test_offline_not_checked(self):
+        server_info = ServerInfo(version="0.9", message='Hey!', last_compatible="0.9")
+        self.biiapi.get_server_info = Mock(return_value=server_info)
+        manager = UpdatesManager(self.store, self.biiapi, ClientVersion("0.8"))
+        self._save_info(manager, server_info, datetime.timedelta(days=-365))
+
+        # Stored info is still processed, obsolete clients stop
+        self.assertRaises(ObsoleteClient, manager.check_for_updates, self.user_io.out,
+                          offline=True)
+        self.assertEquals(self.biiapi.get_server_info.call_count, 0)
+
+    def test_background_check(self):
+        old_info = ServerInfo(version="0.9", message='Hey!', last_compatible="0.9")
+        new_info = ServerInfo(version="1.0", message='Hey!', last_compatible="0.5")
+        self.biiapi.get_server_info = Mock(return_value=new_info)
+        manager = UpdatesManager(self.store, self.biiapi, ClientVersion("0.8"))
+        self._save_info(manager, old_info, datetime.timedelta(days=-365))
+
+        # Last known info is the one processed
+        self.assertRaises(ObsoleteClient, manager.check_for_updates, self.user_io.out,
+                          background=True)
+        manager.thread.join()
+        self.assertEquals(self.biiapi.get_server_info.call_count, 1)
+        self.assertEquals(self.store.load().server_info, new_info)
+
+    def test_background_check_not_waited(self):
+        answered = threading.Event()
+        self.biiapi.get_server_info = Mock(side_effect=lambda: answered.wait(5))
+        manager = UpdatesManager(self.store, self.biiapi, ClientVersion("0.8"))
+
+        # The command starts while the call is still running
+        manager.check_for_updates(self.user_io.out, background=True)
+        try:
+            self.assertTrue(manager.thread.is_alive())
+        finally:
+            answered.set()
+            manager.thread.join()
+        self.assertEquals(1, self.biiapi.get_server_info.call_count)
+
+    def test_background_check_finished(self):
+        old_info = ServerInfo(version="0.9", message='Hey!', last_compatible="0.5")
+        new_info = ServerInfo(version="1.0", message='Hey!', last_compatible="0.5")
+
+        def get_server_info():
+            time.sleep(0.1)
+            return new_info
+        self.biiapi.get_server_info = Mock(side_effect=get_server_info)
+        manager = UpdatesManager(self.store, self.biiapi, ClientVersion("0.8"))
+        self._save_info(manager, old_info, datetime.timedelta(days=-365))
+
+        # A command shorter than the call still stores its result
+        manager.check_for_updates(self.user_io.out, background=True)
+        manager.finish()
+        self.assertEquals(self.store.load().server_info, new_info)
+
+    def test_background_check_finish_timeout(self):
+        old_info = ServerInfo(version="0.9", message='Hey!', last_compatible="0.5")
+        answered = threading.Event()
+        self.biiapi.get_server_info = Mock(side_effect=lambda: answered.wait(5))
+        manager = UpdatesManager(self.store, self.biiapi, ClientVersion("0.8"))
+        self._save_info(manager, old_info, datetime.timedelta(days=-365))
+
+        manager.check_for_updates(self.user_io.out, background=True)
+        try:
+            start = time.time()
+            manager.finish(timeout=0.1)
+            self.assertLess(time.time() - start, 1)
+            self.assertEquals(self.store.load().server_info, old_info)
+        finally:
+            answered.set()
+            manager.thread.join()
+
+    def test_finish_without_background_check(self):
+        manager = UpdatesManager(self.store, self.biiapi, ClientVersion("0.8"))
+        manager.finish()
+
     def _save_info(self, manager, server_info, timedelta):
         now = datetime.datetime.utcnow()
         thetime = now + timedelta
@@ -123,3 +201,4 @@ class UpdatesManagerTest(BiiTestCase):
         manager.store.save(UpdateInfo(server_info, roundthetime))
 
         return server_info, roundthetime
+
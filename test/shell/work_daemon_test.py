@@ -0,0 +1,200 @@
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+from StringIO import StringIO
+from mock import Mock, patch
+from nose.plugins.attrib import attr
+from biicode.common.exception import BiiException
+from biicode.common.test.bii_test_case import BiiTestCase
+from biicode.client.exception import ClientException
+from biicode.client.shell.biistream import BiiOutputStream
+from biicode.client.shell import work_daemon
+from biicode.client.shell.work_daemon import request_prepare, WorkDaemon, _RequestStream
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+class FakeDaemon(object):
+    '''Stand-in of the work daemon serving a single request with the given messages'''
+
+    def __init__(self, bii_folder, messages, pid=None, reset=False):
+        self.messages = messages
+        self.reset = reset  # Closes the connection abruptly, as a killed process
+        self.requests = []
+        self.done = threading.Event()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        with open(os.path.join(bii_folder, work_daemon.DAEMON_FILE), 'w') as daemon_file:
+            json.dump({'port': self.server.getsockname()[1], 'token': 'secret',
+                       'pid': pid or os.getpid()}, daemon_file)
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _serve(self):
+        connection, _ = self.server.accept()
+        self.requests.append(json.loads(connection.makefile('rb').readline()))
+        for message in self.messages or []:
+            work_daemon._send(connection, message)
+        if self.messages is None:  # Hung
+            self.done.wait(5)
+        if self.reset:
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        connection.close()
+        self.server.close()
+
+
+@attr('integration')
+class RequestPrepareTest(BiiTestCase):
+
+    def setUp(self):
+        BiiTestCase.setUp(self)
+        self.bii = Mock()
+        self.bii.bii_paths.bii = self.new_tmp_folder()
+        self.bii.user_io.out = BiiOutputStream()
+
+    def test_no_daemon(self):
+        self.assertIsNone(request_prepare(self.bii, 'cpp', None, 'keep'))
+
+    def test_daemon_closed_without_result(self):
+        FakeDaemon(self.bii.bii_paths.bii, [])
+        self.assertIsNone(request_prepare(self.bii, 'cpp', None, 'keep'))
+
+    def test_daemon_not_running(self):
+        daemon = FakeDaemon(self.bii.bii_paths.bii, [{'result': {'unsupported': True}}],
+                            pid=_dead_pid())
+        self.assertIsNone(request_prepare(self.bii, 'cpp', None, 'keep'))
+        self.assertEqual([], daemon.requests)
+
+    @patch('biicode.client.shell.work_daemon._FIRST_MESSAGE_TIMEOUT', 0.2)
+    def test_daemon_hung(self):
+        daemon = FakeDaemon(self.bii.bii_paths.bii, None)
+        try:
+            self.assertIsNone(request_prepare(self.bii, 'cpp', None, 'keep'))
+        finally:
+            daemon.done.set()
+
+    def test_daemon_killed_while_answering(self):
+        FakeDaemon(self.bii.bii_paths.bii, [{'out': 'Processing changes...\n'}], reset=True)
+        self.assertIsNone(request_prepare(self.bii, 'cpp', None, 'keep'))
+
+    def test_prepared_by_daemon(self):
+        daemon = FakeDaemon(self.bii.bii_paths.bii,
+                            [{'out': 'Processing changes...\n'},
+                             {'result': {'toolchain_file': None, 'regenerate': True}}])
+        self.assertEqual((None, True), request_prepare(self.bii, 'cpp', 'Ninja', 'keep'))
+        self.assertEqual([{'token': 'secret', 'command': 'prepare', 'group': 'cpp',
+                           'generator': 'Ninja', 'toolchain': 'keep'}], daemon.requests)
+        self.assertIn('Processing changes...', str(self.bii.user_io.out))
+
+    def test_unsupported_by_daemon(self):
+        FakeDaemon(self.bii.bii_paths.bii, [{'result': {'unsupported': True}}])
+        self.assertIsNone(request_prepare(self.bii, 'arduino', None, 'keep'))
+
+    def test_error_in_daemon(self):
+        FakeDaemon(self.bii.bii_paths.bii, [{'out': 'ERROR: wrong biicode.conf\n'},
+                                            {'result': {'error': 'wrong biicode.conf'}}])
+        with self.assertRaisesRegexp(Exception, 'wrong biicode.conf'):
+            request_prepare(self.bii, 'cpp', None, 'keep')
+
+
+@attr('integration')
+class WorkDaemonServeTest(BiiTestCase):
+    '''The daemon serving requests of request_prepare, through a localhost socket'''
+
+    def setUp(self):
+        BiiTestCase.setUp(self)
+        self.bii = Mock()
+        self.bii.bii_paths.bii = self.new_tmp_folder()
+        self.bii.user_io.out = BiiOutputStream()
+        with patch.object(WorkDaemon, '_new_bii'):
+            self.daemon = WorkDaemon(self.bii)
+        self.daemon._stream = _RequestStream(StringIO())
+
+    def _serve_one(self, token):
+        '''Serves a request with the given token, the clients send the written one'''
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.daemon._write_daemon_file(server.getsockname()[1], 'secret')
+
+        def serve():
+            connection, _ = server.accept()
+            self.daemon._serve(connection, token)
+            server.close()
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_prepared(self):
+        def request(_):
+            self.daemon._stream.write('Processing changes...\n')
+            return {'toolchain_file': None, 'regenerate': True}
+        self.daemon._request = Mock(side_effect=request)
+        self._serve_one('secret')
+        self.assertEqual((None, True), request_prepare(self.bii, 'cpp', 'Ninja', 'keep'))
+        self.daemon._request.assert_called_once_with({'token': 'secret', 'command': 'prepare',
+                                                      'group': 'cpp', 'generator': 'Ninja',
+                                                      'toolchain': 'keep'})
+        self.assertIn('Processing changes...', str(self.bii.user_io.out))
+
+    def test_wrong_token(self):
+        self.daemon._request = Mock()
+        thread = self._serve_one('other')
+        self.assertIsNone(request_prepare(self.bii, 'cpp', None, 'keep'))
+        thread.join(5)
+        self.assertFalse(self.daemon._request.called)
+
+    def test_unsupported_group(self):
+        self.daemon._check_changes = Mock()
+        self._serve_one('secret')
+        self.assertIsNone(request_prepare(self.bii, 'arduino', None, 'keep'))
+        self.assertFalse(self.daemon._check_changes.called)
+
+    def test_project_error(self):
+        self.daemon._check_changes = Mock()
+        self.daemon._error = BiiException('wrong biicode.conf')
+        self.daemon._work = Mock(side_effect=lambda: self.daemon._stream.write('ERROR: wrong '
+                                                                              'biicode.conf\n'))
+        self._serve_one('secret')
+        with self.assertRaisesRegexp(BiiException, 'wrong biicode.conf'):
+            request_prepare(self.bii, 'cpp', None, 'keep')
+        self.assertEqual(1, self.daemon._work.call_count)
+        self.assertIn('ERROR: wrong biicode.conf', str(self.bii.user_io.out))
+
+    def test_request_exception(self):
+        self.daemon._request = Mock(side_effect=Exception('Unexpected'))
+        self._serve_one('secret')
+        with self.assertRaisesRegexp(BiiException, 'Unexpected'):
+            request_prepare(self.bii, 'cpp', None, 'keep')
+
+    def test_already_running(self):
+        running = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(10)'])
+        try:
+            with open(os.path.join(self.bii.bii_paths.bii, work_daemon.DAEMON_FILE), 'w') as f:
+                json.dump({'port': 1, 'token': 'secret', 'pid': running.pid}, f)
+            self.daemon._work = Mock()
+            with self.assertRaisesRegexp(ClientException, 'already running'):
+                self.daemon.serve_forever()
+            self.assertFalse(self.daemon._work.called)
+        finally:
+            running.kill()
+            running.wait()
+
+    def test_killed_daemon_file_replaced(self):
+        with open(os.path.join(self.bii.bii_paths.bii, work_daemon.DAEMON_FILE), 'w') as f:
+            json.dump({'port': 1, 'token': 'old', 'pid': _dead_pid()}, f)
+        self.daemon._check_not_running()
+        self.daemon._write_daemon_file(2, 'new')
+        with open(os.path.join(self.bii.bii_paths.bii, work_daemon.DAEMON_FILE)) as f:
+            self.assertEqual({'port': 2, 'token': 'new', 'pid': os.getpid()}, json.load(f))
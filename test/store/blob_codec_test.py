@@ -0,0 +1,50 @@
+from unittest import TestCase
+from bson.binary import Binary
+from biicode.client.store.blob_codec import BSONCodec, ReprCodec
+from biicode.common.model.cells import SimpleCell, CellDeserializer
+from biicode.common.model.content import Content, ContentDeserializer
+from biicode.common.model.blob import Blob
+from biicode.common.model.id import ID
+
+
+def _published_resources(num_cells):
+    result = []
+    for i in range(num_cells):
+        cell = SimpleCell("dummy/block/file%d.cpp" % i)
+        cell.ID = ID((0, 1, i))
+        content = Content(ID((0, 1, i)), Blob("int f%d(){return %d;}\n" % (i, i) * 20))
+        result.append((cell, content))
+    return result
+
+
+class BlobCodecTest(TestCase):
+
+    def test_roundtrip_published_resources(self):
+        codec = BSONCodec()
+        for cell, content in _published_resources(10):
+            cell_data = codec.decode(codec.encode(cell.serialize()))
+            self.assertEqual(cell, CellDeserializer(ID).deserialize(cell_data))
+            content_data = codec.decode(codec.encode(content.serialize()))
+            self.assertEqual(content, ContentDeserializer(ID).deserialize(content_data))
+
+    def test_legacy_values_readable(self):
+        legacy = ReprCodec()
+        codec = BSONCodec()
+        for cell, _ in _published_resources(10):
+            legacy_data = legacy.decode(legacy.encode(cell.serialize()))
+            self.assertEqual(CellDeserializer(ID).deserialize(legacy_data),
+                             CellDeserializer(ID).deserialize(codec.decode(
+                                                              codec.encode(legacy_data))))
+
+    def test_binary_stored_raw(self):
+        data = Binary(''.join(chr(i) for i in range(256)) * 4)
+        # repr() escapes most bytes, several times bigger
+        self.assertLess(len(BSONCodec().encode(data)), len(data) + 64)
+        self.assertGreater(len(ReprCodec().encode(data)), 2 * len(data))
+        self.assertEqual(data, BSONCodec().decode(BSONCodec().encode(data)))
+
+    def test_stored_text_not_evaluated(self):
+        codec = BSONCodec()
+        code = "__import__('os').remove('biicode.conf')"
+        self.assertEqual(code, codec.decode(codec.encode(code)))
+        self.assertRaises(Exception, codec.decode, code)
@@ -1,6 +1,7 @@
 import tempfile
 import os
 import shutil
+from mock import Mock
 from biicode.client.store import hivedb
 from biicode.common.model.brl.block_cell_name import BlockCellName
 from unittest import main
@@ -11,7 +12,7 @@ from biicode.common.test import model_creator as mother
 from nose.plugins.attrib import attr
 from biicode.common.test.bii_test_case import BiiTestCase
 from biicode.common.model.blob import Blob
-from biicode.common.model.content import Content
+from biicode.common.model.content import Content, ContentDeserializer
 
 
 @attr('integration')
@@ -104,5 +105,56 @@ class HiveDBTest(BiiTestCase):
             self.db.read_edition_contents()[cid]
 
 
+@attr('integration')
+class LazyEditionContentsTest(BiiTestCase):
+    '''read_edition_contents decodes each content when accessed, not when read'''
+
+    def setUp(self):
+        self.test_folder = tempfile.mkdtemp(suffix='biicode', dir=BII_TEST_FOLDER)
+        self.db = hivedb.factory(os.path.join(self.test_folder, "mytestdb.db"))
+        self.names = [BlockCellName("dummy/geom/sphere%d.cpp" % i) for i in range(3)]
+        self.db.upsert_edition_contents([Content(id_=name, load=Blob("Hola %s" % name))
+                                         for name in self.names])
+        self.deserializer = Mock(wraps=ContentDeserializer(BlockCellName))
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.test_folder)
+
+    def _read_lazy(self):
+        return self.db.read_all_lazy(hivedb.CONTENTS, self.deserializer, BlockCellName)
+
+    def test_decoded_on_access_once(self):
+        contents = self._read_lazy()
+        self.assertEqual(3, len(contents))
+        self.assertEqual(set(self.names), set(contents))
+        self.assertIn(self.names[0], contents)
+        self.assertEqual(0, self.deserializer.deserialize.call_count)
+
+        content = contents[self.names[0]]
+        self.assertIs(content, contents[self.names[0]])
+        self.assertEqual(1, self.deserializer.deserialize.call_count)
+
+        for name in self.names:
+            contents[name].sha
+        contents.values()
+        self.assertEqual(3, self.deserializer.deserialize.call_count)
+
+    def test_same_as_eager(self):
+        eager = self.db.read_all(hivedb.CONTENTS, ContentDeserializer(BlockCellName))
+        self.assertEqual(eager, dict(self.db.read_edition_contents()))
+
+    def test_modified_without_decoding(self):
+        contents = self._read_lazy()
+        new = Content(id_=self.names[0], load=Blob("Adios"))
+        contents[self.names[0]] = new
+        del contents[self.names[1]]
+        self.assertEqual(0, self.deserializer.deserialize.call_count)
+        self.assertIs(new, contents[self.names[0]])
+        self.assertNotIn(self.names[1], contents)
+        self.assertRaises(KeyError, contents.__getitem__, self.names[1])
+        self.assertEqual([self.names[0], self.names[2]], sorted(contents))
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,82 @@
+from unittest import TestCase
+import tempfile
+import os
+import shutil
+from multiprocessing import Pool
+from nose.plugins.attrib import attr
+from biicode.client.store.localdb import LocalDB
+from biicode.common.test.conf import BII_TEST_FOLDER
+from biicode.common.model.symbolic.reference import References, ReferencedResources
+from biicode.common.model.brl.cell_name import CellName
+from biicode.common.model.resource import Resource
+from biicode.common.model.brl.brl_block import BRLBlock
+from biicode.common.model.cells import SimpleCell
+from biicode.common.model.blob import Blob
+from biicode.common.model.content import Content
+from biicode.common.model.id import ID
+from biicode.common.model.symbolic.block_version import BlockVersion
+
+NUM_PROCESSES = 8
+NUM_VERSIONS = 20
+NUM_CELLS = 10
+
+
+def _block_version(process, version):
+    return BlockVersion(BRLBlock('dummy/dummy/block%d/master' % process), version)
+
+
+def _populate_cache(args):
+    '''Executed in a different process, each one writing its own block versions'''
+    dbpath, process = args
+    db = LocalDB(dbpath)
+    try:
+        for version in range(NUM_VERSIONS):
+            block_version = _block_version(process, version)
+            resources = ReferencedResources()
+            for i in range(NUM_CELLS):
+                cell_id = ID((process, version, i))
+                cell = SimpleCell("dummy/block%d/file%d.cpp" % (process, i))
+                cell.ID = cell_id
+                content = Content(cell_id, Blob("process %d version %d" % (process, version)))
+                resources[block_version][CellName("file%d.cpp" % i)] = Resource(cell, content)
+            db.create_published_resources(resources)
+            # Readers of other processes are concurrent with the writers
+            db.get_published_resources(_references(process, version))
+    finally:
+        db.disconnect()
+
+
+def _references(process, version):
+    refs = References()
+    refs[_block_version(process, version)] = {CellName("file%d.cpp" % i)
+                                              for i in range(NUM_CELLS)}
+    return refs
+
+
+@attr('integration')
+class LocalDBConcurrencyTest(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(suffix='biicode', dir=BII_TEST_FOLDER)
+        self.dbpath = os.path.join(self.folder, 'bii.db')
+        LocalDB(self.dbpath).disconnect()  # Create it before concurrent access
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_concurrent_processes_populating_cache(self):
+        pool = Pool(NUM_PROCESSES)
+        try:
+            pool.map(_populate_cache, [(self.dbpath, p) for p in range(NUM_PROCESSES)])
+        finally:
+            pool.close()
+            pool.join()
+
+        db = LocalDB(self.dbpath)
+        try:
+            for process in range(NUM_PROCESSES):
+                for version in range(NUM_VERSIONS):
+                    found = db.get_published_resources(_references(process, version))
+                    self.assertEqual(NUM_CELLS, len(found[_block_version(process, version)]))
+        finally:
+            db.disconnect()
@@ -3,11 +3,13 @@ from unittest import TestCase
 import tempfile
 import os
 import shutil
-from biicode.client.store.localdb import LocalDB, DEP_TABLES
+from biicode.client.store.localdb import (LocalDB, DEP_TABLES, SNAPSHOTS, BLOB_TABLES,
+                                          PUBLISHED_REFERENCES)
 from biicode.common.test.conf import BII_TEST_FOLDER
 from biicode.common.model.symbolic.reference import References, ReferencedResources
 from biicode.common.model.brl.cell_name import CellName
 from biicode.common.model.resource import Resource
+from mock import patch
 from nose.plugins.attrib import attr
 from biicode.common.model.symbolic.block_version_table import BlockVersionTable
 from biicode.common.model.brl.brl_block import BRLBlock
@@ -16,8 +18,9 @@ from biicode.common.model.blob import Blob
 from biicode.common.model.content import Content
 from biicode.common.model.id import ID
 from biicode.common.model.symbolic.block_version import BlockVersion
-from biicode.client.store.sqlite import encode_serialized_value
+from biicode.client.store.sqlite import encode_serialized_key, SQLiteDB
 from biicode.common.exception import NotInStoreException
+from biicode.client.store.cache_bundle import write_bundle, read_bundle
 
 
 @attr('integration')
@@ -101,6 +104,218 @@ class LocalDBTest(TestCase):
         brl_block = BRLBlock('dummy/dummy/block/master')
         block_version = BlockVersion(brl_block, 0)
         self.db.set_dep_table(block_version, original_deptable)
-        ID = encode_serialized_value(block_version.serialize())
+        ID = encode_serialized_key(block_version.serialize())
         self.db.delete(ID, DEP_TABLES)
         self.assertRaises(NotInStoreException, self.db.get_dep_table, block_version)
+
+    def test_migrate_legacy_blobs(self):
+        original_snap = [CellName("alf.c"), CellName("willy.c")]
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        block_version = BlockVersion(brl_block, 0)
+        ID = encode_serialized_key(block_version.serialize())
+        # Row as written by older clients, with repr() text
+        self.db.connection.execute("INSERT INTO %s (id, blob) VALUES (?, ?)" % SNAPSHOTS,
+                                   (ID, repr([c.serialize() for c in original_snap])))
+        self.assertEquals(original_snap, self.db.get_cells_snapshot(block_version))
+
+        self.assertEquals(1, self.db.migrate_legacy_blobs(BLOB_TABLES))
+        self.assertEquals(0, self.db.migrate_legacy_blobs(BLOB_TABLES))
+        self.assertEquals(original_snap, self.db.get_cells_snapshot(block_version))
+
+    def test_transaction_single_commit(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        commits = SQLiteDB.commit_count
+        with self.db.transaction():
+            for t in range(10):
+                block_version = BlockVersion(brl_block, t)
+                with self.db.transaction():  # Nested, doesn't commit
+                    self.db.set_dep_table(block_version, BlockVersionTable())
+                self.db.create_cells_snapshot(block_version, [CellName("alf.c")])
+            self.assertEquals(commits, SQLiteDB.commit_count)
+        self.assertEquals(commits + 1, SQLiteDB.commit_count)
+        for t in range(10):
+            self.db.get_dep_table(BlockVersion(brl_block, t))
+
+    def test_flush(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        version0, version1 = BlockVersion(brl_block, 0), BlockVersion(brl_block, 1)
+        commits = SQLiteDB.commit_count
+        with self.assertRaises(ZeroDivisionError):
+            with self.db.transaction():
+                self.db.set_dep_table(version0, BlockVersionTable())
+                self.db.flush()
+                self.db.set_dep_table(version1, BlockVersionTable())
+                1 / 0
+        self.assertEquals(commits + 1, SQLiteDB.commit_count)
+        self.assertEquals(BlockVersionTable(), self.db.get_dep_table(version0))
+        self.assertRaises(NotInStoreException, self.db.get_dep_table, version1)
+
+        # Already committed, no commit needed
+        self.db.set_dep_table(version1, BlockVersionTable())
+        self.db.flush()
+        self.assertEquals(commits + 2, SQLiteDB.commit_count)
+
+    def test_transaction_rollback(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        block_version = BlockVersion(brl_block, 0)
+        with self.assertRaises(ZeroDivisionError):
+            with self.db.transaction():
+                self.db.set_dep_table(block_version, BlockVersionTable())
+                1 / 0
+        self.assertRaises(NotInStoreException, self.db.get_dep_table, block_version)
+
+    def test_remove_dev_references(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        version0, version1 = BlockVersion(brl_block, 0), BlockVersion(brl_block, 1)
+        resources = ReferencedResources()
+        for version in (version0, version1):
+            alf = Resource(SimpleCell("dummy/block/alf.c"),
+                           Content(ID((0, version.time, 2)), Blob("Hello Alf")))
+            alf.cell.ID = ID((0, version.time, 2))
+            resources[version][CellName("alf.c")] = alf
+        self.db.create_published_resources(resources)
+
+        self.db.remove_dev_references(version0)
+
+        refs = References()
+        refs[version0] = {CellName("alf.c")}
+        refs[version1] = {CellName("alf.c")}
+        retrieved = self.db.get_published_resources(refs)
+        self.assertNotIn(version0, retrieved)
+        self.assertEquals(resources[version1], retrieved[version1])
+
+    def test_references_of_version_indexed(self):
+        key = encode_serialized_key(BlockVersion(BRLBlock('dummy/dummy/block/master'), 0)
+                                    .serialize())
+        for query in ('SELECT cell_id, content_id FROM {table} where block_version=(?);',
+                      'DELETE from {table} where block_version=(?);'):
+            plan = self.db.connection.execute('EXPLAIN QUERY PLAN ' +
+                                              query.format(table=PUBLISHED_REFERENCES),
+                                              (key, )).fetchall()
+            self.assertIn('USING INDEX block_version_index', str(plan))
+
+    @patch('biicode.client.store.localdb.MAX_QUERY_PARAMETERS', 3)
+    def test_get_published_resources_chunked(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        resources = ReferencedResources()
+        refs = References()
+        for version in (BlockVersion(brl_block, 0), BlockVersion(brl_block, 1)):
+            for i in range(5):
+                resource = Resource(SimpleCell("dummy/block/file%d.c" % i),
+                                    Content(ID((0, version.time, i)), Blob("Hello %d" % i)))
+                resource.cell.ID = ID((0, version.time, i))
+                resources[version][CellName("file%d.c" % i)] = resource
+            refs[version] = set(resources[version].keys())
+        self.db.create_published_resources(resources)
+
+        # 10 references, in 4 queries
+        self.assertEquals(resources, self.db.get_published_resources(refs))
+
+    def test_deduplicated_contents(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        resources = ReferencedResources()
+        for t in range(3):
+            version = BlockVersion(brl_block, t)
+            alf = Resource(SimpleCell("dummy/block/alf.c"),
+                           Content(ID((0, t, 2)), Blob("Hello Alf")))
+            alf.cell.ID = ID((0, t, 2))
+            resources[version][CellName("alf.c")] = alf
+        self.db.create_published_resources(resources)
+        stats = self.db.contents_stats()
+        self.assertEquals(3, stats['contents'])
+        self.assertEquals(1, stats['unique_contents'])
+
+        refs = References()
+        for version in resources:
+            refs[version] = {CellName("alf.c")}
+        self.assertEquals(resources, self.db.get_published_resources(refs))
+
+        # Removed versions reclaim their cells, contents and finally the shared blob
+        for version in resources:
+            self.db.remove_dev_references(version)
+        stats = self.db.contents_stats()
+        self.assertEquals(0, stats['contents'])
+        self.assertEquals(0, stats['unique_contents'])
+        cells = self.db.connection.execute("SELECT count(*) FROM cells").fetchone()[0]
+        self.assertEquals(0, cells)
+
+    def test_evict_least_recently_used(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        resources = ReferencedResources()
+        for t in range(3):
+            version = BlockVersion(brl_block, t)
+            alf = Resource(SimpleCell("dummy/block/alf.c"),
+                           Content(ID((0, t, 2)), Blob(os.urandom(20000))))
+            alf.cell.ID = ID((0, t, 2))
+            resources[version][CellName("alf.c")] = alf
+            self.db.create_published_resources(resources)
+        self.db.disconnect()
+
+        # Other command uses only the last version, the rest of them are evicted
+        self.db = LocalDB(os.path.join(self.hiveFolder, 'bii.db'))
+        last_version = BlockVersion(brl_block, 2)
+        refs = References()
+        refs[last_version] = {CellName("alf.c")}
+        self.assertEquals(resources[last_version],
+                          self.db.get_published_resources(refs)[last_version])
+        self.assertEquals(2, self.db.evict(0, time_budget=10))
+
+        for version in resources:
+            refs[version] = {CellName("alf.c")}
+        self.assertEquals([last_version], self.db.get_published_resources(refs).keys())
+        free_pages = self.db.connection.execute("PRAGMA freelist_count").fetchone()[0]
+        self.assertEquals(0, free_pages)
+
+    def test_reads_store_access_at_once(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        versions = [BlockVersion(brl_block, t) for t in range(3)]
+        for version in versions:
+            self.db.set_dep_table(version, BlockVersionTable())
+        self.db.disconnect()
+        self.db = LocalDB(os.path.join(self.hiveFolder, 'bii.db'))
+        query = "SELECT last_access FROM version_access ORDER BY block_version"
+        stored = self.db.connection.execute(query).fetchall()
+
+        commits = SQLiteDB.commit_count
+        for version in versions:
+            self.db.get_dep_table(version)
+        self.assertEquals(commits, SQLiteDB.commit_count)  # Reads don't write
+        self.assertEquals(stored, self.db.connection.execute(query).fetchall())
+
+        self.db.store_access()
+        self.assertEquals(commits + 1, SQLiteDB.commit_count)
+        accessed = self.db.connection.execute(query).fetchall()
+        self.assertTrue(all(new > old for new, old in zip(accessed, stored)))
+
+    def test_export_import_versions(self):
+        brl_block = BRLBlock('dummy/dummy/block/master')
+        resources = ReferencedResources()
+        refs = References()
+        for t in range(3):
+            version = BlockVersion(brl_block, t)
+            alf = Resource(SimpleCell("dummy/block/alf.c"),
+                           Content(ID((0, t, 2)), Blob("Hello Alf")))
+            alf.cell.ID = ID((0, t, 2))
+            resources[version][CellName("alf.c")] = alf
+            refs[version] = {CellName("alf.c")}
+            self.db.set_dep_table(version, BlockVersionTable())
+        self.db.create_published_resources(resources)
+        self.db.set_login(("dummyname", "dummypass"))
+
+        bundle = os.path.join(self.hiveFolder, 'cache.bundle')
+        exported = os.path.join(self.hiveFolder, 'exported.db')
+        self.db.export_versions(exported, self.db.cached_versions().keys())
+        write_bundle(exported, bundle)
+
+        imported = os.path.join(self.hiveFolder, 'imported.db')
+        read_bundle(bundle, imported)
+        other = LocalDB(os.path.join(self.hiveFolder, 'other.db'))
+        try:
+            self.assertEquals(3, other.import_versions(imported))
+            self.assertEquals(0, other.import_versions(imported))  # Duplicates are ignored
+            self.assertEquals(resources, other.get_published_resources(refs))
+            self.assertEquals(BlockVersionTable(), other.get_dep_table(BlockVersion(brl_block, 0)))
+            self.assertEquals(1, other.contents_stats()['unique_contents'])
+            self.assertEquals((None, None), other.get_login())
+        finally:
+            other.disconnect()
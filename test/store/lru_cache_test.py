@@ -0,0 +1,24 @@
+from unittest import TestCase
+from biicode.client.store.lru_cache import LRUCache
+
+
+class LRUCacheTest(TestCase):
+
+    def test_least_recently_used_discarded(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+    def test_invalidate(self):
+        cache = LRUCache(10)
+        for i in range(5):
+            cache.put(i, str(i))
+        cache.invalidate(lambda key: key % 2 == 0)
+        self.assertEqual(2, len(cache))
+        self.assertEqual('3', cache.get(3))
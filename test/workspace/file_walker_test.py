@@ -10,7 +10,13 @@ from biicode.client.workspace.walk_block import walk_bii_folder, walk_anonymous_
 from biicode.client.workspace.bii_paths import BiiPaths
 from biicode.client.workspace.bii_paths import (BII_DIR, BII_HIVE_DB)
 from biicode.common.model.brl.block_name import BlockName
+from biicode.client.workspace.scan_manifest import ScanManifest
+from biicode.client.workspace import walk_block
+from biicode.client.store import hivedb
+from mock import patch
 import platform
+import threading
+import time
 import unittest
 
 
@@ -220,3 +226,178 @@ class FileWalkerTest(TestCase):
 
         for file_, _ in foreign_links:
             check_file(file_, foreign_file_content)
+
+    @unittest.skipIf(platform.system() == "Windows", "windows no symlinks")
+    def test_parallel_read_same_result(self):
+        for i in range(100):
+            save(os.path.join(self.folder, 'User/Block/dir%d/file%d.cpp' % (i % 7, i)),
+                 'int f%d(){}' % i)
+            if i % 10 == 0:
+                os.symlink(os.path.join(self.folder, 'missing%d' % i),
+                           os.path.join(self.folder, 'User/Block/dead%d.h' % i))
+                save(os.path.join(self.folder, 'User/misplaced%d.cpp' % i), '')
+        save(os.path.join(self.folder, 'User/Block/dir3/bad\\name.cpp'), '')
+
+        outputs = []
+        results = []
+        for threads in (1, 8):
+            biiout = BiiOutputStream()
+            with patch.object(walk_block, 'BII_WALK_THREADS', threads):
+                results.append(walk_bii_folder(self.folder, BiiIgnore.defaults(), biiout))
+            outputs.append(str(biiout))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(100, len(results[1]))
+        self.assertEqual(10, outputs[1].count('Error reading'))
+
+    def test_files_read_concurrently(self):
+        for i in range(20):
+            save(os.path.join(self.folder, 'User/Block/file%d.cpp' % i), 'int f%d(){}' % i)
+        read = walk_block._read
+        lock = threading.Lock()
+        reads = {'active': 0, 'peak': 0}
+
+        def slow_read(path, manifest):  # Latency of a network filesystem
+            with lock:
+                reads['active'] += 1
+                reads['peak'] = max(reads['peak'], reads['active'])
+            time.sleep(0.02)
+            with lock:
+                reads['active'] -= 1
+            return read(path, manifest)
+
+        with patch.object(walk_block, '_read', slow_read):
+            with patch.object(walk_block, 'BII_WALK_THREADS', 4):
+                result = walk_bii_folder(self.folder, BiiIgnore.defaults(), BiiOutputStream())
+        self.assertEqual(20, len(result))
+        self.assertEqual(4, reads['peak'])
+
+    def test_ignored_folders_not_walked(self):
+        block = os.path.join(self.folder, 'User/Block')
+        for i in range(5):
+            save(os.path.join(block, 'src/file%d.cpp' % i), 'int f%d(){}' % i)
+            save(os.path.join(block, '.git/objects/%02x/%d' % (i, i)), 'object %d' % i)
+        walked = []
+        walk = os.walk
+
+        def recording_walk(top, *args, **kwargs):
+            for root, directories, files in walk(top, *args, **kwargs):
+                if top == self.folder:  # Not the ones looking for ignore.bii files
+                    walked.append(root)
+                yield root, directories, files
+
+        bii_ignore = BiiIgnore.defaults()
+        with patch.object(walk_block.os, 'walk', recording_walk):
+            result = walk_bii_folder(self.folder, bii_ignore, BiiOutputStream())
+        self.assertEqual(5, len(result))
+        self.assertEqual([], [root for root in walked if '.git' in root])
+        # Same files as walking every folder
+        self.assertEqual(walk_bii_folder(self.folder, _UnprunedBiiIgnore(bii_ignore),
+                                         BiiOutputStream()), result)
+
+    def test_ignore_bii_in_ignored_folder(self):
+        block = os.path.join(self.folder, 'User/Block')
+        save(os.path.join(block, 'ignore.bii'), 'third_party/*')
+        save(os.path.join(block, 'third_party/ignore.bii'), '!*.h')
+        for name in ('main.cpp', 'third_party/lib.h', 'third_party/lib.cpp'):
+            save(os.path.join(block, name), 'int f(){}')
+
+        result = walk_bii_folder(self.folder, BiiIgnore.defaults(), BiiOutputStream())
+        self.assertEqual({'User/Block/ignore.bii', 'User/Block/main.cpp',
+                          'User/Block/third_party/lib.h'}, set(result))
+
+    def test_ignore_bii_in_ignored_subfolder(self):
+        block = os.path.join(self.folder, 'User/Block')
+        save(os.path.join(block, 'ignore.bii'), 'third_party/*')
+        save(os.path.join(block, 'third_party/lib/ignore.bii'), '!*.h')
+        for name in ('main.cpp', 'third_party/lib/lib.h', 'third_party/lib/lib.cpp',
+                     'third_party/other/other.h'):
+            save(os.path.join(block, name), 'int f(){}')
+
+        result = walk_bii_folder(self.folder, BiiIgnore.defaults(), BiiOutputStream())
+        self.assertEqual({'User/Block/ignore.bii', 'User/Block/main.cpp',
+                          'User/Block/third_party/lib/lib.h'}, set(result))
+        # Same files as walking every folder
+        self.assertEqual(walk_bii_folder(self.folder, _UnprunedBiiIgnore(BiiIgnore.defaults()),
+                                         BiiOutputStream()), result)
+
+
+class _UnprunedBiiIgnore(BiiIgnore):
+    '''Rules walking every folder, like the walkers did before pruning ignored ones'''
+    def __add__(self, other):
+        result = _UnprunedBiiIgnore()
+        result.extend(self)
+        result.extend(other)
+        return result
+
+    def ignored_folder(self, path):
+        return False
+
+
+@attr('integration')
+class ScanManifestTest(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(suffix='biicode', dir=BII_TEST_FOLDER)
+        self.user_home = tempfile.mkdtemp(suffix='biicode', dir=BII_TEST_FOLDER)
+        self.biiout = BiiOutputStream()
+        self.hivedb = hivedb.factory(os.path.join(self.user_home, 'hive.db'))
+        self.bii_paths = BiiPathsMock(self.folder, 'root-block: User/Root', self.user_home)
+
+    def tearDown(self):
+        self.hivedb.disconnect()
+
+    def _save(self, path, content, age=60):
+        '''Saves an old file, not modified right before the scan'''
+        path = os.path.join(self.folder, path)
+        save(path, content)
+        old = time.time() - age
+        os.utime(path, (old, old))
+
+    def _scan(self, manifest=None):
+        bii_ignore = BiiIgnore.defaults()
+        result = walk_bii_folder(self.bii_paths.blocks, bii_ignore, self.biiout, manifest)
+        result.update(walk_anonymous_block(self.bii_paths, bii_ignore, self.biiout,
+                                           BlockName('User/Root'), manifest))
+        return result
+
+    def _check_scan(self, expected_reads):
+        '''Scans with a manifest, checking the result is the same as without it'''
+        manifest = ScanManifest(self.hivedb)
+        result = self._scan(manifest)
+        manifest.save()
+        self.assertEqual(self._scan(), result)
+        self.assertEqual(expected_reads, manifest.reads)
+        return result
+
+    def test_same_files_as_walker(self):
+        self._save('blocks/User/Block/main.cpp', 'int main(){}')
+        self._save('blocks/User/Block/lib/lib.h', 'int f();')
+        self._save('blocks/User/Block/ignore.bii', '*.kk')
+        self._save('blocks/User/Block/data.kk', 'ignored')
+        self._save('root.cpp', 'int g(){}')
+        self._check_scan(4)
+        self._check_scan(0)
+
+        self._save('blocks/User/Block/main.cpp', 'int main(){return 1;}')  # size changes
+        self._save('blocks/User/Block/lib/lib.h', 'int g();', age=30)  # mtime changes
+        self._save('blocks/User/Block/new.cpp', 'int h(){}')
+        os.unlink(os.path.join(self.folder, 'root.cpp'))
+        result = self._check_scan(3)
+        self.assertEqual('int g();', result['User/Block/lib/lib.h'])
+        self.assertNotIn('User/Root/root.cpp', result)
+        self._check_scan(0)
+
+    def test_recent_files_always_read(self):
+        self._save('blocks/User/Block/main.cpp', 'int main(){}', age=0)
+        self._check_scan(1)
+        self._check_scan(1)
+
+    def test_corrupted_manifest_read(self):
+        self._save('blocks/User/Block/main.cpp', 'int main(){}')
+        self._check_scan(1)
+        path = os.path.join(self.bii_paths.blocks, 'User/Block/main.cpp')
+        stat = self.hivedb.read_scan_manifest()[path][:4]
+        self.hivedb.update_scan_manifest([(path, ) + stat + ('corrupted', )], [])
+        self._check_scan(1)
+        self._check_scan(0)
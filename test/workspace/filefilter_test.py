@@ -44,6 +44,22 @@ class BiiIgnoreTest(unittest.TestCase):
         self.assertTrue(ig.ignored('file.py'))
         self.assertTrue(ig.ignored('pepe.py'))
 
+    def test_ignored_folder(self):
+        ig = BiiIgnore.defaults()
+        self.assertTrue(ig.ignored_folder('.git'))
+        self.assertTrue(ig.ignored_folder('path/.svn'))
+        self.assertFalse(ig.ignored_folder('path'))
+        self.assertFalse(ig.ignored_folder('path.dir'))  # Only files named *.dir are ignored
+
+        # Later accept rules that could match files inside, prevent skipping it
+        self.assertFalse((ig + BiiIgnore.loads('!*.cpp')).ignored_folder('.git'))
+        self.assertTrue((ig + BiiIgnore.loads('!docs/*')).ignored_folder('.git'))
+        ig = ig + BiiIgnore.loads('*\n!include/*', 'sub')
+        self.assertTrue(ig.ignored_folder('sub/src'))
+        self.assertFalse(ig.ignored_folder('sub/include'))
+        self.assertFalse(ig.ignored_folder('other'))
+        self.assertFalse((ig + BiiIgnore.loads('!*.h', 'sub')).ignored_folder('sub/src'))
+
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
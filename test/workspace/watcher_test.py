@@ -0,0 +1,54 @@
+import os
+import time
+from nose.plugins.attrib import attr
+from biicode.common.test.bii_test_case import BiiTestCase
+from biicode.common.utils.file_utils import save
+from biicode.client.workspace.bii_ignore import BiiIgnore
+from biicode.client.workspace.watcher import PollingWatcher
+
+
+@attr('integration')
+class PollingWatcherTest(BiiTestCase):
+
+    def setUp(self):
+        BiiTestCase.setUp(self)
+        self.folder = self.new_tmp_folder()
+        self.bii = os.path.join(self.folder, 'bii')
+        self.blocks = os.path.join(self.folder, 'blocks')
+        save(os.path.join(self.bii, 'settings.bii'), 'settings')
+        save(os.path.join(self.bii, '.hive.db'), 'db')
+        save(os.path.join(self.blocks, 'user/block/main.cpp'), 'int main(){}')
+        save(os.path.join(self.blocks, 'user/block/.git/HEAD'), 'master')
+        save(os.path.join(self.folder, 'build/main.o'), 'obj')
+        save(os.path.join(self.folder, 'root.cpp'), 'int f(){}')
+        self.watcher = PollingWatcher([(self.folder, 0), (self.blocks, 2)],
+                                      [self.bii, self.blocks, os.path.join(self.folder, 'build')],
+                                      BiiIgnore.defaults(), self.bii)
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def test_changes(self):
+        self.assertEqual(set(), self.watcher.changes())
+        main = self._path('blocks/user/block/main.cpp')
+        save(main, 'int main(){return 0;}')
+        save(self._path('blocks/user/block/src/new.h'), '')
+        os.remove(self._path('root.cpp'))
+        self.assertEqual({main, self._path('blocks/user/block/src/new.h'),
+                          self._path('root.cpp')}, self.watcher.changes())
+        self.assertEqual(set(), self.watcher.changes())
+
+        old = time.time() - 60
+        os.utime(main, (old, old))  # Same size, other mtime
+        self.assertEqual({main}, self.watcher.changes())
+
+    def test_skipped_and_ignored_not_watched(self):
+        save(self._path('blocks/user/block/.git/HEAD'), 'develop')
+        save(self._path('build/main.o'), 'other obj')
+        save(self._path('bii/.hive.db'), 'other db')
+        self.assertEqual(set(), self.watcher.changes())
+
+        save(self._path('bii/settings.bii'), 'other settings')
+        changed = self.watcher.changes()
+        self.assertEqual({self._path('bii/settings.bii')}, changed)
+        self.assertTrue(self.watcher.is_config(changed.pop()))
@@ -1,5 +1,8 @@
 
 import fnmatch
+import itertools
+import os
+import re
 from biicode.common.exception import BiiException
 
 
@@ -72,13 +75,75 @@ class BiiIgnore(list):
 
     def ignored(self, name):
         '''@return: True if it should be ignored'''
-        ignored = False
-        max_cache = fnmatch._MAXCACHE
-        num_elements = len(self)
-        fnmatch._MAXCACHE = num_elements if num_elements > max_cache else max_cache
-        for pattern, accept in self:
-            if (ignored and accept) or (not ignored and not accept):
-                if fnmatch.fnmatch(name, pattern):
-                    ignored = not ignored
-        fnmatch._MAXCACHE = max_cache  # Restoring original cache value
-        return ignored
+        return self._matcher.ignored(name)
+
+    def ignored_folder(self, path):
+        '''@return: True if all the files under folder path are ignored, so it doesn't need
+        to be walked. False if some of them could be accepted'''
+        return self._matcher.ignored_folder(path)
+
+    @property
+    def _matcher(self):
+        # Rules are only appended while loading, a different length means new rules
+        matcher = getattr(self, '_compiled', None)
+        if matcher is None or matcher.num_rules != len(self):
+            matcher = self._compiled = _Matcher(self)
+        return matcher
+
+
+def _translate(pattern, anchored=True):
+    '''Regex of a fnmatch pattern, without the flags fnmatch appends to it. If not anchored,
+    it matches the strings with any prefix matching the pattern'''
+    regex = fnmatch.translate(os.path.normcase(pattern))
+    if regex.endswith('(?ms)'):
+        regex = regex[:-len('(?ms)')]
+    if not anchored and regex.endswith('\\Z'):
+        regex = regex[:-len('\\Z')]
+    return '(?:%s)' % regex
+
+
+def _literal_prefix(pattern):
+    for index, char in enumerate(pattern):
+        if char in '*?[':
+            return pattern[:index]
+    return pattern
+
+
+class _Matcher(object):
+    '''BiiIgnore rules compiled to regexes. A name is ignored or accepted by the last rule
+    matching it, so consecutive rules of the same kind are joined in a single regex, and
+    checked from the last ones, stopping at the first match'''
+
+    def __init__(self, rules):
+        self.num_rules = len(rules)
+        self._groups = []  # [(regex, accept, folder_check)], last rules first
+        for accept, group in itertools.groupby(reversed(rules), key=lambda rule: rule[1]):
+            patterns = [os.path.normcase(pattern) for pattern, _ in group]
+            regex = re.compile('|'.join(_translate(p) for p in patterns), re.S | re.M)
+            if accept:
+                # Could match files under a folder if its literal prefix is compatible
+                folder_check = [_literal_prefix(p) for p in patterns]
+            else:
+                # Patterns ending in * match every file under a folder, if the rest of the
+                # pattern matches the beginning of its path
+                heads = [_translate(p.rstrip('*'), anchored=False) for p in patterns
+                         if p.endswith('*')]
+                folder_check = re.compile('|'.join(heads), re.S | re.M) if heads else None
+            self._groups.append((regex, accept, folder_check))
+
+    def ignored(self, name):
+        name = os.path.normcase(name)
+        for regex, accept, _ in self._groups:
+            if regex.match(name):
+                return not accept
+        return False
+
+    def ignored_folder(self, path):
+        prefix = os.path.normcase(path.rstrip('/') + '/')
+        for _, accept, folder_check in self._groups:
+            if accept:
+                if any(p.startswith(prefix) or prefix.startswith(p) for p in folder_check):
+                    return False
+            elif folder_check is not None and folder_check.match(prefix):
+                return True
+        return False
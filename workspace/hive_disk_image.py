@@ -9,6 +9,8 @@ from biicode.common.settings.settings import Settings
 from biicode.client.workspace.bii_paths import (BiiPaths, DEP_DIR, BIN_DIR, BUILD_DIR, CMAKE_DIR,
                                                 LIB_DIR, BII_DIR, SRC_DIR)
 from biicode.client.workspace.walk_block import walk_bii_folder, walk_anonymous_block
+from biicode.client.workspace.scan_manifest import ScanManifest
+from biicode.client.conf import BII_SCAN_MANIFEST
 import fnmatch
 from biicode.common.model.brl.block_name import BlockName
 from biicode.common.edition.bii_config import BiiConfig
@@ -165,7 +167,8 @@ class HiveDiskImage(object):
         """
         #scan regular block folder
         bii_ignore = self._user_cache.bii_ignore
-        result = walk_bii_folder(self._bii_paths.blocks, bii_ignore, self._biiout)
+        manifest = ScanManifest(self.hivedb) if BII_SCAN_MANIFEST else None
+        result = walk_bii_folder(self._bii_paths.blocks, bii_ignore, self._biiout, manifest)
 
         # check if the project root has to be scanned
         self.update_root_block()
@@ -179,8 +182,12 @@ class HiveDiskImage(object):
                 self._biiout.warn("Skipping %s block, it already exist in project root"
                                   % project_block)
             result = result_filter
-            anon = walk_anonymous_block(self._bii_paths, bii_ignore, self._biiout, project_block)
+            anon = walk_anonymous_block(self._bii_paths, bii_ignore, self._biiout, project_block,
+                                        manifest)
             result.update(anon)
+        if manifest is not None:
+            manifest.save()
+            self._biiout.debug("Project scan: %s" % manifest)
         return result
 
     def clean_hooks(self):
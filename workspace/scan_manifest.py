@@ -0,0 +1,90 @@
+'''
+Manifest of the files read in the last scan of the project: for each path, its stat
+(size, mtime, inode) and its content, compressed, stored in .hive.db. Files whose stat
+didn't change are not read from disk again, their content is taken from the manifest.
+
+Like git index, files modified right before the scan (RACY_TIME) are not stored, as they
+could be modified again in the same mtime without changing their stat.
+'''
+import hashlib
+import os
+import threading
+import time
+import zlib
+from biicode.common.utils.bii_logging import logger
+
+RACY_TIME = 2  # seconds, covers filesystems with low mtime resolution
+
+
+def _stat_key(path):
+    st = os.stat(path)  # Follows symlinks, like reading the file
+    return st.st_size, int(st.st_mtime * 1000000000), st.st_ino
+
+
+class ScanManifest(object):
+
+    def __init__(self, hivedb):
+        self._hivedb = hivedb
+        self._start = time.time()
+        try:
+            self._entries = hivedb.read_scan_manifest()
+        except Exception as e:  # Corrupted or other format, full scan
+            logger.debug("Could not read scan manifest: %s" % e)
+            self._entries = {}
+        self._changed = []  # Rows to store
+        self._stale = []  # Stored rows not valid anymore
+        self._scanned = set()
+        self.reads = 0  # Files read from disk, for stats
+        self._lock = threading.Lock()  # Files can be read from several threads
+
+    def read(self, path):
+        '''Returns the content of the file in path, reading it only if its stat changed.
+        Raises IOError or OSError like reading it. Thread-safe'''
+        stat_key = _stat_key(path)
+        with self._lock:
+            self._scanned.add(path)
+        entry = self._entries.get(path)
+        if entry is not None and tuple(entry[:3]) == stat_key:
+            content = self._decode(path, entry)
+            if content is not None:
+                return content
+        with open(path, 'rb') as handle:
+            content = handle.read()
+        if stat_key[1] < (self._start - RACY_TIME) * 1000000000 and stat_key == _stat_key(path):
+            row = (path, ) + stat_key + (hashlib.sha1(content).hexdigest(),
+                                         zlib.compress(content))
+        else:  # Modified recently or while reading, its stat is not reliable
+            row = None
+        with self._lock:
+            self.reads += 1
+            if row is not None:
+                self._changed.append(row)
+            elif path in self._entries:
+                self._stale.append(path)
+        return content
+
+    @staticmethod
+    def _decode(path, entry):
+        try:
+            content = zlib.decompress(entry[4])
+        except zlib.error as e:
+            logger.debug("Corrupted scan manifest entry %s: %s" % (path, e))
+            return None
+        if hashlib.sha1(content).hexdigest() != entry[3]:
+            logger.debug("Corrupted scan manifest entry %s" % path)
+            return None
+        return content
+
+    def save(self):
+        '''Stores the files read from disk, and removes the ones not scanned anymore'''
+        deleted = [path for path in self._entries if path not in self._scanned]
+        deleted.extend(self._stale)
+        if not self._changed and not deleted:
+            return
+        try:
+            self._hivedb.update_scan_manifest(self._changed, deleted)
+        except Exception as e:  # Next scan will read them from disk
+            logger.debug("Could not store scan manifest: %s" % e)
+
+    def __str__(self):
+        return '%d files scanned, %d read from disk' % (len(self._scanned), self.reads)
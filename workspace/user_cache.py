@@ -2,6 +2,8 @@ import os
 from biicode.common.utils.file_utils import save, load
 from biicode.client.store.localdb import LocalDB
 from biicode.common.find.policy import default_policies
+from biicode.client.conf import (BII_CACHE_MAX_SIZE, BII_CACHE_EVICTION_TIME,
+                                 BII_CACHE_VACUUM_PAGES)
 
 
 _simple_layout = """ # Minimal layout, with all auxiliary folders inside "bii" and
@@ -37,6 +39,7 @@ class UserCache(object):
         self._folder = folder
         self._username = None
         self._localdb = None
+        self._shared_localdb = None
 
     @property
     def folder(self):
@@ -74,6 +77,18 @@ class UserCache(object):
             self._localdb = LocalDB(path)
         return self._localdb
 
+    def shared_localdb(self, folder):
+        '''return instance of LocalDB of the cache shared in folder'''
+        if self._shared_localdb is None:
+            path = os.path.join(folder, 'bii.db')
+            # Team members without write permission only read it
+            read_only = not os.access(path if os.path.exists(path) else folder, os.W_OK)
+            # WAL needs shared memory, not available in network filesystems. It is never
+            # evicted, access times are not needed
+            self._shared_localdb = LocalDB(path, journal_mode='DELETE', read_only=read_only,
+                                           track_access=False)
+        return self._shared_localdb
+
     @property
     def username(self):
         if self._username is None:
@@ -98,7 +113,22 @@ class UserCache(object):
             save(path, default_policies)
         return current_defaults
 
+    def evict(self):
+        '''Stores the access times of the block versions used by the command, and keeps the
+        local cache size bounded. Only done if the cache was used by the command, not to
+        open it just for that'''
+        if self._localdb is None:
+            return
+        if BII_CACHE_MAX_SIZE:
+            self._localdb.evict(BII_CACHE_MAX_SIZE, BII_CACHE_EVICTION_TIME,
+                                BII_CACHE_VACUUM_PAGES)
+        else:
+            self._localdb.store_access()
+
     def close(self):
         if self._localdb is not None:
             self._localdb.disconnect()
             self._localdb = None
+        if self._shared_localdb is not None:
+            self._shared_localdb.disconnect()
+            self._shared_localdb = None
@@ -1,5 +1,8 @@
 from biicode.common.utils import file_utils
 import os
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from biicode.client.conf import BII_WALK_THREADS
 from biicode.client.workspace.bii_ignore import BiiIgnore
 from biicode.common.model.brl.block_cell_name import BlockCellName
 from biicode.common.exception import InvalidNameException
@@ -7,9 +10,14 @@ from biicode.client.workspace.bii_paths import (BII_DIR, BIN_DIR, BUILD_DIR, CMA
                                                 LIB_DIR, SRC_DIR)
 
 
-def walk_anonymous_block(bii_paths, bii_ignore, biiout, block_name):
+def walk_anonymous_block(bii_paths, bii_ignore, biiout, block_name, manifest=None):
+    with _FileReader(biiout, manifest) as reader:
+        _walk_anonymous_block(bii_paths, bii_ignore, reader, block_name)
+        return reader.results()
+
+
+def _walk_anonymous_block(bii_paths, bii_ignore, reader, block_name):
     base_path = bii_paths.project_root
-    result = {}
     bii_ignores = {}  # {folder: current bii_ignore}
 
     dir_skip = [bii_paths.get_by_name(d)
@@ -21,7 +29,7 @@ def walk_anonymous_block(bii_paths, bii_ignore, biiout, block_name):
         to_keep = []
         for dir_name in directories:
             if "\\" in dir_name:
-                biiout.warn('Invalid character "\\" on \'%s\' directory!' % dir_name)
+                reader.warn('Invalid character "\\" on \'%s\' directory!' % dir_name)
             full_dir = os.path.join(root, dir_name)
             if full_dir not in dir_skip:
                 to_keep.append(dir_name)
@@ -29,13 +37,15 @@ def walk_anonymous_block(bii_paths, bii_ignore, biiout, block_name):
         split_rel_path = relative_path.split(os.sep)
         subfolder = '/'.join(split_rel_path[2:])
         current_bii_ignore = _get_filters(bii_ignore, bii_ignores, root, files, subfolder)
+        root_folder = '' if relative_path == os.curdir else relative_path.replace('\\', '/')
+        _prune(root, directories, current_bii_ignore, root_folder)
 
         for file_name_ in files:
             #file_, _ = os.path.splitext(file_name_)
             _, tail = os.path.split(file_name_)  # Tail is filename without extension
 
             if "\\" in tail:
-                biiout.warn("Invalid character \"\\\" on file '%s'. "
+                reader.warn("Invalid character \"\\\" on file '%s'. "
                             "This file will be ignored!" % file_name_)
                 continue
 
@@ -46,36 +56,36 @@ def walk_anonymous_block(bii_paths, bii_ignore, biiout, block_name):
                 name = relative_name.replace('\\', '/')
                 ignored = current_bii_ignore.ignored(name)
                 if not ignored:
-                    biiout.warn('%s. This file will be ignored\n' % e.message)
+                    reader.warn('%s. This file will be ignored\n' % e.message)
             else:
                 ignored = current_bii_ignore.ignored(cell_name.cell_name)
                 if ignored:
                     continue
 
                 full_path = os.path.join(root, file_name_)
-
-                try:
-                    with open(full_path, 'rb') as handle:
-                        content = handle.read()
-                    result[cell_name] = content
-                except IOError as e:
-                    biiout.warn('Error reading "{}" file. Skipping'.format(file_name_))
-                    continue
-
-    return result
+                reader.read(cell_name, full_path, file_name_)
 
 
-def walk_bii_folder(folder, bii_ignore, biiout):
+def walk_bii_folder(folder, bii_ignore, biiout, manifest=None):
     """
     Parameters:
         folder: Absolute folder path
         ui: UserIO
         bii_ignore: Filefilter
+        manifest: ScanManifest to avoid reading unchanged files, or None
     Returns:
         dict {BlockCellName:(bytes or str}, of accepted files.
     """
+    with _FileReader(biiout, manifest) as reader:
+        _walk_bii_folder(folder, bii_ignore, reader)
+        result = reader.results()
+
+    if not result and not folder.endswith('deps'):
+        biiout.debug('No valid files found in %s' % folder)
+    return result
+
 
-    result = {}
+def _walk_bii_folder(folder, bii_ignore, reader):
     bii_ignores = {}  # {folder: current bii_ignore}
 
     #FIXME: Output msgs to user
@@ -84,7 +94,7 @@ def walk_bii_folder(folder, bii_ignore, biiout):
         # Alert for directories with \ char in the name
         for dir_name in directories:
             if "\\" in dir_name:
-                biiout.warn('Invalid character "\\" on \'%s\' directory!' % dir_name)
+                reader.warn('Invalid character "\\" on \'%s\' directory!' % dir_name)
 
         #Discard all the files in the upper folders
         split_rel_path = relative_path.split(os.sep)
@@ -96,19 +106,20 @@ def walk_bii_folder(folder, bii_ignore, biiout):
                 relative_name = os.path.relpath(full_path, folder).replace('\\', '/')
                 ignored = bii_ignore.ignored(relative_name)
                 if not ignored:
-                    biiout.warn('%s is misplaced, you should place it inside blocks folder. '
-                                 'It will be ignored\n' % relative_name)
+                    reader.warn('%s is misplaced, you should place it inside blocks folder. '
+                                'It will be ignored\n' % relative_name)
             continue
         else:
             subfolder = '/'.join(split_rel_path[2:])
         current_bii_ignore = _get_filters(bii_ignore, bii_ignores, root, files, subfolder)
+        _prune(root, directories, current_bii_ignore, subfolder)
 
         for file_name_ in files:
             #file_, _ = os.path.splitext(file_name_)
             _, tail = os.path.split(file_name_)  # Tail is filename without extension
 
             if "\\" in tail:
-                biiout.warn("Invalid character \"\\\" on file '%s'. "
+                reader.warn("Invalid character \"\\\" on file '%s'. "
                             "This file will be ignored!" % file_name_)
                 continue
 
@@ -123,24 +134,40 @@ def walk_bii_folder(folder, bii_ignore, biiout):
                 except:
                     ignored = False
                 if not ignored:
-                    biiout.warn('%s. This file will be ignored\n' % e.message)
+                    reader.warn('%s. This file will be ignored\n' % e.message)
                 continue
 
             ignored = current_bii_ignore.ignored(cell_name.cell_name)
             if ignored:
                 continue
 
-            try:
-                with open(full_path, 'rb') as handle:
-                    content = handle.read()
-                    result[cell_name] = content
-            except IOError:  # Crashes when try to read a dead symbolic link
-                biiout.warn('Error reading "{}" file. Skipping'.format(file_name_))
-                continue
+            reader.read(cell_name, full_path, file_name_)
 
-    if not result and not folder.endswith('deps'):
-        biiout.debug('No valid files found in %s' % folder)
-    return result
+
+def _prune(root, directories, bii_ignore, folder):
+    '''Removes from os.walk directories the ones whose files would all be ignored, like
+    .git, so they are not walked. folder is their parent, relative to the block root.
+    Directories with an ignore.bii anywhere below them are walked, as it can accept some
+    of their files'''
+    directories[:] = [d for d in directories
+                      if not bii_ignore.ignored_folder('%s/%s' % (folder, d) if folder else d)
+                      or _has_ignore_bii(os.path.join(root, d))]
+
+
+def _has_ignore_bii(folder):
+    '''True if folder or any of its subfolders has an ignore.bii. Just lists folders, without
+    filtering their files, which is the slow part of walking them'''
+    for _, _, files in os.walk(folder, followlinks=True):
+        if 'ignore.bii' in files:
+            return True
+    return False
+
+
+def _read(path, manifest):
+    if manifest is not None:
+        return manifest.read(path)
+    with open(path, 'rb') as handle:
+        return handle.read()
 
 
 def _get_filters(bii_ignore, bii_ignores, root, files, subfolder):
@@ -154,3 +181,67 @@ def _get_filters(bii_ignore, bii_ignores, root, files, subfolder):
         current_bii_ignore = current_bii_ignore + BiiIgnore.loads(ignorebii, subfolder)
     bii_ignores[root] = current_bii_ignore
     return current_bii_ignore
+
+
+class _FileReader(object):
+    '''Reads the walked files in a pool of threads while the walk goes on, as reading is
+    slow in network filesystems or cold caches. Results and warnings are output in the
+    same order as if files were read one by one during the walk
+    '''
+
+    def __init__(self, biiout, manifest):
+        self._biiout = biiout
+        self._manifest = manifest
+        self._threads = BII_WALK_THREADS
+        self._pool = None  # Created with the first file, many walks find no files
+        self._pending = deque()  # [(cell_name, file_name, AsyncResult) or warning message]
+        self._result = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._pool is not None:
+            if exc_type is None:
+                self._pool.close()
+            else:
+                self._pool.terminate()
+            self._pool.join()
+
+    def warn(self, message):
+        if self._pending:  # After the pending files
+            self._pending.append(message)
+        else:
+            self._biiout.warn(message)
+
+    def read(self, cell_name, path, file_name):
+        if self._threads < 2:
+            self._store(cell_name, file_name, lambda: _read(path, self._manifest))
+            return
+        if self._pool is None:
+            self._pool = ThreadPool(self._threads)
+        self._pending.append((cell_name, file_name,
+                              self._pool.apply_async(_read, (path, self._manifest))))
+        # Bounded number of files read ahead of the walk, and contents held in memory
+        while len(self._pending) > self._threads * 4:
+            self._process_next()
+
+    def _process_next(self):
+        pending = self._pending.popleft()
+        if isinstance(pending, basestring):
+            self._biiout.warn(pending)
+        else:
+            cell_name, file_name, async_result = pending
+            self._store(cell_name, file_name, async_result.get)
+
+    def _store(self, cell_name, file_name, read):
+        try:
+            self._result[cell_name] = read()
+        except (IOError, OSError):  # Crashes when try to read a dead symbolic link
+            self._biiout.warn('Error reading "{}" file. Skipping'.format(file_name))
+
+    def results(self):
+        '''Waits for all the files, returns {BlockCellName: content}'''
+        while self._pending:
+            self._process_next()
+        return self._result
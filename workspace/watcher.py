@@ -0,0 +1,119 @@
+'''
+Watchers of the files of a project, reporting the ones changed since the last check. Linux
+inotify is used if pyinotify is installed, else the stat of the files is polled
+'''
+import os
+from biicode.common.utils.bii_logging import logger
+
+
+class _Watched(object):
+    '''Folders to watch. Each folder is (path, depth), files of cells are depth folders
+    below it (2 for blocks, user/block). Subfolders ignored by bii_ignore and skip ones
+    are not watched. Files of config_folder (bii/settings.bii...) are watched too
+    '''
+
+    def __init__(self, folders, skip, bii_ignore, config_folder):
+        self.folders = folders
+        self.skip = set(os.path.normpath(path) for path in skip)
+        self.bii_ignore = bii_ignore
+        self.config_folder = config_folder
+
+    def ignored_folder(self, folder, path):
+        if os.path.normpath(path) in self.skip:
+            return True
+        base, depth = folder
+        names = os.path.relpath(path, base).split(os.sep)
+        return len(names) > depth and self.bii_ignore.ignored_folder('/'.join(names[depth:]))
+
+    def is_config(self, path):
+        return os.path.dirname(path) == self.config_folder and path.endswith('.bii')
+
+
+class PollingWatcher(_Watched):
+    '''Compares the stat of all the watched files with the ones of the previous check'''
+
+    def __init__(self, folders, skip, bii_ignore, config_folder):
+        super(PollingWatcher, self).__init__(folders, skip, bii_ignore, config_folder)
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        paths = [os.path.join(self.config_folder, name)
+                 for name in os.listdir(self.config_folder) if name.endswith('.bii')]
+        for folder in self.folders:
+            for root, directories, files in os.walk(folder[0], followlinks=True):
+                directories[:] = [d for d in directories
+                                  if not self.ignored_folder(folder, os.path.join(root, d))]
+                paths.extend(os.path.join(root, name) for name in files)
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:  # Removed while walking, or dead link
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime, st.st_ino)
+        return snapshot
+
+    def changes(self):
+        '''Returns the set of paths created, modified or removed since the last call'''
+        snapshot = self._scan()
+        changed = set(path for path, stat in snapshot.iteritems()
+                      if self._snapshot.get(path) != stat)
+        changed.update(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(_Watched):
+    '''Receives the changes from Linux inotify, without walking the folders'''
+
+    def __init__(self, folders, skip, bii_ignore, config_folder):
+        import pyinotify  # Optional dependency, raises ImportError if not installed
+        super(InotifyWatcher, self).__init__(folders, skip, bii_ignore, config_folder)
+        self._changed = set()
+        self._manager = pyinotify.WatchManager()
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO | pyinotify.IN_ATTRIB)
+        self._notifier = pyinotify.Notifier(self._manager, self._event, timeout=0)
+        try:
+            for folder in folders:
+                exclude = lambda path, folder=folder: (path != folder[0] and
+                                                       self.ignored_folder(folder, path))
+                self._add(folder[0], mask, rec=True, auto_add=True, exclude_filter=exclude)
+            self._add(config_folder, mask)
+        except:
+            self.close()
+            raise
+
+    def _add(self, path, mask, **kwargs):
+        for watched, descriptor in self._manager.add_watch(path, mask, **kwargs).iteritems():
+            if descriptor < 0:  # e.g. max_user_watches reached, it would miss changes
+                raise OSError('Could not watch %s' % watched)
+
+    def _event(self, event):
+        if os.path.dirname(event.pathname) == self.config_folder and \
+                not self.is_config(event.pathname):
+            return  # .hive.db and other files written by bii
+        self._changed.add(event.pathname)
+
+    def changes(self):
+        '''Returns the set of paths created, modified or removed since the last call'''
+        while self._notifier.check_events():
+            self._notifier.read_events()
+            self._notifier.process_events()
+        changed, self._changed = self._changed, set()
+        return changed
+
+    def close(self):
+        self._notifier.stop()
+
+
+def create_watcher(folders, skip, bii_ignore, config_folder):
+    '''Watcher of folders, a list of (path, depth). See _Watched'''
+    try:
+        return InotifyWatcher(folders, skip, bii_ignore, config_folder)
+    except Exception as e:  # Not installed, not Linux, or out of inotify watches
+        logger.debug('Not using inotify, polling changes of files: %s' % e)
+        return PollingWatcher(folders, skip, bii_ignore, config_folder)